@@ -4,18 +4,45 @@ import torch.nn.functional as F
 from torch_geometric.nn import GCNConv
 from torch_geometric.nn import global_mean_pool
 
+from episode_buffer import batch_graphs
+
 class ActorCritic(nn.Module):
-    def __init__(self, input_dim, num_gnn_layers, units_per_gnn_layer, num_lstm_layers, units_per_lstm_layer, actor_output_dim, critic_output_dim):
+    # Politique récurrente pour EpisodeBuffer.fill : np_pass(states, hidden), initial_state et reset_state
+    recurrent = True
+
+    def __init__(self, input_dim, num_gnn_layers, units_per_gnn_layer, num_lstm_layers, units_per_lstm_layer, actor_output_dim, critic_output_dim, sequence_dim=None, edge_index=None):
+        """
+        Actor-critic récurrent sur graphe. Le graphe de chaque état est plongé une seule fois
+        par le tronc GNN partagé, le plongement est concaténé aux observations séquentielles
+        en entrée des LSTM partagés, puis les LSTM et têtes de l'actor et du critic donnent
+        les probabilités d'action et la valeur d'état dans la même passe.
+
+        Args:
+            input_dim (int): Nombre de caractéristiques des nœuds.
+            num_gnn_layers (int): Nombre de couches GCN du tronc partagé.
+            units_per_gnn_layer (int): Taille des couches GCN et du plongement du graphe.
+            num_lstm_layers (int): Nombre total de couches LSTM, la moitié dans chaque étage.
+            units_per_lstm_layer (int): Taille des états des LSTM.
+            actor_output_dim (int): Nombre d'actions.
+            critic_output_dim (int): Nombre de valeurs estimées.
+            sequence_dim (int): Nombre de caractéristiques des observations séquentielles, input_dim si None.
+            edge_index (torch.Tensor): Topologie commune des graphes des états donnés sous forme de
+                caractéristiques des nœuds (np_pass), nécessaire pour le rollout avec EpisodeBuffer.fill.
+        """
         super(ActorCritic, self).__init__()
+        self.edge_index = edge_index
+        self._graph_index = {}
 
-        # Définir les couches de GNN pour l'actor
-        self.actor_convs = nn.ModuleList()
+        # Tronc GNN partagé par l'actor et le critic
+        self.shared_convs = nn.ModuleList()
         for i in range(num_gnn_layers):
             in_channels = input_dim if i == 0 else units_per_gnn_layer
-            self.actor_convs.append(GCNConv(in_channels, units_per_gnn_layer))
+            self.shared_convs.append(GCNConv(in_channels, units_per_gnn_layer))
+        self.embedding_dim = units_per_gnn_layer if num_gnn_layers else input_dim
+        self.sequence_dim = input_dim if sequence_dim is None else sequence_dim
 
-        # Couches LSTM partagées
-        self.shared_lstm = nn.LSTM(input_size=input_dim, hidden_size=units_per_lstm_layer, num_layers=num_lstm_layers // 2, batch_first=True)
+        # Couches LSTM partagées, sur le plongement du graphe et l'observation séquentielle
+        self.shared_lstm = nn.LSTM(input_size=self.embedding_dim + self.sequence_dim, hidden_size=units_per_lstm_layer, num_layers=num_lstm_layers // 2, batch_first=True)
 
         # Couches LSTM séparées pour l'actor
         self.actor_lstm = nn.LSTM(input_size=units_per_lstm_layer, hidden_size=units_per_lstm_layer, num_layers=num_lstm_layers // 2, batch_first=True)
@@ -27,44 +54,204 @@ class ActorCritic(nn.Module):
         self.actor_head = nn.Linear(units_per_lstm_layer, actor_output_dim)
         self.critic_head = nn.Linear(units_per_lstm_layer, critic_output_dim)
 
-    def forward(self, graph_data, sequence_data):
+    def forward(self, graph_data, sequence_data, state=None, lengths=None):
+        """
+        Args:
+            graph_data (Data): Graphes avec x, edge_index et batch : un graphe par séquence, commun à
+                tous ses pas, ou un graphe par pas (batch * temps graphes, séquence par séquence).
+            sequence_data (torch.Tensor): Séquences d'observations, de forme (batch, temps, sequence_dim).
+            state (tuple): État récurrent (h, c) au début des séquences, voir initial_state. Nul si None.
+            lengths (torch.Tensor): Longueur de chaque séquence complétée à droite, les sorties sont
+                prises au dernier pas de chaque séquence. Toute la séquence si None.
+
+        Returns:
+            tuple: Probabilités d'action et valeurs d'état.
+        """
+        action_probs, state_value, _ = self._forward(graph_data, sequence_data, state, lengths)
+        return action_probs, state_value
+
+    def step(self, graph_data, observation, state=None):
+        """
+        Pas de rollout incrémental : seule la dernière observation passe dans les LSTM, repris
+        à l'état récurrent du pas précédent, pour un coût par pas indépendant de l'historique.
+
+        Args:
+            graph_data (Data): Graphe de chaque environnement, avec x, edge_index et batch.
+            observation (torch.Tensor): Dernière observation de chaque environnement, de forme (batch, sequence_dim).
+            state (tuple): État récurrent (h, c) renvoyé par le pas précédent, nul si None.
+
+        Returns:
+            tuple: Probabilités d'action, valeurs d'état et nouvel état récurrent.
+        """
+        return self._forward(graph_data, observation[:, None, :], state)
+
+    def act(self, graph_data, observation, state=None, greedy=False):
+        """
+        Pas de rollout : actions, log-probabilités et valeurs d'une seule passe du modèle.
+
+        Args:
+            graph_data (Data): Graphe de chaque environnement.
+            observation (torch.Tensor): Dernière observation de chaque environnement, de forme (batch, sequence_dim).
+            state (tuple): État récurrent renvoyé par le pas précédent, nul si None.
+            greedy (bool): Prendre l'action la plus probable au lieu de l'échantillonner.
+
+        Returns:
+            tuple: Actions, log-probabilités, actions exploratoires (différentes de la plus probable),
+                valeurs d'état et nouvel état récurrent.
+        """
+        action_probs, state_value, state = self.step(graph_data, observation, state)
+        distribution = torch.distributions.Categorical(probs=action_probs)
+        best = action_probs.argmax(dim=-1)
+        actions = best if greedy else distribution.sample()
+        return actions, distribution.log_prob(actions), actions != best, state_value.squeeze(-1), state
+
+    def evaluate(self, graph_data, sequence_data, actions, state=None, lengths=None):
+        """
+        Passe d'apprentissage : log-probabilités et entropies des actions et valeurs d'état,
+        calculées ensemble. Mêmes arguments que forward, plus les actions prises.
+
+        Returns:
+            tuple: Log-probabilités, entropies et valeurs d'état.
+        """
+        action_probs, state_value, _ = self._forward(graph_data, sequence_data, state, lengths)
+        distribution = torch.distributions.Categorical(probs=action_probs)
+        return distribution.log_prob(actions), distribution.entropy(), state_value.squeeze(-1)
+
+    def embed_graph(self, graph_data):
+        """Plongement de chaque graphe par le tronc GNN partagé, de forme (nombre de graphes, embedding_dim)."""
         x, edge_index, batch = graph_data.x, graph_data.edge_index, graph_data.batch
-        
-        # Passer les données de graphe à travers les GNN
-        for conv in self.actor_convs:
+        for conv in self.shared_convs:
             x = F.relu(conv(x, edge_index))
-        x = global_mean_pool(x, batch)  # Réduire les caractéristiques des nœuds à des caractéristiques de graphe
+        return global_mean_pool(x, batch)  # Réduire les caractéristiques des nœuds à des caractéristiques de graphe
+
+    def graphs(self, states):
+        """
+        Graphes des états donnés par les caractéristiques de leurs nœuds, de forme (batch, num_nodes,
+        input_dim), avec la topologie edge_index du modèle.
+        """
+        if self.edge_index is None:
+            raise ValueError("ActorCritic needs an edge_index to build graphs from node features.")
+        states = torch.as_tensor(states, dtype=torch.float32, device=self.device)
+        edge_index = self.edge_index.to(self.device)
+        if edge_index is not self.edge_index:
+            self.edge_index, self._graph_index = edge_index, {}
+        return batch_graphs(states, self.edge_index, self._graph_index)
+
+    def np_pass(self, states, hidden):
+        """
+        Pas de rollout de EpisodeBuffer.fill, sur les caractéristiques des nœuds stockées par le buffer.
+        Le buffer ne stocke pas d'observations séquentielles, elles sont nulles.
+
+        Args:
+            states (np.ndarray): Caractéristiques des nœuds de chaque environnement, de forme (batch, num_nodes, input_dim).
+            hidden (tuple): État récurrent renvoyé par le pas précédent, voir initial_state.
+
+        Returns:
+            tuple: Actions, log-probabilités et actions exploratoires (tableaux NumPy), valeurs d'état et nouvel état récurrent.
+        """
+        graph_data = self.graphs(states)
+        observation = graph_data.x.new_zeros((graph_data.num_graphs, self.sequence_dim))
+        actions, logpas, exploratory, values, hidden = self.act(graph_data, observation, hidden)
+        return actions.cpu().numpy(), logpas.cpu().numpy(), exploratory.cpu().numpy(), values, hidden
+
+    def get_predictions(self, states, actions, state=None, lengths=None):
+        """
+        Passe d'apprentissage de optimize_shared_model sur les minibatches du buffer, sans
+        observations séquentielles : log-probabilités, entropies et valeurs d'état.
+
+        Args:
+            states (Batch or torch.Tensor): Graphes des pas (EpisodeBuffer.sample), ou caractéristiques
+                des nœuds de forme (batch, num_nodes, input_dim) ou (batch, temps, num_nodes, input_dim).
+            actions (torch.Tensor): Actions prises, de forme (batch,).
+            state (tuple): État récurrent au début des séquences, nul si None.
+            lengths (torch.Tensor): Longueur de chaque séquence, voir forward.
+
+        Returns:
+            tuple: Log-probabilités, entropies et valeurs d'état.
+        """
+        if isinstance(states, torch.Tensor):
+            states = self.graphs(states.reshape((-1,) + states.shape[-2:]))
+        num_steps = states.num_graphs // len(actions)
+        sequence_data = states.x.new_zeros((len(actions), num_steps, self.sequence_dim))
+        return self.evaluate(states, sequence_data, actions, state, lengths)
+
+    @property
+    def device(self):
+        return self.actor_head.weight.device
+
+    def initial_state(self, batch_size, device=None):
+        """
+        État récurrent nul de batch_size séquences.
+
+        Les états (h, c) des LSTM partagés, de l'actor et du critic sont concaténés sur la
+        dimension des couches, h et c sont de forme (3 * num_layers, batch_size, hidden_size).
+        """
+        lstm = self.shared_lstm
+        h = torch.zeros(3 * lstm.num_layers, batch_size, lstm.hidden_size, device=self.device if device is None else device)
+        return h, torch.zeros_like(h)
+
+    @staticmethod
+    def reset_state(state, done):
+        """État récurrent avec les séquences terminées (masque booléen done de forme (batch,)) remises à zéro."""
+        keep = (~torch.as_tensor(done, dtype=torch.bool, device=state[0].device)).to(state[0].dtype)[None, :, None]
+        return state[0] * keep, state[1] * keep
+
+    def _forward(self, graph_data, sequence_data, state, lengths=None):
+        # Plonger les graphes une seule fois pour l'actor et le critic
+        batch_size, num_steps = sequence_data.shape[:2]
+        embedding = self.embed_graph(graph_data)
+        if embedding.size(0) == batch_size * num_steps:
+            embedding = embedding.view(batch_size, num_steps, -1)
+        else:
+            embedding = embedding[:, None, :].expand(batch_size, num_steps, -1)
+        sequence_data = torch.cat([embedding, sequence_data], dim=-1)
+
+        if state is None:
+            state = self.initial_state(sequence_data.size(0), sequence_data.device)
+        h, c = state
+        shared_state, actor_state, critic_state = zip(h.chunk(3), c.chunk(3))
 
         # Passer les données séquentielles à travers les LSTM partagés
-        shared_lstm_out, _ = self.shared_lstm(sequence_data)
+        shared_lstm_out, shared_state = self.shared_lstm(sequence_data, shared_state)
         
         # Passer la sortie des LSTM partagés aux LSTM spécifiques à l'actor
-        actor_lstm_out, _ = self.actor_lstm(shared_lstm_out)
+        actor_lstm_out, actor_state = self.actor_lstm(shared_lstm_out, actor_state)
         
         # Passer la sortie des LSTM partagés aux LSTM spécifiques au critic
-        critic_lstm_out, _ = self.critic_lstm(shared_lstm_out)
+        critic_lstm_out, critic_state = self.critic_lstm(shared_lstm_out, critic_state)
+
+        # Sorties au dernier pas de chaque séquence
+        if lengths is None:
+            actor_last, critic_last = actor_lstm_out[:, -1, :], critic_lstm_out[:, -1, :]
+        else:
+            rows = torch.arange(sequence_data.size(0), device=sequence_data.device)
+            last = torch.as_tensor(lengths, device=sequence_data.device) - 1
+            actor_last, critic_last = actor_lstm_out[rows, last], critic_lstm_out[rows, last]
 
         # Générer des probabilités d'action et des valeurs d'état
-        action_probs = F.softmax(self.actor_head(actor_lstm_out[:, -1, :]), dim=-1)
-        state_value = self.critic_head(critic_lstm_out[:, -1, :])
+        action_probs = F.softmax(self.actor_head(actor_last), dim=-1)
+        state_value = self.critic_head(critic_last)
 
-        return action_probs, state_value
+        state = (torch.cat([shared_state[0], actor_state[0], critic_state[0]]), torch.cat([shared_state[1], actor_state[1], critic_state[1]]))
+        return action_probs, state_value, state
 
-# Paramètres de l'architecture
-input_dim = 10
-num_gnn_layers = 2
-units_per_gnn_layer = 16
-num_lstm_layers = 4
-units_per_lstm_layer = 32
-actor_output_dim = 4
-critic_output_dim = 1
+# Exemple d'utilisation
+if __name__ == "__main__":
+    # Paramètres de l'architecture
+    input_dim = 10
+    num_gnn_layers = 2
+    units_per_gnn_layer = 16
+    num_lstm_layers = 4
+    units_per_lstm_layer = 32
+    actor_output_dim = 4
+    critic_output_dim = 1
 
-# Créer le modèle
-model = ActorCritic(input_dim, num_gnn_layers, units_per_gnn_layer, num_lstm_layers, units_per_lstm_layer, actor_output_dim, critic_output_dim)
+    # Créer le modèle
+    model = ActorCritic(input_dim, num_gnn_layers, units_per_gnn_layer, num_lstm_layers, units_per_lstm_layer, actor_output_dim, critic_output_dim)
 
-# Données factices (remplacer par des données réelles adaptées)
-graph_data = type('GraphData', (object,), {'x': torch.rand(10, input_dim), 'edge_index': torch.tensor([[0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]]), 'batch': torch.tensor([0, 0, 0, 0, 0, 0, 0, 0, 0, 0])})
-sequence_data = torch.rand(1, 5, input_dim)  # Taille de lot de 1, longueur de séquence de 5
+    # Données factices (remplacer par des données réelles adaptées)
+    graph_data = type('GraphData', (object,), {'x': torch.rand(10, input_dim), 'edge_index': torch.tensor([[0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]]), 'batch': torch.tensor([0, 0, 0, 0, 0, 0, 0, 0, 0, 0])})
+    sequence_data = torch.rand(1, 5, input_dim)  # Taille de lot de 1, longueur de séquence de 5
 
-# Passer les données à travers le modèle
-action_probs, state_value = model(graph_data, sequence_data)
+    # Passer les données à travers le modèle
+    action_probs, state_value = model(graph_data, sequence_data)
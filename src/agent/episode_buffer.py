@@ -1,68 +1,293 @@
-import numpy as np
+import queue
+import threading
 import time
+from collections import namedtuple
+
+import numpy as np
 import torch
+from scipy.signal import lfilter
+from torch_geometric.data import Batch
+
+# Steps sampled from an EpisodeBuffer, states being a PyG Batch or a (batch_size, num_nodes, num_node_features) tensor
+Minibatch = namedtuple("Minibatch", ["states", "actions", "logpas", "values", "returns", "gaes"])
+
+# Steps sampled with the window of states leading to them, for recurrent models: states is a
+# (batch_size, sequence_length, ...) tensor padded after the last step of each window, hidden the
+# recurrent state (h, c) at the start of the windows and lengths the number of steps of each window
+SequenceMinibatch = namedtuple("SequenceMinibatch", Minibatch._fields + ("hidden", "lengths"))
+
+
+def discounted_cumsum(x, discount):
+    """
+    Reverse discounted cumulative sum along the last axis, y[t] = x[t] + discount * y[t + 1].
+
+    The scan runs in a single linear filter pass over the time-reversed rows, O(T) per row
+    instead of one dot product per step. Rows of different lengths can be batched by padding
+    them with zeros at the end, the padding does not change the sums of the steps before it.
+
+    Args:
+        x (np.ndarray): Values, shape (..., T).
+        discount (float): Discount factor.
+
+    Returns:
+        np.ndarray: Discounted sums, same shape as x.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    return lfilter([1.0], [1.0, -discount], x[..., ::-1], axis=-1)[..., ::-1]
+
+
+def batch_graphs(x, edge_index, cache=None, capacity=None):
+    """
+    PyG Batch of graphs sharing one topology, built without collating Data objects.
+
+    Args:
+        x (torch.Tensor): Node features of the graphs, shape (num_graphs, num_nodes, num_node_features).
+        edge_index (torch.Tensor): Edges of one graph.
+        cache (dict): Batch topology reused across calls with the same edge_index. It holds the
+            topology of the largest batch seen so far (grown by doubling), smaller batches use
+            views of its first graphs, so that its size is bounded by twice the largest batch
+            and the batches of a size share the same edge_index tensor.
+        capacity (int): Number of graphs the cached topology is built for at least, e.g. the maximum
+            batch size, so that it is not grown again.
+
+    Returns:
+        Batch: The graphs, with x, edge_index, batch and ptr.
+    """
+    num_graphs, num_nodes, _ = x.shape
+    num_edges = edge_index.size(1)
+    topology = None if cache is None else cache.get("topology")
+    if topology is None or topology[0] < num_graphs or topology[1] != num_nodes:
+        capacity = max(num_graphs, capacity or 0, 0 if topology is None else 2 * topology[0])
+        offsets = torch.arange(capacity, device=edge_index.device).repeat_interleave(num_edges) * num_nodes
+        batch = torch.arange(capacity, device=edge_index.device).repeat_interleave(num_nodes)
+        topology = (capacity, num_nodes, edge_index.repeat(1, capacity) + offsets, batch, torch.arange(capacity + 1, device=edge_index.device) * num_nodes)
+        if cache is not None:
+            cache["topology"] = topology
+    _, _, batch_edge_index, batch, ptr = topology
+    return Batch(x=x.reshape(num_graphs * num_nodes, -1), edge_index=batch_edge_index[:, :num_graphs * num_edges],
+                 batch=batch[:num_graphs * num_nodes], ptr=ptr[:num_graphs + 1])
+
+
+def prefetch(iterable, size=2):
+    """
+    Iterate over iterable in a background thread, at most size items ahead of the consumer.
+
+    Exceptions raised by the iterable are raised again in the consumer. The thread stops
+    when the consumer stops iterating, even before the end of the iterable.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except BaseException as error:
+            put((None, error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
 
 class EpisodeBuffer():
     def __init__(self, max_episode_steps, max_episodes, discounts, tau_discounts, gamma):
+        """
+        Rollout storage of PPO, filled with whole episodes by fill.
+
+        The steps of the stored episodes are laid out one episode after the other in flat,
+        preallocated tensors of fixed dtype: node features of the states, actions, log
+        probabilities, values, returns and GAEs. Episode e occupies the rows
+        episode_offsets[e]:episode_offsets[e + 1] and the first size rows are in use. The
+        topology of the graph states does not change during a rollout, it is stored once
+        in edge_index.
+
+        With a recurrent policy, the recurrent state it held before each step is stored as
+        well, so that training can replay truncated sequences from any step of an episode.
+
+        Args:
+            max_episode_steps (int): Episodes are truncated after this many steps.
+            max_episodes (int): Maximum number of episodes stored by one fill.
+            discounts (np.ndarray): Successive powers of gamma.
+            tau_discounts (np.ndarray): Successive powers of gamma * tau.
+            gamma (float): Discount factor.
+        """
         # Initialize buffer parameters
         self.max_episode_steps = max_episode_steps
         self.max_episodes = max_episodes
         self.discounts = discounts
         self.tau_discounts = tau_discounts
         self.gamma = gamma
-        
-        # Initialize memory buffers
-        self.states_mem = np.zeros((max_episodes, max_episode_steps), dtype=np.object)
-        self.actions_mem = np.zeros((max_episodes, max_episode_steps), dtype=np.object)
-        self.logpas_mem = np.zeros((max_episodes, max_episode_steps), dtype=np.object)
-        self.returns_mem = np.zeros((max_episodes, max_episode_steps), dtype=np.object)
-        self.gaes_mem = np.zeros((max_episodes, max_episode_steps), dtype=np.object)
-        self.episode_steps = np.zeros(max_episodes, dtype=np.uint16)
+        # Discount of the GAE scan, gamma * tau, tau_discounts being its successive powers
+        self.gae_discount = tau_discounts[1] if len(tau_discounts) > 1 else gamma
+        self.capacity = max_episodes * max_episode_steps
+
+        # Step storage, allocated by the first fill once the shapes of states and actions are known
+        self.states_mem = None
+        self.actions_mem = None
+        self.logpas_mem = None
+        self.values_mem = None
+        self.returns_mem = None
+        self.gaes_mem = None
+        self.hidden_mem = None
+        self.edge_index = None
+
+        # Episode storage
+        self.episode_offsets = np.zeros(max_episodes + 1, dtype=np.int64)
+        self.episode_steps = np.zeros(max_episodes, dtype=np.int64)
         self.episode_reward = np.zeros(max_episodes, dtype=np.float32)
         self.episode_exploration = np.zeros(max_episodes, dtype=np.float32)
         self.episode_seconds = np.zeros(max_episodes, dtype=np.float64)
-        self.current_ep_idxs = np.arange(max_episodes)
+        self.n_episodes = 0
+        self.size = 0
+        self._graph_index = {}
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        """Forget the stored episodes, the storage is kept for the next fill."""
+        self.episode_offsets[:] = 0
+        self.episode_steps[:] = 0
+        self.episode_reward[:] = 0
+        self.episode_exploration[:] = 0
+        self.episode_seconds[:] = 0
+        self.n_episodes = 0
+        self.size = 0
+
+    def _allocate(self, state_shape, action_shape, action_dtype):
+        if self.states_mem is not None and self.states_mem.shape[1:] == state_shape and self.actions_mem.shape[1:] == action_shape and self.actions_mem.dtype == action_dtype:
+            return
+        self.states_mem = torch.zeros((self.capacity,) + state_shape, dtype=torch.float32)
+        self.actions_mem = torch.zeros((self.capacity,) + action_shape, dtype=action_dtype)
+        self.logpas_mem = torch.zeros(self.capacity, dtype=torch.float32)
+        self.values_mem = torch.zeros(self.capacity, dtype=torch.float32)
+        self.returns_mem = torch.zeros(self.capacity, dtype=torch.float32)
+        self.gaes_mem = torch.zeros(self.capacity, dtype=torch.float32)
+
+    def _allocate_hidden(self, hidden_shape):
+        if self.hidden_mem is None or self.hidden_mem.shape[1:] != hidden_shape:
+            self.hidden_mem = torch.zeros((self.capacity,) + hidden_shape, dtype=torch.float32)
+
+    @staticmethod
+    def _truncated_fn(infos):
+        return np.array([info.get('TimeLimit.truncated', False) for info in infos], dtype=bool)
+
+    def fill(self, envs, policy_model, value_model=None):
+        """
+        Run the policy in the environments until half of max_episodes episodes have ended.
+
+        Args:
+            envs (VectorEnvironment): Vectorized environments with num_envs, reset(ranks) and step(actions).
+                Their edge_index attribute, the edges shared by their states, is kept for graph minibatches
+                (see sample). Environments without one leave the edge_index of the buffer unchanged, it
+                can then be assigned to EpisodeBuffer.edge_index.
+            policy_model: Model with np_pass(states) -> (actions, log probabilities, exploratory flags).
+                A recurrent model (policy_model.recurrent true, e.g. ActorCritic) has np_pass(states, hidden)
+                -> (actions, log probabilities, exploratory flags, next hidden), with hidden an LSTM state
+                (h, c) of shape (num_layers, n_workers, hidden_size), initial_state(n_workers) and
+                reset_state(hidden, done).
+            value_model (torch.nn.Module): Value function. None for an actor-critic policy_model computing
+                the values in the same forward pass, its np_pass then returns the values after the
+                exploratory flags. Values returned by np_pass are ignored when a value_model is given.
+
+        Returns:
+            tuple: Length, total reward, exploration rate and duration in seconds of each stored episode.
+        """
+        self.clear()
 
-    def fill(self, envs, policy_model, value_model):
         # Number of workers (assuming envs is a vectorized environment)
         n_workers = envs.num_envs
+        workers = np.arange(n_workers)
+        edge_index = getattr(envs, "edge_index", None)
+        if edge_index is not None and (self.edge_index is None or not torch.equal(self.edge_index, edge_index)):
+            self.edge_index = edge_index
+            self._graph_index = {}
 
         # Reset the environments and get initial states
         states = envs.reset()
 
-        # Initialize buffers for worker rewards, exploration status, steps, and timestamps
+        # Per-worker buffers of the episodes in progress, copied to the step storage when they end
         we_shape = (n_workers, self.max_episode_steps)
+        worker_states = np.zeros(we_shape + states.shape[1:], dtype=np.float32)
+        worker_actions = None
+        worker_logpas = np.zeros(shape=we_shape, dtype=np.float32)
+        worker_values = np.zeros(shape=we_shape, dtype=np.float32)
         worker_rewards = np.zeros(shape=we_shape, dtype=np.float32)
-        worker_exploratory = np.zeros(shape=we_shape, dtype=np.bool)
-        worker_steps = np.zeros(shape=(n_workers), dtype=np.uint16)
+        worker_exploratory = np.zeros(shape=we_shape, dtype=np.bool_)
+        worker_steps = np.zeros(shape=(n_workers), dtype=np.int64)
         worker_seconds = np.array([time.time()] * n_workers, dtype=np.float64)
-
-        buffer_full = False
+        recurrent = getattr(policy_model, "recurrent", False)
+        hidden = policy_model.initial_state(n_workers) if recurrent else None
+        worker_hidden = None
+        if not recurrent:
+            self.hidden_mem = None
 
         # Main loop to fill the episode buffer
-        while not buffer_full and len(self.episode_steps[self.episode_steps > 0]) < self.max_episodes / 2:
+        while self.n_episodes < self.max_episodes / 2:
             with torch.no_grad():
                 # Get actions, log probabilities, and exploratory status from the policy model
-                actions, logpas, are_exploratory = policy_model.np_pass(states)
+                outputs = policy_model.np_pass(states, hidden) if recurrent else policy_model.np_pass(states)
+                if recurrent:
+                    *outputs, next_hidden = outputs
 
-                # Get value estimates from the value model
-                values = value_model(states)
+                # Get value estimates from the value model, or from the same pass of an actor-critic
+                if value_model is None:
+                    actions, logpas, are_exploratory, values = outputs
+                    values = torch.as_tensor(values)
+                else:
+                    actions, logpas, are_exploratory = outputs[:3]
+                    values = value_model(states)
 
                 # Take a step in the environments using the selected actions
                 next_states, rewards, terminals, infos = envs.step(actions)
 
-                # Store states, actions, log probabilities, and rewards in the memory buffers
-                self.states_mem[self.current_ep_idxs, worker_steps] = states
-                self.actions_mem[self.current_ep_idxs, worker_steps] = actions
-                self.logpas_mem[self.current_ep_idxs, worker_steps] = logpas
-                worker_exploratory[np.arange(n_workers), worker_steps] = are_exploratory
-                worker_rewards[np.arange(n_workers), worker_steps] = rewards
+                # Store states, actions, log probabilities, values and rewards in the worker buffers
+                actions = np.asarray(actions)
+                if worker_actions is None:
+                    worker_actions = np.zeros(we_shape + actions.shape[1:], dtype=actions.dtype)
+                    self._allocate(tuple(states.shape[1:]), tuple(actions.shape[1:]), torch.as_tensor(actions).dtype)
+                worker_states[workers, worker_steps] = states
+                worker_actions[workers, worker_steps] = actions
+                worker_logpas[workers, worker_steps] = logpas
+                worker_values[workers, worker_steps] = values.reshape(-1).cpu().numpy()
+                worker_exploratory[workers, worker_steps] = are_exploratory
+                worker_rewards[workers, worker_steps] = rewards
+                if recurrent:
+                    # (h, c) of shape (num_layers, n_workers, hidden_size) stored as (n_workers, 2, num_layers, hidden_size)
+                    step_hidden = torch.stack(hidden).permute(2, 0, 1, 3).cpu().numpy()
+                    if worker_hidden is None:
+                        worker_hidden = np.zeros(we_shape + step_hidden.shape[1:], dtype=np.float32)
+                        self._allocate_hidden(step_hidden.shape[1:])
+                    worker_hidden[workers, worker_steps] = step_hidden
+                    hidden = next_hidden
 
                 # Handle terminal states
-                for w_idx in range(n_workers):
-                    if worker_steps[w_idx] + 1 == self.max_episode_steps:
-                        terminals[w_idx] = 1
-                        infos[w_idx]['TimeLimit.truncated'] = True
+                for w_idx in np.flatnonzero(worker_steps + 1 == self.max_episode_steps):
+                    terminals[w_idx] = 1
+                    infos[w_idx]['TimeLimit.truncated'] = True
 
                 # Handle termination and truncation
                 if terminals.sum():
@@ -71,8 +296,15 @@ class EpisodeBuffer():
                     truncated = self._truncated_fn(infos)
                     if truncated.sum():
                         idx_truncated = np.flatnonzero(truncated)
-                        with torch.no_grad():
-                            next_values[idx_truncated] = value_model(next_states[idx_truncated]).cpu().numpy()
+                        if value_model is None:
+                            if recurrent:
+                                outputs = policy_model.np_pass(next_states[idx_truncated], tuple(h[:, idx_truncated] for h in hidden))
+                            else:
+                                outputs = policy_model.np_pass(next_states[idx_truncated])
+                            truncated_values = torch.as_tensor(outputs[3])
+                        else:
+                            truncated_values = value_model(next_states[idx_truncated])
+                        next_values[idx_truncated] = truncated_values.reshape(-1).cpu().numpy()
 
                 # Update states and steps
                 states = next_states
@@ -82,55 +314,186 @@ class EpisodeBuffer():
                 if terminals.sum():
                     new_states = envs.reset(ranks=idx_terminals)
                     states[idx_terminals] = new_states
-                    for w_idx in range(n_workers):
-                        if w_idx not in idx_terminals:
-                            continue
-                        e_idx = self.current_ep_idxs[w_idx]
-                        T = worker_steps[w_idx]
-                        self.episode_steps[e_idx] = T
-                        self.episode_reward[e_idx] = worker_rewards[w_idx, :T].sum()
-                        self.episode_exploration[e_idx] = worker_exploratory[w_idx, :T].mean()
-                        self.episode_seconds[e_idx] = time.time() - worker_seconds[w_idx]
-
-                        # Compute returns and advantages
-                        ep_rewards = np.concatenate((worker_rewards[w_idx, :T], [next_values[w_idx]]))
-                        ep_discounts = self.discounts[:T+1]
-                        ep_returns = np.array([np.sum(ep_discounts[:T+1-t] * ep_rewards[t:]) for t in range(T)])
-                        self.returns_mem[e_idx, :T] = ep_returns
-
-                        ep_states = self.states_mem[e_idx, :T]
-                        with torch.no_grad():
-                            ep_values = torch.cat((value_model(ep_states), torch.tensor([next_values[w_idx]], device=value_model.device, dtype=torch.float32)))
-                        np_ep_values = ep_values.view(-1).cpu().numpy()
-                        ep_tau_discounts = self.tau_discounts[:T]
-                        deltas = ep_rewards[:-1] + self.gamma * np_ep_values[1:] - np_ep_values[:-1]
-                        gaes = np.array([np.sum(self.tau_discounts[:T-t] * deltas[t:]) for t in range(T)])
-                        self.gaes_mem[e_idx, :T] = gaes
-
-                        # Reset worker-specific buffers
-                        worker_exploratory[w_idx, :] = 0
-                        worker_rewards[w_idx, :] = 0
-                        worker_steps[w_idx] = 0
-                        worker_seconds[w_idx] = time.time()
-
-                        # Update episode index
-                        new_ep_id = max(self.current_ep_idxs) + 1
-                        if new_ep_id >= self.max_episodes:
-                            buffer_full = True
-                            break
-                        self.current_ep_idxs[w_idx] = new_ep_id
-
-        # Filter and concatenate episode data for training
-        ep_idxs = self.episode_steps > 0
-        ep_t = self.episode_steps[ep_idxs]
-        self.states_mem = np.concatenate([row[:ep_t[i]] for i, row in enumerate(self.states_mem[ep_idxs])])
-        self.actions_mem = np.concatenate([row[:ep_t[i]] for i, row in enumerate(self.actions_mem[ep_idxs])])
-        self.returns_mem = torch.tensor(np.concatenate([row[:ep_t[i]] for i, row in enumerate(self.returns_mem[ep_idxs])]), device=value_model.device)
-        self.gaes_mem = torch.tensor(np.concatenate([row[:ep_t[i]] for i, row in enumerate(self.gaes_mem[ep_idxs])]), device=value_model.device)
-        self.logpas_mem = torch.tensor(np.concatenate([row[:ep_t[i]] for i, row in enumerate(self.logpas_mem[ep_idxs])]), device=value_model.device)
+
+                    # Episodes beyond max_episodes are dropped
+                    w_idxs = idx_terminals[:self.max_episodes - self.n_episodes]
+                    e_idxs = np.arange(self.n_episodes, self.n_episodes + len(w_idxs))
+                    ep_t = worker_steps[w_idxs]
+                    self.episode_steps[e_idxs] = ep_t
+                    self.episode_reward[e_idxs] = worker_rewards[w_idxs].sum(axis=1)
+                    self.episode_exploration[e_idxs] = worker_exploratory[w_idxs].sum(axis=1) / ep_t
+                    self.episode_seconds[e_idxs] = time.time() - worker_seconds[w_idxs]
+
+                    # Copy the episodes to the step storage with their returns and advantages
+                    self._store_episodes(w_idxs, worker_steps, worker_states, worker_actions, worker_logpas, worker_values, worker_rewards, next_values, worker_hidden)
+
+                    # Reset worker-specific buffers
+                    worker_exploratory[idx_terminals] = 0
+                    worker_rewards[idx_terminals] = 0
+                    worker_steps[idx_terminals] = 0
+                    worker_seconds[idx_terminals] = time.time()
+                    if recurrent:
+                        hidden = policy_model.reset_state(hidden, terminals.astype(bool))
 
         # Return episode lengths, rewards, exploration rates, and durations
-        ep_r = self.episode_reward[ep_idxs]
-        ep_x = self.episode_exploration[ep_idxs]
-        ep_s = self.episode_seconds[ep_idxs]
+        ep_t = self.episode_steps[:self.n_episodes]
+        ep_r = self.episode_reward[:self.n_episodes]
+        ep_x = self.episode_exploration[:self.n_episodes]
+        ep_s = self.episode_seconds[:self.n_episodes]
         return ep_t, ep_r, ep_x, ep_s
+
+    def get_stacks(self):
+        """
+        Returns:
+            tuple: (states, actions, returns, gaes, logpas) of every stored step, views on the storage.
+        """
+        steps = slice(0, self.size)
+        return self.states_mem[steps], self.actions_mem[steps], self.returns_mem[steps], self.gaes_mem[steps], self.logpas_mem[steps]
+
+    def sample(self, batch_size, epochs=1, batches_per_epoch=None, graph=True, device=None, prefetch_size=2, generator=None, sequence_length=None):
+        """
+        Shuffled minibatches of the stored steps, collated in a background thread while the
+        consumer works on the previous ones.
+
+        Each epoch is a new permutation of the steps cut into minibatches of batch_size steps,
+        the last one being smaller if batch_size does not divide the number of steps.
+
+        Args:
+            batch_size (int): Number of steps per minibatch.
+            epochs (int): Number of passes over the steps.
+            batches_per_epoch (int): Only yield the first minibatches of each epoch, all of them if None.
+            graph (bool): Give the states as a PyG Batch of graphs sharing edge_index, else as
+                a (batch_size, num_nodes, num_node_features) tensor.
+            device (torch.device): Device the minibatches are moved to, left on CPU if None.
+            prefetch_size (int): Number of minibatches collated ahead of the consumer.
+            generator (torch.Generator): Random generator of the permutations.
+            sequence_length (int): Yield SequenceMinibatch with windows of this many states, see
+                collate_sequences. Requires a rollout of a recurrent policy.
+
+        Yields:
+            Minibatch: States, actions, log probabilities, values, returns and GAEs of the steps.
+        """
+        batch_size = max(1, min(int(batch_size), self.size))
+        return prefetch(self._minibatches(batch_size, epochs, batches_per_epoch, graph, device, generator, sequence_length), prefetch_size)
+
+    def _minibatches(self, batch_size, epochs, batches_per_epoch, graph, device, generator, sequence_length):
+        for _ in range(epochs):
+            permutation = torch.randperm(self.size, generator=generator)
+            batches = torch.split(permutation, batch_size)
+            for idxs in batches[:batches_per_epoch]:
+                if sequence_length is None:
+                    yield self.collate(idxs, graph, device)
+                else:
+                    yield self.collate_sequences(idxs, sequence_length, device)
+
+    def collate(self, idxs, graph=True, device=None):
+        """
+        Gather the given steps of the storage.
+
+        Args:
+            idxs (torch.Tensor): Rows of the steps.
+            graph (bool): Give the states as a PyG Batch, see sample.
+            device (torch.device): Device the minibatch is moved to, left on CPU if None.
+
+        Returns:
+            Minibatch: The steps.
+        """
+        states = self.states_mem[idxs]
+        if graph:
+            states = self._graph_batch(states)
+        minibatch = Minibatch(states, self.actions_mem[idxs], self.logpas_mem[idxs], self.values_mem[idxs], self.returns_mem[idxs], self.gaes_mem[idxs])
+        if device is not None:
+            minibatch = Minibatch(*(tensor.to(device, non_blocking=True) for tensor in minibatch))
+        return minibatch
+
+    def collate_sequences(self, idxs, sequence_length, device=None):
+        """
+        Gather the given steps with the window of at most sequence_length states ending at
+        each of them, for recurrent models.
+
+        Windows do not cross the start of their episode. A window shorter than
+        sequence_length is padded after its last step by repeating it, lengths tells which
+        output of the recurrent model belongs to the sampled step.
+
+        Args:
+            idxs (torch.Tensor): Rows of the steps.
+            sequence_length (int): Maximum number of states of the windows.
+            device (torch.device): Device the minibatch is moved to, left on CPU if None.
+
+        Returns:
+            SequenceMinibatch: The steps, with (h, c) of shape (num_layers, len(idxs), hidden_size).
+        """
+        if self.hidden_mem is None:
+            raise ValueError("The buffer holds no recurrent state, fill it with a recurrent policy.")
+        idxs = torch.as_tensor(idxs, dtype=torch.int64)
+        episodes = np.searchsorted(self.episode_offsets[:self.n_episodes + 1], idxs.numpy(), side="right") - 1
+        episode_starts = torch.from_numpy(self.episode_offsets[episodes])
+        starts = torch.maximum(idxs - sequence_length + 1, episode_starts)
+        positions = torch.minimum(starts[:, None] + torch.arange(sequence_length), idxs[:, None])
+        hidden = self.hidden_mem[starts].permute(1, 2, 0, 3)
+        minibatch = SequenceMinibatch(self.states_mem[positions], self.actions_mem[idxs], self.logpas_mem[idxs], self.values_mem[idxs],
+                                      self.returns_mem[idxs], self.gaes_mem[idxs], (hidden[0].contiguous(), hidden[1].contiguous()), idxs - starts + 1)
+        if device is not None:
+            minibatch = SequenceMinibatch(*(tuple(t.to(device, non_blocking=True) for t in tensor) if isinstance(tensor, tuple) else tensor.to(device, non_blocking=True) for tensor in minibatch))
+        return minibatch
+
+    def _graph_batch(self, states):
+        """PyG Batch of graphs with the given node features and the shared edge_index."""
+        if self.edge_index is None:
+            raise ValueError("Graph minibatches need the edge_index of the states, give it to the environments or to EpisodeBuffer.edge_index.")
+        return batch_graphs(states, self.edge_index, self._graph_index)
+
+    def _store_episodes(self, w_idxs, worker_steps, worker_states, worker_actions, worker_logpas, worker_values, worker_rewards, next_values, worker_hidden=None):
+        """
+        Append the episodes that just ended on the given workers to the step storage, with
+        their discounted returns and GAEs.
+
+        The episodes are padded to the longest one so both reverse scans run once over a
+        (len(w_idxs), T) array, and each column of the storage is written with a single
+        index operation.
+
+        Args:
+            w_idxs (np.ndarray): Workers whose episode ended.
+            worker_steps (np.ndarray): Length of the episode of each worker.
+            worker_states, worker_actions, worker_logpas, worker_values, worker_rewards (np.ndarray):
+                Per-worker buffers of shape (n_workers, max_episode_steps, ...).
+            next_values (np.ndarray): Bootstrap value of each worker, 0 for terminal states.
+            worker_hidden (np.ndarray): Per-worker buffer of recurrent states, None for a non-recurrent policy.
+        """
+        n_episodes = len(w_idxs)
+        if n_episodes == 0:
+            return
+        ep_t = worker_steps[w_idxs]
+        max_t = ep_t.max()
+        in_episode = np.arange(max_t) < ep_t[:, None]
+        rows, steps = np.nonzero(in_episode)
+        workers = w_idxs[rows]
+
+        # Rows of the steps in the storage, episodes being stored one after the other
+        offsets = self.size + np.concatenate(([0], np.cumsum(ep_t)))
+        self.episode_offsets[self.n_episodes:self.n_episodes + n_episodes + 1] = offsets
+        positions = torch.from_numpy(offsets[rows] + steps)
+        self.states_mem[positions] = torch.from_numpy(worker_states[workers, steps])
+        self.actions_mem[positions] = torch.from_numpy(worker_actions[workers, steps])
+        self.logpas_mem[positions] = torch.from_numpy(worker_logpas[workers, steps])
+        self.values_mem[positions] = torch.from_numpy(worker_values[workers, steps])
+        if worker_hidden is not None:
+            self.hidden_mem[positions] = torch.from_numpy(worker_hidden[workers, steps])
+
+        # Rewards and values followed by the bootstrap value, zero after it
+        ep_rewards = np.zeros((n_episodes, max_t + 1))
+        ep_rewards[:, :max_t][in_episode] = worker_rewards[workers, steps]
+        ep_rewards[np.arange(n_episodes), ep_t] = next_values[w_idxs]
+        ep_returns = discounted_cumsum(ep_rewards, self.gamma)[:, :-1]
+        self.returns_mem[positions] = torch.from_numpy(ep_returns[in_episode].astype(np.float32))
+
+        ep_values = np.zeros((n_episodes, max_t + 1))
+        ep_values[:, :max_t][in_episode] = worker_values[workers, steps]
+        ep_values[np.arange(n_episodes), ep_t] = next_values[w_idxs]
+        deltas = ep_rewards[:, :-1] + self.gamma * ep_values[:, 1:] - ep_values[:, :-1]
+        deltas[~in_episode] = 0
+        gaes = discounted_cumsum(deltas, self.gae_discount)
+        self.gaes_mem[positions] = torch.from_numpy(gaes[in_episode].astype(np.float32))
+
+        self.n_episodes += n_episodes
+        self.size = int(offsets[-1])
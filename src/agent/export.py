@@ -0,0 +1,199 @@
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch_geometric.nn.conv.gcn_conv import gcn_norm
+
+from episode_buffer import batch_graphs
+
+
+class StaticGCNLayer(nn.Module):
+    def __init__(self, conv):
+        """GCNConv layer on batched dense node features, sharing the parameters of conv."""
+        super(StaticGCNLayer, self).__init__()
+        self.weight = conv.lin.weight
+        self.bias = conv.bias if conv.bias is not None else nn.Parameter(torch.zeros(conv.out_channels), requires_grad=False)
+
+    def forward(self, x, sources, targets, edge_weight):
+        x = F.linear(x, self.weight)
+        messages = x[:, sources] * edge_weight[None, :, None]
+        return torch.zeros_like(x).index_add(1, targets, messages) + self.bias
+
+
+class StaticPolicy(nn.Module):
+    def __init__(self, model, edge_index, num_nodes):
+        """
+        Inference-only copy of a trained ActorCritic for one fixed graph topology, in plain
+        torch operations that can be traced, scripted or exported to ONNX.
+
+        The GCN normalization of the topology is computed once and stored with the weights,
+        the message passing is an index_add over the normalized edges and the pooling a mean
+        over the nodes, so nothing of torch_geometric is needed at inference time.
+
+        Args:
+            model (ActorCritic): Trained model, its weights are shared, not copied.
+            edge_index (torch.Tensor): Topology of the graphs.
+            num_nodes (int): Number of nodes of the graphs.
+        """
+        super(StaticPolicy, self).__init__()
+        self.num_nodes = num_nodes
+        self.convs = nn.ModuleList([StaticGCNLayer(conv) for conv in model.shared_convs])
+        self.shared_lstm = model.shared_lstm
+        self.actor_lstm = model.actor_lstm
+        self.critic_lstm = model.critic_lstm
+        self.actor_head = model.actor_head
+        self.critic_head = model.critic_head
+        edge_index, edge_weight = gcn_norm(edge_index, None, num_nodes, add_self_loops=True)
+        self.register_buffer("sources", edge_index[0].clone())
+        self.register_buffer("targets", edge_index[1].clone())
+        self.register_buffer("edge_weight", edge_weight.detach().clone())
+
+    def forward(self, x, observation, h, c):
+        """
+        Args:
+            x (torch.Tensor): Node features, shape (batch, num_nodes, input_dim).
+            observation (torch.Tensor): Sequential observations, shape (batch, sequence_dim).
+            h, c (torch.Tensor): Recurrent state as in ActorCritic.initial_state.
+
+        Returns:
+            tuple: Action probabilities, state values, new h and c.
+        """
+        for conv in self.convs:
+            x = F.relu(conv(x, self.sources, self.targets, self.edge_weight))
+        embedding = x.mean(dim=1)
+
+        sequence = torch.cat([embedding, observation], dim=-1)[:, None, :]
+        shared_h, actor_h, critic_h = h.chunk(3)
+        shared_c, actor_c, critic_c = c.chunk(3)
+        shared_out, (shared_h, shared_c) = self.shared_lstm(sequence, (shared_h.contiguous(), shared_c.contiguous()))
+        actor_out, (actor_h, actor_c) = self.actor_lstm(shared_out, (actor_h.contiguous(), actor_c.contiguous()))
+        critic_out, (critic_h, critic_c) = self.critic_lstm(shared_out, (critic_h.contiguous(), critic_c.contiguous()))
+
+        action_probs = F.softmax(self.actor_head(actor_out[:, -1, :]), dim=-1)
+        state_value = self.critic_head(critic_out[:, -1, :])
+        return action_probs, state_value, torch.cat([shared_h, actor_h, critic_h]), torch.cat([shared_c, actor_c, critic_c])
+
+
+def example_inputs(model, num_nodes, batch_size=1):
+    """Zero inputs of StaticPolicy for the given model, used to trace it."""
+    h, c = model.initial_state(batch_size)
+    x = torch.zeros(batch_size, num_nodes, model.shared_convs[0].in_channels if len(model.shared_convs) else model.embedding_dim)
+    return x, torch.zeros(batch_size, model.sequence_dim), h, c
+
+
+def export_policy(model, edge_index, num_nodes, method="trace", path=None, batch_size=1):
+    """
+    Export the policy for a fixed topology.
+
+    Args:
+        model (ActorCritic): Trained model.
+        edge_index (torch.Tensor): Topology of the graphs.
+        num_nodes (int): Number of nodes of the graphs.
+        method (str): "trace" or "script" for TorchScript, "onnx" for an ONNX file (requires the onnx package).
+        path (str): File the exported policy is saved to, required for ONNX.
+        batch_size (int): Batch size of the example inputs, the exported policy accepts any batch size.
+
+    Returns:
+        torch.jit.ScriptModule: The TorchScript policy, or the path of the ONNX file.
+    """
+    policy = StaticPolicy(model, edge_index, num_nodes).eval()
+    inputs = example_inputs(model, num_nodes, batch_size)
+    if method == "onnx":
+        if path is None:
+            raise ValueError("An ONNX export needs a path.")
+        dynamic_axes = {"x": {0: "batch"}, "observation": {0: "batch"}, "h": {1: "batch"}, "c": {1: "batch"}}
+        torch.onnx.export(policy, inputs, path, input_names=["x", "observation", "h", "c"],
+                          output_names=["action_probs", "state_value", "h_out", "c_out"], dynamic_axes=dynamic_axes)
+        return path
+    with torch.no_grad():
+        if method == "trace":
+            exported = torch.jit.trace(policy, inputs)
+        elif method == "script":
+            exported = torch.jit.script(policy)
+        else:
+            raise ValueError(f"Unknown export method {method}.")
+    exported = torch.jit.freeze(exported.eval())
+    if path is not None:
+        exported.save(path)
+    return exported
+
+
+def onnx_session(path, num_threads=1):
+    """
+    ONNX Runtime session of an exported policy, taking NumPy inputs x, observation, h and c.
+    Requires the onnxruntime package.
+    """
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    options.inter_op_num_threads = 1
+    return onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def check_parity(model, exported, edge_index, x, observation=None, state=None):
+    """
+    Largest absolute differences between the exported policy and the eager ActorCritic.
+
+    Args:
+        model (ActorCritic): Eager model.
+        exported (callable): Exported policy, a TorchScript module or an ONNX Runtime session.
+        edge_index (torch.Tensor): Topology of the graphs.
+        x (torch.Tensor): Node features, shape (batch, num_nodes, input_dim).
+        observation (torch.Tensor): Sequential observations, zeros if None.
+        state (tuple): Recurrent state (h, c), zeros if None.
+
+    Returns:
+        dict: Differences of the action probabilities, values and recurrent state.
+    """
+    if observation is None:
+        observation = x.new_zeros((x.size(0), model.sequence_dim))
+    if state is None:
+        state = model.initial_state(x.size(0))
+    with torch.no_grad():
+        expected = model.step(batch_graphs(x, edge_index), observation, state)
+        expected = (expected[0], expected[1]) + expected[2]
+        outputs = _run(exported, (x, observation) + tuple(state))
+    names = ("action_probs", "state_value", "h", "c")
+    return {name: (torch.as_tensor(output) - reference).abs().max().item() for name, output, reference in zip(names, outputs, expected)}
+
+
+def latency_percentiles(exported, inputs, num_threads=1, repeats=200, warmup=20, percentiles=(50, 90, 99)):
+    """
+    Latency of single forward passes of a policy.
+
+    Args:
+        exported (callable): TorchScript module, eager module or ONNX Runtime session.
+        inputs (tuple): Inputs x, observation, h and c.
+        num_threads (int): Number of intra-op threads of torch during the measure.
+        repeats (int): Number of timed forward passes.
+        warmup (int): Number of forward passes run before timing, e.g. for the TorchScript optimizations.
+        percentiles (tuple): Percentiles to report.
+
+    Returns:
+        dict: Latency in milliseconds for each percentile, keyed "p50", "p90"...
+    """
+    previous_threads = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        timings = np.zeros(repeats)
+        with torch.no_grad():
+            for _ in range(warmup):
+                _run(exported, inputs)
+            for i in range(repeats):
+                start = time.perf_counter()
+                _run(exported, inputs)
+                timings[i] = time.perf_counter() - start
+    finally:
+        torch.set_num_threads(previous_threads)
+    return {f"p{p}": float(np.percentile(timings, p) * 1000) for p in percentiles}
+
+
+def _run(exported, inputs):
+    if hasattr(exported, "get_inputs"):
+        # ONNX Runtime session
+        names = [node.name for node in exported.get_inputs()]
+        return exported.run(None, {name: np.asarray(tensor, dtype=np.float32) for name, tensor in zip(names, inputs)})
+    return exported(*inputs)
@@ -1,26 +1,75 @@
 import torch
 from torch_geometric.data import Data
 from torch_geometric.nn import GCNConv, global_mean_pool
+from torch_geometric.nn.conv.gcn_conv import gcn_norm
 import torch.nn.functional as F
 import torch_geometric.transforms as T
 from torch.nn import Linear
 
 class GraphEmbedder(torch.nn.Module):
-    def __init__(self, input_node_feature_size, output_feature_size):
+    def __init__(self, input_node_feature_size, output_feature_size, static_topology=False):
+        """
+        Embedding of a graph by two GCN layers followed by a mean pooling of its nodes.
+
+        In static topology mode, for graphs whose edges do not change from one call to the
+        next (the road network during an episode), the per-call transforms are replaced by
+        precomputed ones:
+        - node features are standardized by the affine map fitted once by fit,
+        - the GCN normalization of edge_index is computed once and reused as long as the
+          same edge_index tensor is given,
+        - features narrower than input_node_feature_size are padded in a preallocated buffer
+          when no gradient is recorded.
+
+        Args:
+            input_node_feature_size (int): Number of node features, inputs are padded or truncated to it.
+            output_feature_size (int): Size of the graph embedding.
+            static_topology (bool): Use the static topology mode.
+        """
         super(GraphEmbedder, self).__init__()
         self.input_node_feature_size = input_node_feature_size
         self.output_feature_size = output_feature_size
-        self.conv1 = GCNConv(input_node_feature_size, 2 * output_feature_size)
-        self.conv2 = GCNConv(2 * output_feature_size, output_feature_size)
+        self.static_topology = static_topology
+        self.conv1 = GCNConv(input_node_feature_size, 2 * output_feature_size, normalize=not static_topology)
+        self.conv2 = GCNConv(2 * output_feature_size, output_feature_size, normalize=not static_topology)
         self.transform = T.Compose([T.NormalizeFeatures(), T.NormalizeScale()])
 
+        # Standardization x * feature_scale + feature_shift, the identity until fit is called. Only
+        # saved in the state dict in static topology mode, the only one using it, so that state dicts
+        # of the default mode keep the keys of the GCN layers alone
+        self.register_buffer("feature_scale", torch.ones(input_node_feature_size), persistent=static_topology)
+        self.register_buffer("feature_shift", torch.zeros(input_node_feature_size), persistent=static_topology)
+        self._normalized_edges = None
+        self._padding = None
+
+    def fit(self, x):
+        """
+        Fit the standardization of the node features used in static topology mode.
+
+        Args:
+            x (torch.Tensor): Node features of shape (..., num_node_features), e.g. the states of a rollout.
+        """
+        x = x.reshape(-1, x.size(-1))[:, :self.input_node_feature_size].to(self.feature_scale)
+        mean, std = x.mean(dim=0), x.std(dim=0)
+        scale = torch.where(std > 0, 1 / std, torch.ones_like(std))
+        self.feature_scale.fill_(1)
+        self.feature_shift.zero_()
+        self.feature_scale[:x.size(1)] = scale
+        self.feature_shift[:x.size(1)] = -mean * scale
+
     def forward(self, data):
+        if self.static_topology:
+            x = self._features(data.x)
+            edge_index, edge_weight = self._normalize(data.edge_index, x.size(0))
+            x = F.relu(self.conv1(x, edge_index, edge_weight))
+            x = F.relu(self.conv2(x, edge_index, edge_weight))
+            return global_mean_pool(x, data.batch)
+
         # Normalisation et échelle des caractéristiques des nœuds
         data = self.transform(data)
 
         # Padding des caractéristiques des nœuds si nécessaire
         if data.x.size(1) < self.input_node_feature_size:
-            padding = torch.zeros((data.num_nodes, self.input_node_feature_node - data.x.size(1)))
+            padding = torch.zeros((data.num_nodes, self.input_node_feature_size - data.x.size(1)))
             data.x = torch.cat([data.x, padding], dim=1)
         elif data.x.size(1) > self.input_node_feature_size:
             data.x = data.x[:, :self.input_node_feature_size]
@@ -35,6 +84,32 @@ class GraphEmbedder(torch.nn.Module):
 
         return x
 
+    def _features(self, x):
+        """Standardized node features, padded or truncated to input_node_feature_size."""
+        x = x[:, :self.input_node_feature_size]
+        num_nodes, num_features = x.shape
+        scale, shift = self.feature_scale[:num_features], self.feature_shift[:num_features]
+        if num_features == self.input_node_feature_size:
+            return torch.addcmul(shift, x, scale)
+        if torch.is_grad_enabled():
+            padded = x.new_zeros((num_nodes, self.input_node_feature_size))
+        else:
+            # The buffer is overwritten by the next call, it cannot be kept for a backward pass
+            if self._padding is None or self._padding[0] != (num_nodes, num_features, x.device, x.dtype):
+                self._padding = ((num_nodes, num_features, x.device, x.dtype), x.new_zeros((num_nodes, self.input_node_feature_size)))
+            padded = self._padding[1]
+        torch.addcmul(shift, x, scale, out=padded[:, :num_features])
+        return padded
+
+    def _normalize(self, edge_index, num_nodes):
+        """Edges with self loops and symmetric GCN weights, cached for the last edge_index tensor."""
+        key = (edge_index.data_ptr(), edge_index._version, tuple(edge_index.shape), num_nodes)
+        if self._normalized_edges is None or self._normalized_edges[0] != key:
+            normalized = gcn_norm(edge_index, None, num_nodes, add_self_loops=True, dtype=self.feature_scale.dtype)
+            # edge_index is kept alive so that its address cannot be reused by another tensor
+            self._normalized_edges = (key, edge_index, normalized)
+        return self._normalized_edges[2]
+
     def prepare_graph(self, graph):
         # Assurez-vous que le graphe a des attributs 'x' et 'edge_index'
         if graph.x is None:
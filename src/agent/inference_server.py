@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from episode_buffer import batch_graphs
+
+
+class InferenceClient:
+    def __init__(self, client_id, requests, responses):
+        """
+        Handle of one environment worker on an InferenceServer, obtained from InferenceServer.client.
+        It can be passed to a worker process when the server uses multiprocessing queues.
+        """
+        self.client_id = client_id
+        self.requests = requests
+        self.responses = responses
+
+    def act(self, x, observation=None, state=None):
+        """
+        Actions of the policy for the environments of the worker, computed by the server in a
+        batch with the requests of the other workers.
+
+        Args:
+            x (np.ndarray): Node features of each environment, shape (num_envs, num_nodes, num_node_features),
+                or (num_nodes, num_node_features) for a single environment.
+            observation (np.ndarray): Sequential observation of each environment, shape (num_envs, sequence_dim).
+                Zeros if None.
+            state (tuple): Recurrent state (h, c) of the environments returned by the previous call,
+                each of shape (num_layers, num_envs, hidden_size). Zeros if None.
+
+        Returns:
+            tuple: Actions, log probabilities, values and recurrent state (h, c) of the environments,
+                NumPy arrays with a leading num_envs dimension (num_layers first for the state).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 2:
+            x = x[None]
+        self.requests.put((self.client_id, x, observation, state))
+        response = self.responses.get()
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+
+class InferenceServer:
+    def __init__(self, model, edge_index, max_batch_size=256, max_wait=0.002, context=None, greedy=False):
+        """
+        Local policy inference service for many environment workers.
+
+        Workers send the observations of their environments through a shared request queue.
+        The server thread groups the requests arriving within max_wait seconds of the first
+        one, up to max_batch_size environments, runs one batched forward of the ActorCritic
+        on them and sends each worker its actions, log probabilities, values and recurrent
+        states back on its own response queue. Simulation and inference are decoupled: the
+        workers only hold a client and the model lives in the server.
+
+        Args:
+            model (ActorCritic): Policy, evaluated with act.
+            edge_index (torch.Tensor): Topology shared by the graphs of every environment.
+            max_batch_size (int): Maximum number of environments per forward. A request is never split.
+            max_wait (float): Seconds to wait for more requests after the first one of a batch.
+            context (multiprocessing.context.BaseContext): Use queues of this multiprocessing context,
+                for workers in other processes. Thread queues if None.
+            greedy (bool): Take the most probable actions instead of sampling them.
+        """
+        self.model = model
+        self.edge_index = edge_index
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.greedy = greedy
+        self._queue = queue.Queue if context is None else context.Queue
+        self.requests = self._queue()
+        self.responses = []
+        self.num_batches = 0
+        self.num_requests = 0
+        self._graph_index = {}
+        self._pending = None
+        self._thread = None
+
+    def client(self):
+        """New client, with its own response queue. Clients of a process-based server must be created before starting the workers."""
+        self.responses.append(self._queue())
+        return InferenceClient(len(self.responses) - 1, self.requests, self.responses[-1])
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is not None:
+            self.requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                results = self._forward(batch)
+            except Exception as error:
+                results = [error] * len(batch)
+            for request, result in zip(batch, results):
+                self.responses[request[0]].put(result)
+
+    def _next_batch(self):
+        """Requests of the next forward, None when the server is closed."""
+        request = self._pending if self._pending is not None else self.requests.get()
+        self._pending = None
+        if request is None:
+            return None
+        batch, size = [request], len(request[1])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None or size + len(request[1]) > self.max_batch_size:
+                # Closing, or a request for the next batch
+                self._pending = request
+                break
+            batch.append(request)
+            size += len(request[1])
+        return batch
+
+    def _forward(self, batch):
+        sizes = [len(request[1]) for request in batch]
+        x = torch.from_numpy(np.concatenate([request[1] for request in batch]))
+        observation = torch.cat([x.new_zeros((size, self.model.sequence_dim)) if request[2] is None else torch.as_tensor(request[2], dtype=x.dtype)
+                                 for size, request in zip(sizes, batch)])
+        state = None
+        if any(request[3] is not None for request in batch):
+            initial = self.model.initial_state(1)
+            state = tuple(torch.cat([initial[i].expand(-1, size, -1) if request[3] is None else torch.as_tensor(request[3][i])
+                                     for size, request in zip(sizes, batch)], dim=1) for i in range(2))
+
+        with torch.no_grad():
+            actions, logpas, _, values, (h, c) = self.model.act(batch_graphs(x, self.edge_index, self._graph_index, self.max_batch_size), observation, state, greedy=self.greedy)
+        self.num_batches += 1
+        self.num_requests += len(batch)
+
+        # Scatter the rows back to the requests
+        actions, logpas, values, h, c = (tensor.cpu().numpy() for tensor in (actions, logpas, values, h, c))
+        bounds = np.cumsum([0] + sizes)
+        return [(actions[a:b], logpas[a:b], values[a:b], (h[:, a:b], c[:, a:b])) for a, b in zip(bounds[:-1], bounds[1:])]
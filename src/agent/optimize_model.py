@@ -1,121 +1,268 @@
 # Source : Grokking Deep Reinforcement Learning by Miguel Morales
 
-import numpy as np
+import math
+
 import torch
 
 EPS=1e-10
 
 def optimize_model(self):
-    # Get states, actions, returns, generalized advantage estimations (GAEs), and log probabilities
-    states, actions, returns, gaes, logpas = self.episode_buffer.get_stacks()
-    
-    # Detach values from the value model
-    values = self.value_model(states).detach()
-    
-    # Normalize GAEs
-    gaes = (gaes - gaes.mean()) / (gaes.std() + EPS)
-    
+    """
+    PPO update of the policy model, then of the value model, on the steps of the episode buffer.
+
+    Returns:
+        dict: KL divergence ("kl") and value MSE ("mse") of each completed epoch, as used for early stopping.
+    """
+    # An actor-critic without value model is updated by a single joint loop
+    if self.value_model is None:
+        return optimize_shared_model(self)
+
+    # Get the generalized advantage estimations (GAEs) of the stored steps
+    _, _, _, gaes, _ = self.episode_buffer.get_stacks()
+
+    # Normalization of the GAEs, applied to each batch
+    gaes_mean, gaes_std = gaes.mean(), gaes.std() + EPS
+
     # Number of samples
-    n_samples = len(actions)
-    
-    # Policy Optimization Loop
-    for i in range(self.policy_optimization_epochs):
-        # Determine the batch size
-        batch_size = int(self.policy_sample_ratio * n_samples)
-        
-        # Randomly select batch indices
-        batch_idxs = np.random.choice(n_samples, batch_size, replace=False)
-        
-        # Create batches from the sampled indices
-        states_batch = states[batch_idxs]
-        actions_batch = actions[batch_idxs]
-        gaes_batch = gaes[batch_idxs]
-        logpas_batch = logpas[batch_idxs]
-        
+    n_samples = len(gaes)
+
+    # Every stored step, only collated for the optional full-rollout checks
+    all_steps = None
+
+    # Epochs between two checks of the early stopping statistics over the whole rollout, None to only use the batches
+    policy_full_kl_every = getattr(self, "policy_full_kl_every", None)
+    value_full_mse_every = getattr(self, "value_full_mse_every", None)
+
+    # Policy Optimization Loop, each epoch is a shuffled pass over the rollout in batches collated in the background
+    batch_size = max(1, int(self.policy_sample_ratio * n_samples))
+    batches_per_epoch = math.ceil(n_samples / batch_size)
+    batches = self.episode_buffer.sample(batch_size, epochs=self.policy_optimization_epochs, device=self.policy_model.device)
+    kl_sum, kl_count = 0.0, 0
+    kls, mses = [], []
+    for i, batch in enumerate(batches):
         # Get log probabilities and entropies from the policy model
-        logpas_pred, entropies_pred = self.policy_model.get_predictions(states_batch, actions_batch)
-        
-        # Calculate the ratios
-        ratios = (logpas_pred - logpas_batch).exp()
-        
-        # Calculate the unclipped policy objective
-        pi_obj = gaes_batch * ratios
-        
-        # Calculate the clipped policy objective
-        pi_obj_clipped = gaes_batch * ratios.clamp(1.0 - self.policy_clip_range, 1.0 + self.policy_clip_range)
-        
-        # Final policy loss using the minimum of unclipped and clipped objective
-        policy_loss = -torch.min(pi_obj, pi_obj_clipped).mean()
-        
-        # Entropy loss for encouraging exploration
-        entropy_loss = -entropies_pred.mean() * self.entropy_loss_weight
-        
+        logpas_pred, entropies_pred = self.policy_model.get_predictions(batch.states, batch.actions)
+
+        # Policy and entropy losses of the batch
+        policy_loss, entropy_loss = _policy_losses(self, batch, logpas_pred, entropies_pred, gaes_mean, gaes_std)
+
         # Zero out the gradients
         self.policy_optimizer.zero_grad()
-        
+
         # Backpropagation for policy and entropy loss
         (policy_loss + entropy_loss).backward()
-        
+
         # Gradient clipping for stability
         torch.nn.utils.clip_grad_norm_(self.policy_model.parameters(), self.policy_model_max_grad_norm)
-        
+
         # Policy optimizer step
         self.policy_optimizer.step()
-        
-        # Calculate the KL divergence
-        with torch.no_grad():
-            logpas_pred_all, _ = self.policy_model.get_predictions(states, actions)
-            kl = (logpas - logpas_pred_all).mean()
-        
+
+        # Accumulate the KL divergence from the predictions of the batch
+        kl_sum += (batch.logpas - logpas_pred.detach()).sum()
+        kl_count += len(batch.logpas)
+        if (i + 1) % batches_per_epoch:
+            continue
+        epoch = (i + 1) // batches_per_epoch
+
+        # KL divergence of the epoch, over the whole rollout every policy_full_kl_every epochs
+        if policy_full_kl_every and epoch % policy_full_kl_every == 0:
+            if all_steps is None:
+                all_steps = self.episode_buffer.collate(torch.arange(n_samples), device=self.policy_model.device)
+            with torch.no_grad():
+                logpas_pred_all, _ = self.policy_model.get_predictions(all_steps.states, all_steps.actions)
+                kl = (all_steps.logpas - logpas_pred_all).mean().item()
+        else:
+            kl = (kl_sum / kl_count).item()
+        kl_sum, kl_count = 0.0, 0
+        kls.append(kl)
+
         # Early stopping based on KL divergence threshold
-        if kl.item() > self.policy_stopping_kl:
+        if kl > self.policy_stopping_kl:
             break
-    
+
     # Value Optimization Loop
-    for i in range(self.value_optimization_epochs):
-        # Determine the batch size
-        batch_size = int(self.value_sample_ratio * n_samples)
-        
-        # Randomly select batch indices
-        batch_idxs = np.random.choice(n_samples, batch_size, replace=False)
-        
-        # Create batches from the sampled indices
-        states_batch = states[batch_idxs]
-        returns_batch = returns[batch_idxs]
-        values_batch = values[batch_idxs]
-        
-        # Predict values for the current batch
-        values_pred = self.value_model(states_batch)
-        
-        # Calculate the value loss
-        v_loss = (values_pred - returns_batch).pow(2)
-        
-        # Clipped value prediction to prevent large updates
-        values_pred_clipped = values_batch + (values_pred - values_batch).clamp(-self.value_clip_range, self.value_clip_range)
-        
-        # Clipped value loss
-        v_loss_clipped = (values_pred_clipped - returns_batch).pow(2)
-        
-        # Final value loss using the maximum of unclipped and clipped loss
-        value_loss = torch.max(v_loss, v_loss_clipped).mul(0.5).mean()
-        
+    batch_size = max(1, int(self.value_sample_ratio * n_samples))
+    batches_per_epoch = math.ceil(n_samples / batch_size)
+    batches = self.episode_buffer.sample(batch_size, epochs=self.value_optimization_epochs, device=self.value_model.device)
+    mse_sum, mse_count = 0.0, 0
+    for i, batch in enumerate(batches):
+        # Predict values for the current batch, with the (batch_size,) shape of the stored values
+        values_pred = self.value_model(batch.states).reshape(batch.values.shape)
+
+        # Value loss of the batch
+        value_loss = _value_loss(self, batch, values_pred)
+
         # Zero out the gradients
         self.value_optimizer.zero_grad()
-        
+
         # Backpropagation for value loss
         value_loss.backward()
-        
+
         # Gradient clipping for stability
         torch.nn.utils.clip_grad_norm_(self.value_model.parameters(), self.value_model_max_grad_norm)
-        
+
         # Value optimizer step
         self.value_optimizer.step()
-        
-        # Calculate the mean squared error
-        with torch.no_grad():
-            values_pred_all = self.value_model(states)
-            mse = (values - values_pred_all).pow(2).mul(0.5).mean()
-        
+
+        # Accumulate the mean squared error from the predictions of the batch
+        mse_sum += (batch.values - values_pred.detach()).pow(2).mul(0.5).sum()
+        mse_count += len(batch.values)
+        if (i + 1) % batches_per_epoch:
+            continue
+        epoch = (i + 1) // batches_per_epoch
+
+        # Mean squared error of the epoch, over the whole rollout every value_full_mse_every epochs
+        if value_full_mse_every and epoch % value_full_mse_every == 0:
+            if all_steps is None:
+                all_steps = self.episode_buffer.collate(torch.arange(n_samples), device=self.value_model.device)
+            with torch.no_grad():
+                values_pred_all = self.value_model(all_steps.states).reshape(all_steps.values.shape)
+                mse = (all_steps.values - values_pred_all).pow(2).mul(0.5).mean().item()
+        else:
+            mse = (mse_sum / mse_count).item()
+        mse_sum, mse_count = 0.0, 0
+        mses.append(mse)
+
         # Early stopping based on MSE threshold
-        if mse.item() > self.value_stopping_mse:
+        if mse > self.value_stopping_mse:
+            break
+    return {"kl": kls, "mse": mses}
+
+
+def optimize_shared_model(self):
+    """
+    PPO update of an actor-critic whose get_predictions(states, actions) returns the log
+    probabilities, entropies and values of one forward pass, so that the graph of each
+    state is embedded once for both losses. The policy optimizer minimizes the policy and
+    entropy losses plus value_loss_weight times the value loss, with the policy settings
+    (epochs, sample ratio, gradient norm) and early stopping on both the KL divergence
+    and the value MSE.
+
+    A recurrent actor-critic (policy_model.recurrent true) is given the window of at most
+    policy_sequence_length states leading to each step, replayed from the recurrent state
+    stored at its start (see EpisodeBuffer.collate_sequences), so that the predictions of
+    the unchanged model are the ones of the rollout.
+
+    Returns:
+        dict: KL divergence ("kl") and value MSE ("mse") of each completed epoch.
+    """
+    # Get the generalized advantage estimations (GAEs) of the stored steps
+    _, _, _, gaes, _ = self.episode_buffer.get_stacks()
+
+    # Normalization of the GAEs, applied to each batch
+    gaes_mean, gaes_std = gaes.mean(), gaes.std() + EPS
+
+    # Number of samples
+    n_samples = len(gaes)
+
+    # Every stored step, only collated for the optional full-rollout checks
+    all_steps = None
+
+    # Epochs between two checks of the early stopping statistics over the whole rollout, None to only use the batches
+    full_check_every = getattr(self, "policy_full_kl_every", None)
+    value_loss_weight = getattr(self, "value_loss_weight", 0.5)
+
+    # Windows of states of a recurrent model, None to give it the states of the steps alone
+    recurrent = getattr(self.policy_model, "recurrent", False)
+    sequence_length = getattr(self, "policy_sequence_length", 8) if recurrent else None
+
+    # Joint Optimization Loop, each epoch is a shuffled pass over the rollout in batches collated in the background
+    batch_size = max(1, int(self.policy_sample_ratio * n_samples))
+    batches_per_epoch = math.ceil(n_samples / batch_size)
+    batches = self.episode_buffer.sample(batch_size, epochs=self.policy_optimization_epochs, device=self.policy_model.device,
+                                         sequence_length=sequence_length)
+    kl_sum, mse_sum, count = 0.0, 0.0, 0
+    kls, mses = [], []
+    for i, batch in enumerate(batches):
+        # Get log probabilities, entropies and values from one pass of the model
+        logpas_pred, entropies_pred, values_pred = _shared_predictions(self, batch)
+        values_pred = values_pred.reshape(batch.values.shape)
+
+        # Losses of the batch
+        policy_loss, entropy_loss = _policy_losses(self, batch, logpas_pred, entropies_pred, gaes_mean, gaes_std)
+        value_loss = _value_loss(self, batch, values_pred)
+
+        # Zero out the gradients
+        self.policy_optimizer.zero_grad()
+
+        # Backpropagation for the policy, entropy and value losses
+        (policy_loss + entropy_loss + value_loss_weight * value_loss).backward()
+
+        # Gradient clipping for stability
+        torch.nn.utils.clip_grad_norm_(self.policy_model.parameters(), self.policy_model_max_grad_norm)
+
+        # Optimizer step
+        self.policy_optimizer.step()
+
+        # Accumulate the KL divergence and the mean squared error from the predictions of the batch
+        kl_sum += (batch.logpas - logpas_pred.detach()).sum()
+        mse_sum += (batch.values - values_pred.detach()).pow(2).mul(0.5).sum()
+        count += len(batch.logpas)
+        if (i + 1) % batches_per_epoch:
+            continue
+        epoch = (i + 1) // batches_per_epoch
+
+        # Statistics of the epoch, over the whole rollout every policy_full_kl_every epochs
+        if full_check_every and epoch % full_check_every == 0:
+            if all_steps is None and recurrent:
+                all_steps = self.episode_buffer.collate_sequences(torch.arange(n_samples), sequence_length, device=self.policy_model.device)
+            elif all_steps is None:
+                all_steps = self.episode_buffer.collate(torch.arange(n_samples), device=self.policy_model.device)
+            with torch.no_grad():
+                logpas_pred_all, _, values_pred_all = _shared_predictions(self, all_steps)
+                values_pred_all = values_pred_all.reshape(all_steps.values.shape)
+                kl = (all_steps.logpas - logpas_pred_all).mean().item()
+                mse = (all_steps.values - values_pred_all).pow(2).mul(0.5).mean().item()
+        else:
+            kl, mse = (kl_sum / count).item(), (mse_sum / count).item()
+        kl_sum, mse_sum, count = 0.0, 0.0, 0
+        kls.append(kl)
+        mses.append(mse)
+
+        # Early stopping based on KL divergence and MSE thresholds
+        if kl > self.policy_stopping_kl or mse > self.value_stopping_mse:
             break
+    return {"kl": kls, "mse": mses}
+
+
+def _shared_predictions(self, batch):
+    # Windows of a SequenceMinibatch start from their stored recurrent state
+    if hasattr(batch, "hidden"):
+        return self.policy_model.get_predictions(batch.states, batch.actions, batch.hidden, batch.lengths)
+    return self.policy_model.get_predictions(batch.states, batch.actions)
+
+
+def _policy_losses(self, batch, logpas_pred, entropies_pred, gaes_mean, gaes_std):
+    # Normalized GAEs of the batch
+    gaes_batch = (batch.gaes - gaes_mean) / gaes_std
+
+    # Calculate the ratios
+    ratios = (logpas_pred - batch.logpas).exp()
+
+    # Calculate the unclipped policy objective
+    pi_obj = gaes_batch * ratios
+
+    # Calculate the clipped policy objective
+    pi_obj_clipped = gaes_batch * ratios.clamp(1.0 - self.policy_clip_range, 1.0 + self.policy_clip_range)
+
+    # Final policy loss using the minimum of unclipped and clipped objective
+    policy_loss = -torch.min(pi_obj, pi_obj_clipped).mean()
+
+    # Entropy loss for encouraging exploration
+    entropy_loss = -entropies_pred.mean() * self.entropy_loss_weight
+    return policy_loss, entropy_loss
+
+
+def _value_loss(self, batch, values_pred):
+    # Calculate the value loss
+    v_loss = (values_pred - batch.returns).pow(2)
+
+    # Clipped value prediction to prevent large updates
+    values_pred_clipped = batch.values + (values_pred - batch.values).clamp(-self.value_clip_range, self.value_clip_range)
+
+    # Clipped value loss
+    v_loss_clipped = (values_pred_clipped - batch.returns).pow(2)
+
+    # Final value loss using the maximum of unclipped and clipped loss
+    return torch.max(v_loss, v_loss_clipped).mul(0.5).mean()
@@ -1,6 +1,12 @@
 import sys
 
-from environment.environment import Environment, load_network_from_csv
+from environment.environment import Environment, load_network, load_network_from_csv
 from environment.nodes import Node
 from environment.vehicle import Vehicle
-from environment.arcs import Arc
\ No newline at end of file
+from environment.arcs import Arc
+from environment.network_state import NodeTable, ArcTable, FleetTable
+from environment.network_cache import NetworkCache
+from environment.adjacency import AdjacencyIndex
+from environment.routing import Router
+from environment.vector_environment import VectorEnvironment
+from environment.subprocess_vector_environment import SubprocessVectorEnvironment
\ No newline at end of file
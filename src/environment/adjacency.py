@@ -0,0 +1,117 @@
+import numpy as np
+
+
+class AdjacencyIndex:
+    """
+    Compressed sparse row (CSR) adjacency of the network, forward (outgoing arcs) and reverse
+    (incoming arcs), keyed by node row.
+
+    For the node of row r, the arcs leaving it are the arc rows arc_rows[indptr[r]:indptr[r + 1]]
+    and indices holds the rows of their target nodes (source nodes for the reverse index),
+    arcs of a node being in row order.
+
+    The arrays are built lazily in one pass over the source_row and target_row columns of the
+    arc table. Arcs added one at a time through add_arc are kept in a short pending list
+    scanned by the queries, until there are enough of them to make a rebuild worth it.
+    """
+
+    def __init__(self, node_table, arc_table):
+        """
+        Args:
+            node_table (NodeTable): Nodes of the network.
+            arc_table (ArcTable): Arcs of the network, with their source_row and target_row.
+        """
+        self.node_table = node_table
+        self.arc_table = arc_table
+        self._csr = None
+        self._pending = []
+
+    def invalidate(self):
+        """Drop the index, it is rebuilt by the next query. Called after bulk changes of the arcs."""
+        self._csr = None
+        self._pending = []
+
+    def add_arc(self, row):
+        """Record an arc appended to the arc table."""
+        if self._csr is None:
+            return
+        self._pending.append(row)
+        if len(self._pending) > max(64, len(self.arc_table) // 8):
+            self.invalidate()
+
+    def _build(self):
+        num_nodes = len(self.node_table)
+        self._csr = []
+        for key, other in (("source_row", "target_row"), ("target_row", "source_row")):
+            keys = self.arc_table[key]
+            arc_rows = np.argsort(keys, kind="stable")
+            indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=num_nodes), out=indptr[1:])
+            self._csr.append((indptr, self.arc_table[other][arc_rows], arc_rows))
+        self._pending = []
+
+    def csr(self, reverse=False):
+        """
+        Raw CSR arrays, including every arc added so far.
+
+        Args:
+            reverse (bool): Index the arcs by target node instead of source node.
+
+        Returns:
+            tuple: (indptr, indices, arc_rows) as described in the class docstring.
+        """
+        if self._csr is None or self._pending or len(self._csr[0][0]) != len(self.node_table) + 1:
+            self._build()
+        return self._csr[int(reverse)]
+
+    @property
+    def indptr(self):
+        return self.csr()[0]
+
+    @property
+    def indices(self):
+        return self.csr()[1]
+
+    @property
+    def reverse_indptr(self):
+        return self.csr(reverse=True)[0]
+
+    @property
+    def reverse_indices(self):
+        return self.csr(reverse=True)[1]
+
+    def _incident(self, node_row, reverse):
+        if self._csr is None:
+            self._build()
+        indptr, indices, arc_rows = self._csr[int(reverse)]
+        if node_row + 1 < len(indptr):
+            arcs, nodes = arc_rows[indptr[node_row]:indptr[node_row + 1]], indices[indptr[node_row]:indptr[node_row + 1]]
+        else:
+            arcs = nodes = np.zeros(0, dtype=np.int64)
+        if self._pending:
+            key, other = ("target_row", "source_row") if reverse else ("source_row", "target_row")
+            pending = np.array(self._pending, dtype=np.int64)
+            pending = pending[self.arc_table[key][pending] == node_row]
+            arcs = np.concatenate((arcs, pending))
+            nodes = np.concatenate((nodes, self.arc_table[other][pending]))
+        return arcs, nodes
+
+    def out_arcs(self, node_row):
+        """Rows of the arcs leaving the node of the given row."""
+        return self._incident(node_row, reverse=False)[0]
+
+    def in_arcs(self, node_row):
+        """Rows of the arcs entering the node of the given row."""
+        return self._incident(node_row, reverse=True)[0]
+
+    def successors(self, node_row):
+        """Rows of the targets of the arcs leaving the node, once per arc."""
+        return self._incident(node_row, reverse=False)[1]
+
+    def predecessors(self, node_row):
+        """Rows of the sources of the arcs entering the node, once per arc."""
+        return self._incident(node_row, reverse=True)[1]
+
+    def degrees(self, reverse=False):
+        """Out-degree (in-degree if reverse) of every node row."""
+        return np.diff(self.csr(reverse)[0])
@@ -1,6 +1,23 @@
 import torch
+from network_state import RowView, column_property, vehicles_property
+
+class Arc(RowView):
+    view_attributes = ("vehicles",)
+    columns = ("arc_type", "length", "travel_time", "capacity", "traffic_condition", "safety", "usage_cost", "open", "source", "target")
+
+    arc_type = column_property("arc_type")
+    length = column_property("length")
+    travel_time = column_property("travel_time")
+    capacity = column_property("capacity")
+    traffic_condition = column_property("traffic_condition")
+    safety = column_property("safety")
+    usage_cost = column_property("usage_cost")
+    open = column_property("open")
+    # The source_row and target_row columns, the adjacency and the routes are derived from the endpoints
+    source = column_property("source", read_only=True)
+    target = column_property("target", read_only=True)
+    vehicles = vehicles_property(0, "arc_id")
 
-class Arc:
     def __init__(self, arc_id, arc_type, length, travel_time, capacity, traffic_condition, safety, usage_cost, open, source, target, vehicles):
         """
         Initialize an arc in the transportation network.
@@ -18,7 +35,11 @@ class Arc:
             source (int): ID of the source node.
             target (int): ID of the target node.
             vehicles (list): List of Vehicle objects currently on the arc.
+
+        Once the arc is added to an Environment, its attributes are views on a row of the environment's ArcTable
+        and its vehicles are those of the environment's fleet located on the arc.
         """
+        self._init_view()
         self.arc_id = arc_id
         self.arc_type = arc_type
         self.length = length
@@ -33,10 +54,16 @@ class Arc:
         self.vehicles = vehicles
 
     def add_vehicle(self, vehicle):
-        self.vehicles.append(vehicle)
+        if self._table is None:
+            self._vehicles.append(vehicle)
+        else:
+            self._fleet.place(vehicle, 0, self.arc_id)
 
     def remove_vehicle(self, vehicle_id):
-        self.vehicles = [v for v in self.vehicles if v.vehicle_id != vehicle_id]
+        if self._table is None:
+            self._vehicles = [v for v in self._vehicles if v.id != vehicle_id]
+        else:
+            self._fleet.take(vehicle_id, 0, self.arc_id)
 
     def get_id(self):
         return self.arc_id
@@ -75,13 +102,13 @@ class Arc:
         return (f"Arc(id={self.arc_id}, type={self.arc_type.tolist()}, length={self.length} km, "
                 f"travel_time={self.travel_time} min, capacity={self.capacity}, traffic_condition={self.traffic_condition}, "
                 f"safety={self.safety}, usage_cost={self.usage_cost}, open={self.open}, source={self.source}, "
-                f"target={self.target}, vehicles={[v.vehicle_id for v in self.vehicles]})")
+                f"target={self.target}, vehicles={[v.id for v in self.vehicles]})")
 
 # Exemple d'utilisation
 if __name__ == "__main__":
     class Vehicle:
         def __init__(self, vehicle_id, in_service, vehicle_type, is_node, location_id, next_departure, capacity, capacity_left, service_hours):
-            self.vehicle_id = vehicle_id
+            self.id = vehicle_id
             self.in_service = in_service
             self.vehicle_type = vehicle_type
             self.is_node = is_node
@@ -93,7 +120,7 @@ if __name__ == "__main__":
 
         def to_tensor(self):
             return torch.tensor([
-                self.vehicle_id, self.in_service, *self.vehicle_type.tolist(), self.is_node, self.location_id,
+                self.id, self.in_service, *self.vehicle_type.tolist(), self.is_node, self.location_id,
                 self.next_departure, self.capacity, self.capacity_left, *self.service_hours.tolist()
             ], dtype=torch.float)
 
@@ -1,35 +1,136 @@
 import sys
 sys.path.append("../../")
 
+import math
+import os
 import numpy as np
 import pandas as pd
 import torch
-import ast
 from torch_geometric.data import Data
 from torch_geometric.utils import to_networkx
 from nodes import Node
 from arcs import Arc
 from vehicle import Vehicle
-from update import update_demand
+from network_state import NodeTable, ArcTable, FleetTable, RowViews, FleetViews
+from observation import ObservationBuilder, NODE_FEATURES, ARC_FEATURES
+from snapshot import write_snapshot, read_snapshot, FORMAT_VERSION as SNAPSHOT_FORMAT_VERSION
+from network_cache import NetworkCache
+from adjacency import AdjacencyIndex
+from routing import Router
+from simulation import Simulator
+from update import DemandModel
+from reward import RewardTracker, demand_penalty
 
 class Environment:
     def __init__(self):
-        self.nodes = {}
-        self.arcs = {}
-        self.vehicles = {}
         self.current_time = 0
+        # Stream of the sampled demand (see DemandModel), one per episode so that runs in parallel draw different demand
+        self.episode_id = 0
+        # Set for snapshots opened with mode "r", whose columns cannot be written
+        self.read_only = False
+        self.demand_model = DemandModel()
+        self._set_tables(NodeTable(), ArcTable(), FleetTable())
+        self.simulator = Simulator(self)
+
+    def _set_tables(self, node_table, arc_table, fleet):
+        # Columnar backing store, Node, Arc and Vehicle objects are views on their rows created on first access
+        self.node_table = node_table
+        self.arc_table = arc_table
+        self.fleet = fleet
+        self.nodes = RowViews(node_table, self._node_view)
+        self.arcs = RowViews(arc_table, self._arc_entry)
+        self.vehicles = FleetViews(fleet, self._vehicle_view)
+        self.adjacency = AdjacencyIndex(node_table, arc_table)
+        self.router = Router(self)
+        self.reward_tracker = RewardTracker()
+        node_table.trackers["demand"] = self.reward_tracker
+        self.observation_builder = ObservationBuilder(node_table, arc_table)
+
+    def _node_view(self, node_id, row):
+        return Node.from_row(self.node_table, row, node_id=node_id, _fleet=self.vehicles)
+
+    def _vehicle_view(self, vehicle_id, row):
+        return Vehicle.from_row(self.fleet, row, id=vehicle_id)
+
+    def _arc_entry(self, arc_id, row):
+        arc = Arc.from_row(self.arc_table, row, arc_id=arc_id, _fleet=self.vehicles)
+        source = self.node_table.ids[self.arc_table["source_row"][row]].item()
+        target = self.node_table.ids[self.arc_table["target_row"][row]].item()
+        return (arc, source, target)
 
     def add_node(self, node):
         if node.node_id in self.nodes:
             raise ValueError(f"Node with ID {node.node_id} already exists.")
+        vehicles = node.vehicles
+        row = self.node_table.append(node.node_id, node.column_values())
+        node.bind(self.node_table, row)
+        node._fleet = self.vehicles
         self.nodes[node.node_id] = node
+        for vehicle in vehicles:
+            node.add_vehicle(vehicle)
 
     def add_arc(self, arc, source, target):
         if source not in self.nodes or target not in self.nodes:
             raise ValueError(f"Source or target node does not exist.")
         if arc.arc_id in self.arcs:
             raise ValueError(f"Arc with ID {arc.arc_id} already exists.")
+        values = arc.column_values()
+        values["source_row"] = self.node_table.row(source)
+        values["target_row"] = self.node_table.row(target)
+        vehicles = arc.vehicles
+        row = self.arc_table.append(arc.arc_id, values)
+        self.adjacency.add_arc(row)
+        arc.bind(self.arc_table, row)
+        arc._fleet = self.vehicles
         self.arcs[arc.arc_id] = (arc, source, target)
+        for vehicle in vehicles:
+            arc.add_vehicle(vehicle)
+
+    def add_nodes(self, node_ids, columns):
+        """
+        Add many nodes at once from column arrays.
+
+        Args:
+            node_ids (array-like): IDs of the new nodes.
+            columns (dict): Node attribute name to array, one entry (or row for list-valued attributes) per node.
+        """
+        self.node_table.extend(node_ids, columns)
+
+    def add_arcs(self, arc_ids, sources, targets, columns):
+        """
+        Add many arcs at once from column arrays.
+
+        Args:
+            arc_ids (array-like): IDs of the new arcs.
+            sources (array-like): ID of the source node of each arc.
+            targets (array-like): ID of the target node of each arc.
+            columns (dict): Arc attribute name to array, one entry (or row for list-valued attributes) per arc.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        source_rows = self.node_rows(sources)
+        target_rows = self.node_rows(targets)
+        missing = (source_rows < 0) | (target_rows < 0)
+        if missing.any():
+            arc_ids = np.asarray(arc_ids)
+            raise ValueError(f"Source or target node does not exist for arcs {arc_ids[missing].tolist()}.")
+        columns = dict(columns, source=sources, target=targets, source_row=source_rows, target_row=target_rows)
+        self.arc_table.extend(arc_ids, columns)
+        self.adjacency.invalidate()
+
+    def node_rows(self, node_ids):
+        """Rows of the given node IDs in the node table, -1 for unknown IDs."""
+        return self.node_table.rows(node_ids)
+
+    def add_vehicle(self, vehicle):
+        """Add a vehicle to the fleet, on the node or arc given by its location."""
+        if vehicle.id in self.vehicles:
+            raise ValueError(f"Vehicle with ID {vehicle.id} already exists.")
+        if vehicle.is_node and vehicle.location_id not in self.nodes:
+            raise ValueError(f"Node with ID {vehicle.location_id} does not exist.")
+        if not vehicle.is_node and vehicle.location_id not in self.arcs:
+            raise ValueError(f"Arc with ID {vehicle.location_id} does not exist.")
+        self.vehicles.add(vehicle)
 
     def get_node(self, node_id):
         return self.nodes.get(node_id, None)
@@ -37,242 +138,295 @@ class Environment:
     def get_arc(self, arc_id):
         return self.arcs.get(arc_id, None)
 
+    def observation(self, clone=False):
+        """
+        Current graph observation, built incrementally from the node and arc tables.
+
+        Args:
+            clone (bool): If False, the returned Data shares its buffers with the environment
+                and is overwritten by the next call.
+        """
+        return self.observation_builder.build(clone=clone)
+
     def to_pyg_data(self):
-        node_features = []
-        edge_index = []
-        edge_attr = []
-        node_sizes = []
-        arc_sizes = []
-
-        node_index = {node_id: i for i, node_id in enumerate(self.nodes)}
-
-        for node_id, node in self.nodes.items():
-            node_attr = [
-                node.node_type,
-                node.coordinates,
-                torch.tensor([node.capacity], dtype=torch.float),
-                torch.tensor([node.staff], dtype=torch.float),
-                node.service_hours,
-                torch.tensor([node.demand], dtype=torch.float)
-            ]
-            node_sizes.append([node_id] + [len(attr) for attr in node_attr])
-            node_features.append(torch.cat(node_attr))
-
-        for arc_id, (arc, source, target) in self.arcs.items():
-            if source not in self.nodes or target not in self.nodes:
-                raise ValueError(f"Source or target node does not exist.")
-            
-            arc_attr = [
-                arc.arc_type, 
-                torch.tensor([arc.length], dtype=torch.float), 
-                torch.tensor([arc.travel_time], dtype=torch.float), 
-                torch.tensor([arc.capacity], dtype=torch.float), 
-                torch.tensor([arc.traffic_condition], dtype=torch.float),
-                torch.tensor([arc.safety], dtype=torch.float), 
-                torch.tensor([arc.usage_cost], dtype=torch.float), 
-                torch.tensor([arc.open], dtype=torch.float)
-            ]
-            arc_sizes.append([arc_id] + [len(attr) for attr in arc_attr])
-            edge_index.append([node_index[source], node_index[target]])
-            edge_attr.append(torch.cat(arc_attr))
-
-        x = torch.stack(node_features)
-        edge_index = torch.tensor(edge_index, dtype=torch.long).t().contiguous()
-        edge_attr = torch.stack(edge_attr)
-
-        node_sizes_df = pd.DataFrame(node_sizes, columns=['node_id', 'node_type_size', 'coordinates_size', 'capacity_size', 'staff_size', 'service_hours_size', 'demand_size'])
-        arc_sizes_df = pd.DataFrame(arc_sizes, columns=['arc_id', 'arc_type_size', 'length_size', 'travel_time_size', 'capacity_size', 'traffic_condition_size', 'safety_size', 'usage_cost_size', 'open_size'])
-
-        return Data(x=x, edge_index=edge_index, edge_attr=edge_attr), node_sizes_df, arc_sizes_df
+        data = self.observation(clone=True)
+        node_sizes_df, arc_sizes_df = self.observation_builder.sizes()
+        return data, node_sizes_df, arc_sizes_df
 
     def from_pyg_data(self, data, node_sizes_df, arc_sizes_df):
-        self.nodes.clear()
-        self.arcs.clear()
-
-        node_features = data.x.tolist()
-        edge_index = data.edge_index.t().tolist()
-        edge_attr = data.edge_attr.tolist()
-
-        node_id_to_idx = {row['node_id']: idx for idx, row in node_sizes_df.iterrows()}
-        arc_id_to_idx = {row['arc_id']: idx for idx, row in arc_sizes_df.iterrows()}
-
-        # Add nodes
-        for node_id, idx in node_id_to_idx.items():
-            node_sizes = node_sizes_df.iloc[idx]
-            start = 0
-            node_type = node_features[idx][start:start + node_sizes['node_type_size']]
-            start += node_sizes['node_type_size']
-            coordinates = node_features[idx][start:start + node_sizes['coordinates_size']]
-            start += node_sizes['coordinates_size']
-            capacity = node_features[idx][start:start + node_sizes['capacity_size']][0]
-            start += node_sizes['capacity_size']
-            staff = node_features[idx][start:start + node_sizes['staff_size']][0]
-            start += node_sizes['staff_size']
-            service_hours = node_features[idx][start:start + node_sizes['service_hours_size']]
-            start += node_sizes['service_hours_size']
-            demand = node_features[idx][start:start + node_sizes['demand_size']][0]
-
-            node = Node(
-                node_id=node_id,
-                node_type=torch.tensor(node_type, dtype=torch.float),
-                coordinates=torch.tensor(coordinates, dtype=torch.float),
-                capacity=int(capacity),
-                vehicles=[],
-                staff=int(staff),
-                service_hours=torch.tensor(service_hours, dtype=torch.float),
-                demand=int(demand)
-            )
-            self.add_node(node)
-
-        print("nodes are : ---")
-        print(self.nodes.keys())
-        print("---")
-
-        # Create a mapping from index to node_id
-        idx_to_node_id = {v: k for k, v in node_id_to_idx.items()}
-
-        # Add arcs
-        for arc_id, idx in arc_id_to_idx.items():
-            arc_sizes = arc_sizes_df.iloc[idx]
-            start = 0
-            arc_type = edge_attr[idx][start:start + arc_sizes['arc_type_size']]
-            start += arc_sizes['arc_type_size']
-            length = edge_attr[idx][start:start + arc_sizes['length_size']][0]
-            start += arc_sizes['length_size']
-            travel_time = edge_attr[idx][start:start + arc_sizes['travel_time_size']][0]
-            start += arc_sizes['travel_time_size']
-            capacity = edge_attr[idx][start:start + arc_sizes['capacity_size']][0]
-            start += arc_sizes['capacity_size']
-            traffic_condition = edge_attr[idx][start:start + arc_sizes['traffic_condition_size']][0]
-            start += arc_sizes['traffic_condition_size']
-            safety = edge_attr[idx][start:start + arc_sizes['safety_size']][0]
-            start += arc_sizes['safety_size']
-            usage_cost = edge_attr[idx][start:start + arc_sizes['usage_cost_size']][0]
-            start += arc_sizes['usage_cost_size']
-            open_status = edge_attr[idx][start:start + arc_sizes['open_size']][0]
-
-            source_idx = edge_index[idx][0]
-            target_idx = edge_index[idx][1]
-
-            source = idx_to_node_id[source_idx]
-            target = idx_to_node_id[target_idx]
-
-            # Ensure the source and target nodes exist
-            if source not in self.nodes or target not in self.nodes:
-                raise ValueError(f"Source or target node does not exist for arc {arc_id} (source: {source}, target: {target})")
-
-            arc = Arc(
-                arc_id=arc_id,
-                arc_type=torch.tensor(arc_type, dtype=torch.float),
-                length=float(length),
-                travel_time=float(travel_time),
-                capacity=int(capacity),
-                traffic_condition=int(traffic_condition),
-                safety=int(safety),
-                usage_cost=float(usage_cost),
-                open=int(open_status),
-                source=source,
-                target=target,
-                vehicles=[]
-            )
-            self.add_arc(arc, source, target)
-
+        """
+        Restore the network from the output of to_pyg_data.
+
+        Feature columns are sliced out of x and edge_attr as tensor views at offsets computed
+        from the sizes DataFrames and added in bulk to the node and arc tables. The fleet and
+        the pending events refer to rows of the previous network, they are dropped with it.
+        """
+        self._set_tables(NodeTable(), ArcTable(), FleetTable())
+        self.simulator = Simulator(self)
+
+        node_ids = node_sizes_df["node_id"].to_numpy()
+        node_columns = self._slice_features(data.x, node_sizes_df, NODE_FEATURES, self.node_table)
+        self.add_nodes(node_ids, node_columns)
+
+        arc_ids = arc_sizes_df["arc_id"].to_numpy()
+        edge_index = data.edge_index.numpy()
+        arc_columns = self._slice_features(data.edge_attr, arc_sizes_df, ARC_FEATURES, self.arc_table)
+        self.add_arcs(arc_ids, node_ids[edge_index[0]], node_ids[edge_index[1]], arc_columns)
+
+    @staticmethod
+    def _slice_features(features, sizes_df, names, table):
+        sizes = sizes_df[[f"{name}_size" for name in names]].to_numpy()
+        if len(sizes) == 0:
+            return {}
+        if (sizes != sizes[0]).any():
+            raise ValueError("Attribute sizes must be the same for every row to restore from PyG data.")
+        offsets = np.concatenate(([0], np.cumsum(sizes[0])))
+        features = features.detach().cpu().numpy()
+        columns = {}
+        for name, start, stop in zip(names, offsets[:-1], offsets[1:]):
+            if name in table.vector_columns:
+                columns[name] = features[:, start:stop]
+            elif stop - start == 1:
+                columns[name] = features[:, start]
+            else:
+                raise ValueError(f"Attribute {name} must have size 1, got {stop - start}.")
+        return columns
+
+    def save_snapshot(self, file_path):
+        """
+        Save the network to a single binary snapshot file (see snapshot.py for the layout).
+
+        Args:
+            file_path (str): Destination of the snapshot.
+        """
+        arrays = {}
+        for prefix, table in (("nodes", self.node_table), ("arcs", self.arc_table), ("vehicles", self.fleet)):
+            arrays.update({f"{prefix}/{name}": array for name, array in table.to_arrays().items()})
+        write_snapshot(file_path, arrays, {"current_time": self.current_time, "episode_id": self.episode_id})
+
+    @classmethod
+    def load_snapshot(cls, file_path, mode="c"):
+        """
+        Open a network snapshot written by save_snapshot.
+
+        The node, arc and vehicle columns are memory-mapped, so that processes opening the
+        same snapshot share one copy of the network until they modify it. Trips in progress
+        resume from the position of the vehicles, see Simulator.resume.
+
+        Args:
+            file_path (str): Path of the snapshot.
+            mode (str): "c" for copy-on-write columns, "r" for read-only ones. Only a copy-on-write
+                environment can be advanced.
+
+        Returns:
+            Environment: The restored network.
+        """
+        arrays, metadata = read_snapshot(file_path, mode=mode)
+        tables = {}
+        for prefix in ("nodes", "arcs", "vehicles"):
+            tables[prefix] = {name[len(prefix) + 1:]: array for name, array in arrays.items() if name.startswith(prefix + "/")}
+        environment = cls()
+        environment._set_tables(NodeTable.from_arrays(tables["nodes"]), ArcTable.from_arrays(tables["arcs"]), FleetTable.from_arrays(tables["vehicles"]))
+        environment.current_time = metadata["current_time"]
+        environment.episode_id = metadata.get("episode_id", 0)
+        environment.read_only = mode == "r"
+        environment.simulator.now = environment.current_time
+        environment.simulator.resume()
+        return environment
 
     def get_state(self):
         state = {
-            "nodes": {node_id: node.__dict__ for node_id, node in self.nodes.items()},
-            "arcs": {arc_id: arc[0].__dict__ for arc_id, arc in self.arcs.items()}
+            "nodes": {node_id: node.to_dict() for node_id, node in self.nodes.items()},
+            "arcs": {arc_id: arc[0].to_dict() for arc_id, arc in self.arcs.items()}
         }
         return state
     
     def step(self, schedule):
+        reward, done = self.advance(schedule)
+        new_state = self.get_state()
+        
+        return new_state, reward, done
+
+    def advance(self, schedule, duration=None):
+        """
+        Apply the schedule and move the simulation forward, without building the state dict.
+
+        Args:
+            schedule (list): Events, see apply_event.
+            duration (float): Hours to simulate. If None, time jumps to the next event of the
+                simulator moving a vehicle, or by one hour if there is none.
+        """
+        if self.read_only:
+            raise ValueError("A snapshot opened read-only cannot be advanced, load it with mode='c'.")
         for event in schedule:
             self.apply_event(event)
-        
-        self.update_state()
-        self.current_time += 1
+
+        start = self.current_time
+        if duration is None:
+            # Events due now are processed first, then time jumps to the next one
+            self.simulator.run_until(start)
+            next_time = self.simulator.next_event_time()
+            end = next_time if next_time is not None else float(start + 1)
+        else:
+            end = float(start + duration)
+        self.simulator.run_until(end)
+
+        # Demand arrives once for every hour started during the elapsed time
+        for hour in range(math.ceil(start), math.ceil(end)):
+            self.current_time = hour
+            self.update_state()
+        self.current_time = end
         reward = self.calculate_reward()
         done = False
-        new_state = self.get_state()
-        
-        return new_state, reward, done
+        return reward, done
+
+    def checkpoint(self):
+        """Copy of the node, arc and vehicle columns and of the time, to be given back to restore."""
+        return {
+            "current_time": self.current_time,
+            "simulator": self.simulator.checkpoint(),
+            "nodes": {name: array.copy() for name, array in self.node_table.to_arrays().items()},
+            "arcs": {name: array.copy() for name, array in self.arc_table.to_arrays().items()},
+            "vehicles": {name: array.copy() for name, array in self.fleet.to_arrays().items()},
+        }
+
+    def restore(self, checkpoint):
+        """Write back the columns saved by checkpoint, the network and the fleet must have the same rows."""
+        self.current_time = checkpoint["current_time"]
+        self.simulator.restore(checkpoint["simulator"])
+        self.node_table.load_arrays(checkpoint["nodes"])
+        self.arc_table.load_arrays(checkpoint["arcs"])
+        self.fleet.load_arrays(checkpoint["vehicles"])
     
     def apply_event(self, event):
-        pass
+        """
+        Schedule a trip.
+
+        Args:
+            event (tuple): (vehicle_id, departure_time, circuit) with circuit the list of node IDs
+                of the trip, starting with the node where the vehicle is.
+        """
+        vehicle_id, departure_time, circuit = event
+        self.simulator.schedule_trip(self.vehicles[vehicle_id], departure_time, circuit)
 
     def calculate_reward(self):
-        total_unsatisfied_demand = sum(node.demand for node in self.nodes.values())
-        demands = [node.demand for node in self.nodes.values()]
-        demand_std_dev = np.std(demands)
-        reward = - (total_unsatisfied_demand + 0.1 * demand_std_dev)
-        return reward
+        # The tracker follows the writes of the demand column, it is only reset after
+        # untracked writes (bulk writes through node_table["demand"], rows added)
+        tracker = self.reward_tracker
+        if tracker.version != self.node_table.versions["demand"] or tracker.count != len(self.node_table):
+            tracker.reset(self.node_table["demand"], self.node_table.versions["demand"])
+        return float(demand_penalty(tracker.total, tracker.std))
     
     def update_state(self):
-        for vehicle in self.vehicles.values():
-            self.vehicle_step(vehicle)
-
-        for node in self.nodes.values():
-            self.update_demand(node)
-            pass
-
-        for arc in self.arcs.values():
-            pass
+        # Vehicles are moved by the simulator events
+        self.update_demand()
     
-    def update_demand(self, node):
-        node.demand += update_demand(self.current_time)
-
-    def vehicle_step(self, vehicle):
-        pass
+    def update_demand(self, node=None):
+        """Add the demand arriving at the current hour to every node at once, or to a single node."""
+        arrivals = self.demand_model.arrivals(self.current_time, len(self.node_table), self.episode_id)
+        if node is None:
+            self.node_table.add("demand", arrivals)
+        else:
+            row = self.node_table.row(node.node_id)
+            self.node_table.add("demand", arrivals[row], rows=row)
 
     def __repr__(self):
         return f"Environment(nodes={list(self.nodes.keys())}, arcs={list(self.arcs.keys())})"
 
 
-def load_network_from_csv(node_file_path, arc_file_path):
+def read_table(file_path):
+    """Read a node or arc table from a CSV, Parquet or Feather file (the latter two need pyarrow)."""
+    file_path = str(file_path)
+    if file_path.endswith((".parquet", ".pq")):
+        return pd.read_parquet(file_path)
+    if file_path.endswith((".feather", ".arrow")):
+        return pd.read_feather(file_path)
+    return pd.read_csv(file_path)
+
+
+def parse_list_column(df, name):
+    """
+    Parse a list-valued attribute of a node or arc table into a 2-D float array.
+
+    The attribute can be stored either in flat columns ``name_0, name_1, ...``, as list
+    values (Parquet/Feather), or as list-encoded strings such as "[1, 0, 0]" or "(6, 22)".
+    Rows shorter than the longest one are zero padded.
+    """
+    prefix = f"{name}_"
+    flat_columns = [c for c in df.columns if c.startswith(prefix) and c[len(prefix):].isdigit()]
+    if flat_columns:
+        flat_columns.sort(key=lambda c: int(c[len(prefix):]))
+        return df[flat_columns].to_numpy(dtype=np.float32)
+
+    column = df[name]
+    if len(column) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    if not isinstance(column.iloc[0], str):
+        return np.stack([np.asarray(value, dtype=np.float32) for value in column])
+    values = column.str.strip("[]() ").str.split(",", expand=True)
+    values = values.replace(r"^\s*$", np.nan, regex=True)
+    return values.astype(np.float32).fillna(0).to_numpy()
+
+
+# Bump when load_network builds networks differently, to invalidate the cached ones
+LOADER_VERSION = 1
+
+
+def load_network(node_file_path, arc_file_path):
+    """
+    Load a network from node and arc tables in a single columnar pass.
+
+    Args:
+        node_file_path (str): Path of the node table (CSV, Parquet or Feather).
+        arc_file_path (str): Path of the arc table (CSV, Parquet or Feather).
+
+    Returns:
+        Environment: The loaded network.
+    """
     environment = Environment()
-    
-    df_nodes = pd.read_csv(node_file_path)
-    for _, row in df_nodes.iterrows():
-        node = Node(
-            node_id=row["node_id"],
-            node_type=torch.tensor(ast.literal_eval(row["node_type"]), dtype=torch.float),
-            coordinates=torch.tensor(ast.literal_eval(row["coordinates"]), dtype=torch.float),
-            capacity=row["capacity"],
-            vehicles=[],
-            staff=row["staff"],
-            service_hours=torch.tensor(ast.literal_eval(row["service_hours"]), dtype=torch.float),
-            demand=row["demand"]
-        )
-        environment.add_node(node)
-    
-    df_arcs = pd.read_csv(arc_file_path)
-    for _, row in df_arcs.iterrows():
-        arc = Arc(
-            arc_id=row["arc_id"],
-            arc_type=torch.tensor(ast.literal_eval(row["arc_type"]), dtype=torch.float),
-            length=row["length"],
-            travel_time=row["travel_time"],
-            capacity=row["capacity"],
-            traffic_condition=row["traffic_condition"],
-            safety=row["safety"],
-            usage_cost=row["usage_cost"],
-            open=row["open"],
-            source=row["source"],
-            target=row["target"],
-            vehicles=[]
-        )
-        environment.add_arc(arc, row["source"], row["target"])
-    
+
+    df_nodes = read_table(node_file_path)
+    node_columns = {name: df_nodes[name].to_numpy() for name in ("capacity", "staff", "demand")}
+    for name in ("node_type", "coordinates", "service_hours"):
+        node_columns[name] = parse_list_column(df_nodes, name)
+    environment.add_nodes(df_nodes["node_id"].to_numpy(), node_columns)
+
+    df_arcs = read_table(arc_file_path)
+    arc_columns = {name: df_arcs[name].to_numpy() for name in ("length", "travel_time", "capacity", "traffic_condition", "safety", "usage_cost", "open")}
+    arc_columns["arc_type"] = parse_list_column(df_arcs, "arc_type")
+    environment.add_arcs(df_arcs["arc_id"].to_numpy(), df_arcs["source"].to_numpy(), df_arcs["target"].to_numpy(), arc_columns)
+
     return environment
 
+
+def load_network_from_csv(node_file_path, arc_file_path, cache=None):
+    """
+    Load a network, optionally going through the on-disk network cache.
+
+    Args:
+        node_file_path (str): Path of the node table.
+        arc_file_path (str): Path of the arc table.
+        cache (bool or NetworkCache): True for the default cache (see NetworkCache), False to always
+            parse the files. If None, the cache is only used when $TSC_NETWORK_CACHE_DIR is set.
+    """
+    if cache is None:
+        cache = "TSC_NETWORK_CACHE_DIR" in os.environ
+    if cache is False:
+        return load_network(node_file_path, arc_file_path)
+    if cache is True:
+        cache = NetworkCache()
+    return cache.get_or_build(
+        (node_file_path, arc_file_path),
+        f"{LOADER_VERSION}.{SNAPSHOT_FORMAT_VERSION}",
+        lambda: load_network(node_file_path, arc_file_path),
+        Environment.load_snapshot
+    )
+
 # Example usage
 if __name__ == "__main__":
     node_file_path = "../../data/generated/nodes_example_1.csv"
     arc_file_path = "../../data/generated/arcs_example_1.csv"
     
     environment = load_network_from_csv(node_file_path, arc_file_path)
-    pyg_data, node_sizes_df, arc_sizes_df = environment.to_pyg_data()
-    torch.save(pyg_data, "../../data/generated/environment.pth")
-    node_sizes_df.to_csv("../../data/generated/node_sizes.csv", index=False)
-    arc_sizes_df.to_csv("../../data/generated/arc_sizes.csv", index=False)
-    print("Graph and sizes saved to environment.pth, node_sizes.csv, and arc_sizes.csv")
\ No newline at end of file
+    environment.save_snapshot("../../data/generated/environment.snap")
+    print("Network saved to environment.snap")
\ No newline at end of file
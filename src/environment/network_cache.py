@@ -0,0 +1,113 @@
+import hashlib
+import os
+import tempfile
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "transport_system_control", "networks")
+
+
+class NetworkCache:
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024 ** 3, max_age=7 * 24 * 3600):
+        """
+        On-disk cache of built networks, stored as snapshots keyed by the content of their input files.
+
+        Entries are never invalidated explicitly: any change in the input files or in the
+        loader version gives a new key, and stale entries are evicted by age and total size.
+
+        Args:
+            cache_dir (str): Directory of the cache. Defaults to $TSC_NETWORK_CACHE_DIR or ~/.cache/transport_system_control/networks.
+            max_bytes (int): Maximum total size of the cached snapshots, least recently used entries are evicted first.
+            max_age (float): Entries not used for more than max_age seconds are evicted.
+        """
+        self.cache_dir = cache_dir or os.environ.get("TSC_NETWORK_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    @staticmethod
+    def key(file_paths, version):
+        """SHA-256 of the loader version and of the content of the input files."""
+        digest = hashlib.sha256(str(version).encode("utf-8"))
+        for file_path in file_paths:
+            digest.update(b"\x00")
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.snap")
+
+    def get_or_build(self, file_paths, version, build, load):
+        """
+        Load the network built from file_paths from the cache, building and caching it on a miss.
+
+        Args:
+            file_paths (tuple): Input files of the network.
+            version (str): Version of the loader, part of the key.
+            build (callable): Called without arguments to build the network on a miss.
+            load (callable): Called with the path of a cached snapshot to load it.
+
+        Returns:
+            Environment: The network.
+        """
+        path = self.path(self.key(file_paths, version))
+        if os.path.exists(path):
+            try:
+                environment = load(path)
+                os.utime(path)
+                return environment
+            except Exception:
+                # Truncated, corrupted or concurrently evicted entry, drop it and rebuild it
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        environment = build()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so that concurrent workers never read a partial snapshot
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                environment.save_snapshot(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.evict()
+        except OSError:
+            pass  # The cache is an optimization, an unwritable cache directory must not break loading
+        return environment
+
+    def evict(self):
+        """Remove entries older than max_age, then the least recently used ones until the cache fits in max_bytes."""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".snap"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".snap"):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,597 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+import torch
+
+
+class ColumnTable:
+    """
+    Growable struct-of-arrays storage for the rows of the transportation network.
+
+    Scalar attributes live in one 1-D array per column and list-valued attributes
+    (one-hot types, coordinates, service hours) in one 2-D array per column, each
+    row keeping its own width. Arrays are over-allocated and grown by doubling so
+    that appending rows one at a time stays amortized O(1).
+
+    Arrays returned by ``table[name]`` are views on the live rows: they are
+    writable, but only valid until the next append that triggers a reallocation.
+    Code writing through them in bulk must call ``mark_dirty(name)`` so that
+    consumers relying on ``versions`` (e.g. the ObservationBuilder) see the change.
+
+    ``versions`` counts the writes of each column and ``layout_version`` the
+    changes of the table layout (rows added or removed, vector columns widened).
+
+    ``trackers`` maps scalar column names to objects keeping statistics of the
+    column up to date (e.g. a RewardTracker). ``set`` and ``add`` report their
+    changes to a tracker through ``tracker.update(old, new)`` as long as it has
+    seen every previous write (``tracker.version`` equal to the column version);
+    after any other write the tracker is out of date and must be reset.
+    """
+
+    scalar_columns = {}
+    vector_columns = {}
+
+    def __init__(self, capacity=16):
+        """
+        Args:
+            capacity (int): Number of rows allocated up front.
+        """
+        capacity = max(int(capacity), 1)
+        self.size = 0
+        self.index = {}
+        self._capacity = capacity
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._scalars = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.scalar_columns.items()}
+        self._vectors = {name: np.zeros((capacity, 0), dtype=dtype) for name, dtype in self.vector_columns.items()}
+        self._widths = {name: np.zeros(capacity, dtype=np.int64) for name in self.vector_columns}
+        self.versions = {name: 0 for name in list(self.scalar_columns) + list(self.vector_columns)}
+        self.layout_version = 0
+        self._sorted_ids = None
+        self.trackers = {}
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item_id):
+        return item_id in self.index
+
+    def __getitem__(self, name):
+        if name in self._scalars:
+            return self._scalars[name][:self.size]
+        if name in self._vectors:
+            return self._vectors[name][:self.size]
+        raise KeyError(f"Column {name} not found in {type(self).__name__}.")
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    def width(self, name):
+        """Per-row width of a vector column."""
+        return self._widths[name][:self.size]
+
+    def column_width(self, name):
+        """Number of features the column takes in a feature matrix: 1 for scalars, the padded width for vectors."""
+        if name in self._scalars:
+            return 1
+        return self._vectors[name].shape[1]
+
+    def mark_dirty(self, name):
+        self.versions[name] += 1
+
+    def row(self, item_id):
+        return self.index[item_id]
+
+    def rows(self, item_ids):
+        """Rows of many IDs at once, -1 for unknown IDs."""
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        if self.size == 0:
+            return np.full(item_ids.shape, -1, dtype=np.int64)
+        if self._sorted_ids is None or self._sorted_ids[0] != self.layout_version:
+            order = np.argsort(self.ids, kind="stable")
+            self._sorted_ids = (self.layout_version, order, self.ids[order])
+        _, order, sorted_ids = self._sorted_ids
+        rows = order[np.searchsorted(sorted_ids, item_ids).clip(max=self.size - 1)]
+        return np.where(self.ids[rows] == item_ids, rows, -1)
+
+    def append(self, item_id, values):
+        """
+        Append a row and fill it with the given column values.
+
+        Args:
+            item_id (int): Identifier of the row (node_id or arc_id).
+            values (dict): Column name to value. Missing columns are left at zero.
+
+        Returns:
+            int: The row index of the new item.
+        """
+        if item_id in self.index:
+            raise ValueError(f"Row with ID {item_id} already exists.")
+        if self.size == self._capacity:
+            self.reserve(2 * self._capacity)
+        row = self.size
+        self._ids[row] = item_id
+        for column in self._scalars.values():
+            column[row] = 0
+        for name, column in self._vectors.items():
+            column[row] = 0
+            self._widths[name][row] = 0
+        self.index[item_id] = row
+        self.size += 1
+        self.layout_version += 1
+        for name, value in values.items():
+            self.set(name, row, value)
+        return row
+
+    def extend(self, item_ids, values):
+        """
+        Append many rows at once from column arrays.
+
+        Args:
+            item_ids (array-like): Identifiers of the new rows.
+            values (dict): Column name to array of length len(item_ids), or of shape
+                (len(item_ids), width) for vector columns. Missing columns are left at zero.
+
+        Returns:
+            np.ndarray: The row indices of the new items.
+        """
+        item_ids = np.asarray(item_ids, dtype=np.int64).reshape(-1)
+        count = len(item_ids)
+        if len(np.unique(item_ids)) != count:
+            raise ValueError("Duplicate IDs in the rows to add.")
+        if self.size and np.isin(item_ids, self.ids).any():
+            duplicates = item_ids[np.isin(item_ids, self.ids)]
+            raise ValueError(f"Rows with IDs {duplicates.tolist()} already exist.")
+        if self.size + count > self._capacity:
+            self.reserve(max(2 * self._capacity, self.size + count))
+        start, stop = self.size, self.size + count
+        self._ids[start:stop] = item_ids
+        for column in self._scalars.values():
+            column[start:stop] = 0
+        for name, column in self._vectors.items():
+            column[start:stop] = 0
+            self._widths[name][start:stop] = 0
+        for name, value in values.items():
+            self.versions[name] += 1
+            if name in self._scalars:
+                self._scalars[name][start:stop] = value
+                continue
+            value = np.asarray(value, dtype=self._vectors[name].dtype).reshape(count, -1)
+            width = value.shape[1]
+            self._ensure_width(name, width)
+            self._vectors[name][start:stop, :width] = value
+            self._widths[name][start:stop] = width
+        self.index.update(zip(item_ids.tolist(), range(start, stop)))
+        self.size = stop
+        self.layout_version += 1
+        return np.arange(start, stop)
+
+    def reserve(self, capacity):
+        """Grow the allocated arrays to hold at least ``capacity`` rows."""
+        if capacity <= self._capacity:
+            return
+        self._ids = self._grow(self._ids, capacity)
+        self._scalars = {name: self._grow(column, capacity) for name, column in self._scalars.items()}
+        self._vectors = {name: self._grow(column, capacity) for name, column in self._vectors.items()}
+        self._widths = {name: self._grow(column, capacity) for name, column in self._widths.items()}
+        self._capacity = capacity
+
+    @staticmethod
+    def _grow(array, capacity):
+        grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def to_arrays(self):
+        """Live rows of every column, keyed by column name (vector widths under "<name>.width")."""
+        arrays = {"ids": self.ids}
+        for name, column in self._scalars.items():
+            arrays[name] = column[:self.size]
+        for name, column in self._vectors.items():
+            arrays[name] = column[:self.size]
+            arrays[f"{name}.width"] = self._widths[name][:self.size]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Build a table on top of existing arrays, as returned by to_arrays, without copying them.
+
+        The arrays (for instance memory-mapped ones) are only copied if rows are appended later.
+        """
+        table = cls()
+        ids = np.asarray(arrays["ids"])
+        size = len(ids)
+        if size == 0:
+            return table
+        table._ids = ids
+        for name in table._scalars:
+            table._scalars[name] = arrays[name] if name in arrays else np.zeros(size, dtype=table._scalars[name].dtype)
+        for name in table._vectors:
+            if name in arrays:
+                table._vectors[name] = arrays[name]
+                table._widths[name] = arrays[f"{name}.width"]
+            else:
+                table._vectors[name] = np.zeros((size, 0), dtype=table._vectors[name].dtype)
+                table._widths[name] = np.zeros(size, dtype=np.int64)
+        table._capacity = size
+        table.size = size
+        table.index = dict(zip(ids.tolist(), range(size)))
+        return table
+
+    def load_arrays(self, arrays):
+        """Write back columns returned by to_arrays in place, the table must have the same rows."""
+        for name, array in arrays.items():
+            if name == "ids" or name.endswith(".width"):
+                continue
+            if not np.array_equal(self[name], array):
+                self[name][...] = array
+                self.mark_dirty(name)
+
+    def clear(self):
+        self.size = 0
+        self.index = {}
+        self.layout_version += 1
+
+    def get(self, name, row):
+        """Scalar columns are returned as Python numbers, vector columns as tensor views on the row."""
+        if name in self._scalars:
+            return self._scalars[name][row].item()
+        width = self._widths[name][row]
+        return torch.from_numpy(self._vectors[name][row, :width])
+
+    def set(self, name, row, value):
+        self.versions[name] += 1
+        if name in self._scalars:
+            tracker = self.trackers.get(name)
+            if tracker is not None and tracker.version == self.versions[name] - 1:
+                old = self._scalars[name][row]
+                self._scalars[name][row] = value
+                tracker.update(old, self._scalars[name][row])
+                tracker.version = self.versions[name]
+            else:
+                self._scalars[name][row] = value
+            return
+        column = self._vectors[name]
+        value = np.asarray(value, dtype=column.dtype).reshape(-1)
+        width = len(value)
+        column = self._ensure_width(name, width)
+        column[row, :width] = value
+        column[row, width:] = 0
+        self._widths[name][row] = width
+
+    def add(self, name, values, rows=slice(None)):
+        """Add values in place to the given rows of a scalar column (every row by default)."""
+        column = self[name]
+        tracker = self.trackers.get(name)
+        tracked = tracker is not None and tracker.version == self.versions[name]
+        old = column[rows].copy() if tracked else None
+        column[rows] += values
+        self.versions[name] += 1
+        if tracked:
+            tracker.update(old, column[rows])
+            tracker.version = self.versions[name]
+
+    def _ensure_width(self, name, width):
+        column = self._vectors[name]
+        if width > column.shape[1]:
+            # Widen the column, narrower rows keep their own width and are zero padded
+            widened = np.zeros((self._capacity, width), dtype=column.dtype)
+            widened[:, :column.shape[1]] = column
+            self._vectors[name] = column = widened
+            self.layout_version += 1
+        return column
+
+
+class NodeTable(ColumnTable):
+    scalar_columns = {
+        "capacity": np.int64,
+        "staff": np.int64,
+        "demand": np.int64,
+    }
+    vector_columns = {
+        "node_type": np.float32,
+        "coordinates": np.float32,
+        "service_hours": np.float32,
+    }
+
+
+class ArcTable(ColumnTable):
+    scalar_columns = {
+        "length": np.float64,
+        "travel_time": np.float64,
+        "capacity": np.int64,
+        "traffic_condition": np.int64,
+        "safety": np.int64,
+        "usage_cost": np.float64,
+        "open": np.int64,
+        "source": np.int64,
+        "target": np.int64,
+        "source_row": np.int64,
+        "target_row": np.int64,
+    }
+    vector_columns = {
+        "arc_type": np.float32,
+    }
+
+
+class FleetTable(ColumnTable):
+    """
+    Vehicle rows. A vehicle is on a node (is_node = 1) or on an arc (is_node = 0), and
+    moving it only rewrites its location columns. A location_id of -1 means nowhere.
+
+    Circuits are stored back to back in one flat array: circuit_start points to the current
+    node of the vehicle and circuit_end past its destination, so that moving to the next node
+    of the circuit is an increment. Replaced circuits leave holes that are reclaimed when
+    the flat array is full.
+    """
+
+    scalar_columns = {
+        "in_service": np.int64,
+        "is_node": np.int64,
+        "location_id": np.int64,
+        "start": np.int64,
+        "capacity": np.int64,
+        "capacity_left": np.int64,
+        "progress": np.float64,
+        "circuit_start": np.int64,
+        "circuit_end": np.int64,
+    }
+    vector_columns = {
+        "type": np.float32,
+        "service_hours": np.float32,
+    }
+
+    def __init__(self, capacity=16):
+        super().__init__(capacity)
+        self.circuits = np.zeros(64, dtype=np.int64)
+        self.circuits_size = 0
+
+    def get(self, name, row):
+        if name == "circuit":
+            return self.circuits[self._scalars["circuit_start"][row]:self._scalars["circuit_end"][row]].tolist()
+        return super().get(name, row)
+
+    def set(self, name, row, value):
+        if name == "circuit":
+            self.set_circuit(row, value)
+        else:
+            super().set(name, row, value)
+
+    def set_circuit(self, row, circuit):
+        circuit = np.asarray(circuit if circuit is not None else [], dtype=np.int64).reshape(-1)
+        if self.circuits_size + len(circuit) > len(self.circuits):
+            self._compact_circuits(row, len(circuit))
+        start = self.circuits_size
+        self.circuits[start:start + len(circuit)] = circuit
+        self.circuits_size += len(circuit)
+        self._scalars["circuit_start"][row] = start
+        self._scalars["circuit_end"][row] = start + len(circuit)
+        self.versions["circuit_start"] += 1
+        self.versions["circuit_end"] += 1
+
+    def _compact_circuits(self, replaced_row, extra):
+        # Move the live circuits to the front of a new array, the circuit of replaced_row is dropped
+        starts, ends = self["circuit_start"].copy(), self["circuit_end"].copy()
+        if replaced_row < self.size:
+            ends[replaced_row] = starts[replaced_row]
+        lengths = ends - starts
+        live = int(lengths.sum())
+        circuits = np.zeros(max(64, 2 * (live + extra)), dtype=np.int64)
+        new_starts = np.cumsum(lengths) - lengths
+        # Index of every live element in the old array
+        positions = np.repeat(starts - new_starts, lengths) + np.arange(live)
+        circuits[:live] = self.circuits[positions]
+        self.circuits = circuits
+        self.circuits_size = live
+        self["circuit_start"][...] = new_starts
+        self["circuit_end"][...] = new_starts + lengths
+
+    def circuit_node(self, row, offset=0):
+        """Node offset steps ahead in the circuit of the vehicle, offset 0 being its current node."""
+        return self.circuits[self._scalars["circuit_start"][row] + offset].item()
+
+    def circuit_length(self, row):
+        return (self._scalars["circuit_end"][row] - self._scalars["circuit_start"][row]).item()
+
+    def advance_circuit(self, row):
+        """Make the next node of the circuit the current one."""
+        self._scalars["circuit_start"][row] += 1
+        self.versions["circuit_start"] += 1
+
+    def relocate(self, row, is_node, location_id):
+        """Put a vehicle on a node or at the start of an arc."""
+        self._scalars["is_node"][row] = is_node
+        self._scalars["location_id"][row] = location_id
+        self._scalars["progress"][row] = 0
+        for name in ("is_node", "location_id", "progress"):
+            self.versions[name] += 1
+
+    def located(self, is_node, location_id):
+        """Rows of the vehicles on the given node or arc."""
+        return np.flatnonzero((self["is_node"] == is_node) & (self["location_id"] == location_id))
+
+    def to_arrays(self):
+        arrays = super().to_arrays()
+        arrays["circuits"] = self.circuits[:self.circuits_size]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        table = super().from_arrays({name: array for name, array in arrays.items() if name != "circuits"})
+        if "circuits" in arrays and len(arrays["circuits"]):
+            table.circuits = arrays["circuits"]
+            table.circuits_size = len(arrays["circuits"])
+        return table
+
+    def load_arrays(self, arrays):
+        circuits = arrays["circuits"]
+        self.circuits = np.zeros(max(64, 2 * len(circuits)), dtype=np.int64)
+        self.circuits[:len(circuits)] = circuits
+        self.circuits_size = len(circuits)
+        super().load_arrays({name: array for name, array in arrays.items() if name != "circuits"})
+
+
+def column_property(name, read_only=False):
+    """
+    Attribute stored in the bound table row, or locally while the object is not part of an environment.
+
+    Args:
+        name (str): Column of the attribute.
+        read_only (bool): The attribute can only be set while the object is detached. Used for columns that
+            other columns or indexes are derived from (e.g. the endpoints of an arc).
+    """
+    def fget(self):
+        if self._table is None:
+            return self._values[name]
+        return self._table.get(name, self._row)
+
+    def fset(self, value):
+        if self._table is None:
+            self._values[name] = value
+        elif read_only:
+            raise AttributeError(f"{name} of {type(self).__name__} cannot be changed once it is part of an environment.")
+        else:
+            self._table.set(name, self._row, value)
+
+    return property(fget, fset)
+
+
+class RowViews(MutableMapping):
+    """
+    Mapping from id to the view on the corresponding row of a table.
+
+    Views are created the first time they are accessed, so that bulk loads do not
+    pay for one Python object per row. Keys follow the row order of the table.
+    """
+
+    def __init__(self, table, factory):
+        """
+        Args:
+            table (ColumnTable): Table holding the rows.
+            factory (callable): Called as factory(item_id, row) to create the view of a row.
+        """
+        self.table = table
+        self.factory = factory
+        self._views = {}
+
+    def __getitem__(self, item_id):
+        view = self._views.get(item_id)
+        if view is None:
+            view = self._views[item_id] = self.factory(item_id, self.table.index[item_id])
+        return view
+
+    def __setitem__(self, item_id, view):
+        if item_id not in self.table.index:
+            raise KeyError(f"Row with ID {item_id} is not in the table.")
+        self._views[item_id] = view
+
+    def __delitem__(self, item_id):
+        raise TypeError("Rows cannot be removed from the network one at a time.")
+
+    def __contains__(self, item_id):
+        return item_id in self.table.index
+
+    def __iter__(self):
+        return iter(self.table.index)
+
+    def __len__(self):
+        return len(self.table)
+
+    def clear(self):
+        self._views.clear()
+
+
+class FleetViews(RowViews):
+    """RowViews of a FleetTable, with the vehicle moves used by nodes and arcs."""
+
+    def add(self, vehicle):
+        """Append a detached Vehicle to the fleet and bind it to its row."""
+        row = self.table.append(vehicle.id, vehicle.column_values())
+        vehicle.bind(self.table, row)
+        self._views[vehicle.id] = vehicle
+
+    def place(self, vehicle, is_node, location_id):
+        """Move a vehicle to a node or an arc, adding it to the fleet if it is not part of it yet."""
+        if vehicle.id in self:
+            self.table.relocate(self.table.row(vehicle.id), is_node, location_id)
+            return
+        vehicle.is_node = is_node
+        vehicle.location_id = location_id
+        self.add(vehicle)
+
+    def take(self, vehicle_id, is_node, location_id):
+        """Remove a vehicle from a node or an arc, it is then nowhere until placed again."""
+        row = self.table.index.get(vehicle_id)
+        if row is not None and self.table["is_node"][row] == is_node and self.table["location_id"][row] == location_id:
+            self.table.relocate(row, 0, -1)
+
+    def located(self, is_node, location_id):
+        """Vehicles on the given node or arc."""
+        rows = self.table.located(is_node, location_id)
+        return [self[vehicle_id] for vehicle_id in self.table.ids[rows].tolist()]
+
+
+def vehicles_property(is_node, id_attribute):
+    """
+    Vehicles on a node (is_node = 1) or an arc (is_node = 0). They are a plain list while
+    the object is detached, and looked up in the fleet of the environment once it is bound.
+    """
+    def fget(self):
+        if self._table is None:
+            return self._vehicles
+        return self._fleet.located(is_node, getattr(self, id_attribute))
+
+    def fset(self, vehicles):
+        if self._table is None:
+            self._vehicles = vehicles
+            return
+        location_id = getattr(self, id_attribute)
+        kept = {vehicle.id for vehicle in vehicles}
+        for vehicle in self._fleet.located(is_node, location_id):
+            if vehicle.id not in kept:
+                self._fleet.take(vehicle.id, is_node, location_id)
+        for vehicle in vehicles:
+            self._fleet.place(vehicle, is_node, location_id)
+
+    return property(fget, fset)
+
+
+class RowView:
+    """
+    Base class for network objects whose attributes are a row of a ColumnTable.
+
+    A view starts detached, keeping its values locally, and is bound to a row
+    when it is added to an Environment. Attributes that are not columns (ids)
+    stay as plain instance attributes.
+    """
+
+    columns = ()
+    # Properties that are not columns but are part of to_dict
+    view_attributes = ()
+
+    def _init_view(self):
+        self._table = None
+        self._row = None
+        self._values = {}
+
+    @classmethod
+    def from_row(cls, table, row, **attributes):
+        """Create a view bound to an existing row, without going through __init__."""
+        view = cls.__new__(cls)
+        view.__dict__.update(attributes, _table=table, _row=row, _values={})
+        return view
+
+    def bind(self, table, row):
+        self._table = table
+        self._row = row
+        self._values = {}
+
+    def column_values(self):
+        return {name: getattr(self, name) for name in self.columns}
+
+    def to_dict(self):
+        state = {key: value for key, value in self.__dict__.items() if not key.startswith("_")}
+        state.update(self.column_values())
+        state.update({name: getattr(self, name) for name in self.view_attributes})
+        return state
@@ -1,7 +1,19 @@
 import torch
 from vehicle import Vehicle
+from network_state import RowView, column_property, vehicles_property
+
+class Node(RowView):
+    view_attributes = ("vehicles",)
+    columns = ("node_type", "coordinates", "capacity", "staff", "service_hours", "demand")
+
+    node_type = column_property("node_type")
+    coordinates = column_property("coordinates")
+    capacity = column_property("capacity")
+    staff = column_property("staff")
+    service_hours = column_property("service_hours")
+    demand = column_property("demand")
+    vehicles = vehicles_property(1, "node_id")
 
-class Node:
     def __init__(self, node_id, node_type, coordinates, capacity, vehicles, staff, service_hours, demand):
         """
         Initialize a node in the transportation network.
@@ -15,7 +27,11 @@ class Node:
             staff (int): Number of staff available at the node.
             service_hours (torch.Tensor): Tensor with [opening_hour, closing_hour].
             demand (int): Current demand at the node.
+
+        Once the node is added to an Environment, its attributes are views on a row of the environment's NodeTable
+        and its vehicles are those of the environment's fleet located at the node.
         """
+        self._init_view()
         self.node_id = node_id
         self.node_type = node_type
         self.coordinates = coordinates
@@ -26,10 +42,16 @@ class Node:
         self.demand = demand
 
     def add_vehicle(self, vehicle):
-        self.vehicles.append(vehicle)
+        if self._table is None:
+            self._vehicles.append(vehicle)
+        else:
+            self._fleet.place(vehicle, 1, self.node_id)
 
     def remove_vehicle(self, vehicle_id):
-        self.vehicles = [v for v in self.vehicles if v.vehicle_id != vehicle_id]
+        if self._table is None:
+            self._vehicles = [v for v in self._vehicles if v.id != vehicle_id]
+        else:
+            self._fleet.take(vehicle_id, 1, self.node_id)
 
     def get_id(self):
         return self.node_id
@@ -80,7 +102,7 @@ class Node:
 
     def __repr__(self):
         return (f"Node(id={self.node_id}, type={self.node_type.tolist()}, coordinates={self.coordinates.tolist()}, "
-                f"capacity={self.capacity}, vehicles={[v.vehicle_id for v in self.vehicles]}, staff={self.staff}, "
+                f"capacity={self.capacity}, vehicles={[v.id for v in self.vehicles]}, staff={self.staff}, "
                 f"service_hours={self.service_hours.tolist()}, demand={self.demand})")
 
 # Exemple d'utilisation
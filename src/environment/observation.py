@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import torch
+from torch_geometric.data import Data
+
+# Order of the attributes in the rows of x and edge_attr
+NODE_FEATURES = ("node_type", "coordinates", "capacity", "staff", "service_hours", "demand")
+ARC_FEATURES = ("arc_type", "length", "travel_time", "capacity", "traffic_condition", "safety", "usage_cost", "open")
+
+
+def feature_slices(table, names):
+    """Column slices of each attribute in the feature matrix built from the table."""
+    slices = {}
+    start = 0
+    for name in names:
+        width = table.column_width(name)
+        slices[name] = slice(start, start + width)
+        start += width
+    return slices
+
+
+class ObservationBuilder:
+    def __init__(self, node_table, arc_table):
+        """
+        Build the PyTorch Geometric observation of the network from its columnar tables.
+
+        The x, edge_index and edge_attr buffers are allocated once per table layout.
+        Later calls only rewrite the feature columns whose version changed since the
+        previous build (typically demand, traffic_condition and open), the static
+        columns and the topology are left untouched.
+
+        Args:
+            node_table (NodeTable): Node columns of the environment.
+            arc_table (ArcTable): Arc columns of the environment.
+        """
+        self.node_table = node_table
+        self.arc_table = arc_table
+        self.data = None
+        self.node_slices = {}
+        self.arc_slices = {}
+        self._layout = None
+        self._node_versions = {}
+        self._arc_versions = {}
+        self._edge_versions = None
+
+    def build(self, clone=False):
+        """
+        Args:
+            clone (bool): Return a copy of the buffers instead of the shared Data object.
+
+        Returns:
+            Data: Graph with x, edge_index and edge_attr.
+        """
+        layout = (self.node_table.layout_version, self.arc_table.layout_version)
+        if self.data is None or layout != self._layout:
+            self._allocate()
+            self._layout = layout
+        self._refresh()
+        return self.data.clone() if clone else self.data
+
+    def _allocate(self):
+        self.node_slices = feature_slices(self.node_table, NODE_FEATURES)
+        self.arc_slices = feature_slices(self.arc_table, ARC_FEATURES)
+        num_node_features = sum(s.stop - s.start for s in self.node_slices.values())
+        num_arc_features = sum(s.stop - s.start for s in self.arc_slices.values())
+        x = torch.zeros((len(self.node_table), num_node_features), dtype=torch.float)
+        edge_index = torch.zeros((2, len(self.arc_table)), dtype=torch.long)
+        edge_attr = torch.zeros((len(self.arc_table), num_arc_features), dtype=torch.float)
+        self.data = Data(x=x, edge_index=edge_index, edge_attr=edge_attr)
+        # Force every column to be written by the next refresh
+        self._node_versions = {}
+        self._arc_versions = {}
+        self._edge_versions = None
+
+    def _refresh(self):
+        self._write_columns(self.node_table, self.node_slices, self.data.x, self._node_versions)
+        self._write_columns(self.arc_table, self.arc_slices, self.data.edge_attr, self._arc_versions)
+        edge_versions = (self.arc_table.versions["source_row"], self.arc_table.versions["target_row"])
+        if edge_versions != self._edge_versions:
+            self.data.edge_index[0].copy_(torch.from_numpy(self.arc_table["source_row"]))
+            self.data.edge_index[1].copy_(torch.from_numpy(self.arc_table["target_row"]))
+            self._edge_versions = edge_versions
+
+    @staticmethod
+    def _write_columns(table, slices, features, seen_versions):
+        for name, columns in slices.items():
+            version = table.versions[name]
+            if seen_versions.get(name) == version:
+                continue
+            if columns.stop > columns.start:
+                values = torch.from_numpy(table[name]).reshape(len(table), columns.stop - columns.start)
+                features[:, columns].copy_(values)
+            seen_versions[name] = version
+
+    def sizes(self):
+        """Per-row attribute sizes of x and edge_attr, in the format used to save networks next to their Data."""
+        node_sizes = {"node_id": self.node_table.ids.copy()}
+        for name, columns in feature_slices(self.node_table, NODE_FEATURES).items():
+            node_sizes[f"{name}_size"] = np.full(len(self.node_table), columns.stop - columns.start)
+        arc_sizes = {"arc_id": self.arc_table.ids.copy()}
+        for name, columns in feature_slices(self.arc_table, ARC_FEATURES).items():
+            arc_sizes[f"{name}_size"] = np.full(len(self.arc_table), columns.stop - columns.start)
+        return pd.DataFrame(node_sizes), pd.DataFrame(arc_sizes)
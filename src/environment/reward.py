@@ -1,5 +1,29 @@
 import numpy as np
 
+def demand_penalty(total, std):
+    """
+    Récompense de Environment.calculate_reward : opposé de la demande non satisfaite totale
+    plus 0.1 fois son écart-type. Accepte des tableaux, par exemple une valeur par environnement.
+
+    Args:
+    - total (float ou np.array): Somme des demandes des noeuds.
+    - std (float ou np.array): Écart-type des demandes des noeuds.
+    """
+    return -(total + 0.1 * std)
+
+def calculate_batch_penalty(demands):
+    """
+    demand_penalty de plusieurs environnements en un appel.
+
+    Args:
+    - demands (np.array): Demandes de forme (num_envs, num_nodes).
+
+    Returns:
+    - np.array: Récompense de chaque environnement, de forme (num_envs,).
+    """
+    demands = np.asarray(demands, dtype=np.float64)
+    return demand_penalty(demands.sum(axis=1), demands.std(axis=1))
+
 class RewardCalculator:
     def __init__(self, weight_mean=0.7, weight_std=0.3, alpha=0.1, beta=0.1):
         """
@@ -44,8 +68,82 @@ class RewardCalculator:
 
         return total_reward
 
+    def reward_from_stats(self, mean_demand, std_demand):
+        """
+        Récompense à partir de la moyenne et de l'écart-type déjà calculés, par exemple
+        par un RewardTracker. Accepte aussi des tableaux de moyennes et d'écarts-types.
+        """
+        mean_reward = np.exp(-self.alpha * mean_demand)
+        std_reward = np.exp(-self.beta * std_demand)
+        return self.weight_mean * mean_reward + self.weight_std * std_reward
+
+    def calculate_batch_reward(self, demands):
+        """
+        Calcule en un appel la récompense de plusieurs environnements.
+
+        Args:
+        - demands (np.array): Demandes de forme (num_envs, num_nodes).
+
+        Returns:
+        - np.array: Récompense de chaque environnement, de forme (num_envs,).
+        """
+        demands = np.asarray(demands, dtype=np.float64)
+        if demands.shape[1] == 0:
+            return np.zeros(demands.shape[0])
+        return self.reward_from_stats(demands.mean(axis=1), demands.std(axis=1))
+
+class RewardTracker:
+    def __init__(self, values=()):
+        """
+        Somme et somme des carrés d'une colonne de demandes, tenues à jour à chaque modification
+        pour que la moyenne et l'écart-type coûtent O(1) au lieu de O(nombre de noeuds).
+
+        Enregistré dans ColumnTable.trackers, il reçoit les écritures de la table par update.
+
+        Args:
+        - values (np.array): Valeurs initiales de la colonne.
+        """
+        self.reset(values)
+
+    def reset(self, values, version=-1):
+        """
+        Recalcule les sommes à partir de toutes les valeurs.
+
+        Args:
+        - values (np.array): Valeurs de la colonne.
+        - version (int): Version de la colonne correspondant à ces valeurs.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.count = len(values)
+        self.total = values.sum()
+        self.total_squares = np.square(values).sum()
+        self.version = version
+
+    def update(self, old, new):
+        """Prend en compte le remplacement des valeurs old par new (scalaires ou tableaux de même forme)."""
+        old = np.asarray(old, dtype=np.float64)
+        new = np.asarray(new, dtype=np.float64)
+        self.total += (new - old).sum()
+        self.total_squares += (np.square(new) - np.square(old)).sum()
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def std(self):
+        if not self.count:
+            return 0.0
+        # Les erreurs d'arrondi peuvent rendre la variance très légèrement négative
+        return float(np.sqrt(max(self.total_squares / self.count - self.mean ** 2, 0.0)))
+
 # Exemple d'utilisation
-reward_calculator = RewardCalculator(weight_mean=0.7, weight_std=0.3, alpha=0.1, beta=0.1)
-demands = np.array([10, 20, 30, 40, 50])
-reward = reward_calculator.calculate_reward(demands)
-print("Calculated Reward:", reward)
+if __name__ == "__main__":
+    reward_calculator = RewardCalculator(weight_mean=0.7, weight_std=0.3, alpha=0.1, beta=0.1)
+    demands = np.array([10, 20, 30, 40, 50])
+    reward = reward_calculator.calculate_reward(demands)
+    print("Calculated Reward:", reward)
+    tracker = RewardTracker(demands)
+    tracker.update(demands[0], 15)
+    print("Tracked Reward:", reward_calculator.reward_from_stats(tracker.mean, tracker.std))
+    print("Batch Rewards:", reward_calculator.calculate_batch_reward(np.stack([demands, 2 * demands])))
@@ -0,0 +1,305 @@
+import heapq
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+# Arc columns that change the cost of the routes, besides the metric itself
+WATCHED_COLUMNS = ("open", "traffic_condition")
+
+
+class Router:
+    def __init__(self, environment, max_trees=1024):
+        """
+        Shortest paths over the open arcs of an environment, weighted by an arc column
+        (travel_time or usage_cost), with cached shortest-path trees.
+
+        The routing graph has one edge per (source node, target node) pair, weighted by the
+        cheapest open arc between them, inf if they are all closed. A tree is cached per
+        (source node, metric). When the open flag, the metric or the traffic condition of
+        some arcs change, the edge weights are updated in place and the cached trees are
+        repaired: only the nodes whose route went through an edge that got costlier, and
+        the nodes that an edge that got cheaper brings closer, are visited again. Adding
+        nodes or arcs drops every tree.
+
+        The routes and vehicle circuits invalidated by the changes are collected until
+        pop_changes is called.
+
+        Args:
+            environment (Environment): Network to route on.
+            max_trees (int): Maximum number of cached trees, least recently used ones are dropped first.
+        """
+        self.environment = environment
+        self.max_trees = max_trees
+        self._graphs = {}
+        self._trees = {}
+        self._changes = {}
+
+    def _weights(self, metric):
+        arc_table = self.environment.arc_table
+        return np.where(arc_table["open"] != 0, arc_table[metric].astype(np.float64), np.inf)
+
+    def _graph(self, metric):
+        """Routing graph of metric, brought up to date with the arc table."""
+        node_table = self.environment.node_table
+        arc_table = self.environment.arc_table
+        key = (arc_table.layout_version, len(node_table)) + tuple(arc_table.versions[name] for name in (metric,) + WATCHED_COLUMNS)
+        graph = self._graphs.get(metric)
+        if graph is not None and graph["key"] == key:
+            return graph
+
+        weights = self._weights(metric)
+        if graph is None or graph["key"][:2] != key[:2]:
+            changes = self._changes.setdefault(metric, {"routes": {}, "circuits": set()})
+            for source_row, tree_metric in list(self._trees):
+                if tree_metric == metric:
+                    changes["routes"][source_row] = None
+                    del self._trees[(source_row, tree_metric)]
+            graph = self._graphs[metric] = self._build(weights)
+        else:
+            changed = np.flatnonzero(weights != graph["weights"])
+            graph["weights"] = weights
+            if len(changed):
+                self._update(metric, graph, changed)
+        graph["key"] = key
+        return graph
+
+    def _build(self, weights):
+        arc_table = self.environment.arc_table
+        num_nodes = len(self.environment.node_table)
+        sources, targets = arc_table["source_row"], arc_table["target_row"]
+        # Group parallel arcs into (source, target) pairs sorted by source then target,
+        # so that pair i is the i-th stored entry of the outgoing matrix
+        arc_order = np.lexsort((targets, sources))
+        first = np.ones(len(arc_order), dtype=bool)
+        first[1:] = (sources[arc_order][1:] != sources[arc_order][:-1]) | (targets[arc_order][1:] != targets[arc_order][:-1])
+        pair_starts = np.flatnonzero(first)
+        arc_pairs = np.empty(len(arc_order), dtype=np.int64)
+        arc_pairs[arc_order] = np.cumsum(first) - 1
+        pair_sources, pair_targets = sources[arc_order][pair_starts], targets[arc_order][pair_starts]
+        pair_weights = np.minimum.reduceat(weights[arc_order], pair_starts) if len(pair_starts) else np.zeros(0)
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_sources, minlength=num_nodes), out=indptr[1:])
+        outgoing = csr_matrix((pair_weights.copy(), pair_targets, indptr), shape=(num_nodes, num_nodes))
+        incoming_order = np.lexsort((pair_sources, pair_targets))
+        incoming_indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_targets, minlength=num_nodes), out=incoming_indptr[1:])
+        incoming = csr_matrix((pair_weights[incoming_order], pair_sources[incoming_order], incoming_indptr), shape=(num_nodes, num_nodes))
+        incoming_positions = np.empty(len(incoming_order), dtype=np.int64)
+        incoming_positions[incoming_order] = np.arange(len(incoming_order))
+        return {
+            "weights": weights,
+            "arc_order": arc_order,
+            "arc_pairs": arc_pairs,
+            "pair_starts": np.append(pair_starts, len(arc_order)),
+            "pair_sources": pair_sources,
+            "pair_targets": pair_targets,
+            "outgoing": outgoing,
+            "incoming": incoming,
+            "incoming_positions": incoming_positions,
+        }
+
+    def _update(self, metric, graph, changed_arcs):
+        """Update the weights of the pairs of the changed arcs and repair the cached trees."""
+        pairs = np.unique(graph["arc_pairs"][changed_arcs])
+        starts, stops = graph["pair_starts"][pairs], graph["pair_starts"][pairs + 1]
+        new_weights = np.array([graph["weights"][graph["arc_order"][start:stop]].min() for start, stop in zip(starts, stops)])
+        outgoing = graph["outgoing"]
+        old_weights = outgoing.data[pairs]
+        moved = new_weights != old_weights
+        pairs, old_weights, new_weights = pairs[moved], old_weights[moved], new_weights[moved]
+        if len(pairs) == 0:
+            return
+        outgoing.data[pairs] = new_weights
+        graph["incoming"].data[graph["incoming_positions"][pairs]] = new_weights
+
+        changes = self._changes.setdefault(metric, {"routes": {}, "circuits": set()})
+        for (source_row, tree_metric), (distances, predecessors) in self._trees.items():
+            if tree_metric != metric:
+                continue
+            visited = self._repair(graph, distances, predecessors, pairs, old_weights, new_weights)
+            if visited:
+                routes = changes["routes"].setdefault(source_row, set())
+                if routes is not None:
+                    routes.update(visited)
+        changes["circuits"].update(self._circuits_through(graph["pair_sources"][pairs], graph["pair_targets"][pairs]))
+
+    @staticmethod
+    def _repair(graph, distances, predecessors, pairs, old_weights, new_weights):
+        """
+        Repair a shortest-path tree in place after the weights of some pairs changed.
+
+        Returns:
+            set: Node rows whose route was recomputed.
+        """
+        outgoing, incoming = graph["outgoing"], graph["incoming"]
+        sources, targets = graph["pair_sources"][pairs], graph["pair_targets"][pairs]
+        visited = set()
+        heap = []
+
+        # Costlier edges: every node reached through one of them loses its route. With one edge
+        # per pair, a pair is a tree edge when its source is the predecessor of its target
+        increased = new_weights > old_weights
+        subtree = list(dict.fromkeys(targets[increased & (predecessors[targets] == sources)].tolist()))
+        visited.update(subtree)
+        for node in subtree:
+            children = outgoing.indices[outgoing.indptr[node]:outgoing.indptr[node + 1]]
+            for child in children[predecessors[children] == node].tolist():
+                if child not in visited:
+                    visited.add(child)
+                    subtree.append(child)
+        if subtree:
+            distances[subtree] = np.inf
+            predecessors[subtree] = -9999
+            # Best entry into the lost subtree from the rest of the tree
+            for node in subtree:
+                start, stop = incoming.indptr[node], incoming.indptr[node + 1]
+                candidates = distances[incoming.indices[start:stop]] + incoming.data[start:stop]
+                if len(candidates) and np.isfinite(candidates.min()):
+                    best = candidates.argmin()
+                    distances[node] = candidates[best]
+                    predecessors[node] = incoming.indices[start + best]
+                    heapq.heappush(heap, (distances[node], node))
+
+        # Cheaper edges: their targets, and everything after them, may get closer
+        for source, target, weight in zip(sources.tolist(), targets.tolist(), new_weights.tolist()):
+            if distances[source] + weight < distances[target]:
+                distances[target] = distances[source] + weight
+                predecessors[target] = source
+                visited.add(target)
+                heapq.heappush(heap, (distances[target], target))
+
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if distance > distances[node]:
+                continue
+            start, stop = outgoing.indptr[node], outgoing.indptr[node + 1]
+            neighbors = outgoing.indices[start:stop]
+            candidates = distance + outgoing.data[start:stop]
+            closer = candidates < distances[neighbors]
+            for neighbor, candidate in zip(neighbors[closer].tolist(), candidates[closer].tolist()):
+                distances[neighbor] = candidate
+                predecessors[neighbor] = node
+                visited.add(neighbor)
+                heapq.heappush(heap, (candidate, neighbor))
+        return visited
+
+    def _circuits_through(self, source_rows, target_rows):
+        """IDs of the vehicles whose remaining circuit goes from a source row to the matching target row."""
+        fleet = self.environment.fleet
+        if len(fleet) == 0:
+            return set()
+        starts, ends = fleet["circuit_start"], fleet["circuit_end"]
+        hops = np.maximum(ends - starts - 1, 0)
+        if hops.sum() == 0:
+            return set()
+        owners = np.repeat(np.arange(len(fleet)), hops)
+        positions = np.repeat(starts - (np.cumsum(hops) - hops), hops) + np.arange(hops.sum())
+        num_nodes = len(self.environment.node_table)
+        hop_keys = self.environment.node_rows(fleet.circuits[positions]) * num_nodes + self.environment.node_rows(fleet.circuits[positions + 1])
+        hit = np.isin(hop_keys, source_rows * num_nodes + target_rows)
+        return set(fleet.ids[owners[hit]].tolist())
+
+    def pop_changes(self, metric="travel_time"):
+        """
+        Bring the routing graph of metric up to date, then return and forget what the arc
+        changes since the last call invalidated.
+
+        Returns:
+            dict: "routes" maps the ID of each cached source to the IDs of the nodes whose route
+                from it was recomputed (None if its tree was dropped), "circuits" lists the IDs of the
+                vehicles whose remaining circuit uses a node pair whose cost changed.
+        """
+        self._graph(metric)
+        changes = self._changes.pop(metric, {"routes": {}, "circuits": set()})
+        node_ids = self.environment.node_table.ids
+        routes = {}
+        for source_row, rows in changes["routes"].items():
+            routes[node_ids[source_row].item()] = None if rows is None else node_ids[sorted(rows)].tolist()
+        return {"routes": routes, "circuits": sorted(changes["circuits"])}
+
+    def _cache(self, tree_key, tree):
+        self._trees[tree_key] = tree
+        while len(self._trees) > self.max_trees:
+            del self._trees[next(iter(self._trees))]
+
+    def trees(self, source_rows, metric="travel_time"):
+        """
+        Shortest-path trees from many sources at once, computing the missing ones in a single call.
+
+        Args:
+            source_rows (array-like): Node rows of the sources.
+            metric (str): Arc column used as weight.
+
+        Returns:
+            tuple: (distances, predecessors) of shape (len(source_rows), num_nodes), with inf
+                distances and -9999 predecessors for unreachable nodes.
+        """
+        matrix = self._graph(metric)["outgoing"]
+        source_rows = np.asarray(source_rows, dtype=np.int64).reshape(-1)
+        found = {}
+        for row in dict.fromkeys(source_rows.tolist()):
+            tree = self._trees.pop((row, metric), None)
+            if tree is not None:
+                # Reinserted at the end of the cache, as the most recently used
+                found[row] = self._trees[(row, metric)] = tree
+        missing = [row for row in dict.fromkeys(source_rows.tolist()) if row not in found]
+        if missing:
+            distances, predecessors = dijkstra(matrix, directed=True, indices=missing, return_predecessors=True)
+            for row, tree in zip(missing, zip(distances, predecessors)):
+                found[row] = tree
+                self._cache((row, metric), tree)
+        num_nodes = len(self.environment.node_table)
+        if len(source_rows) == 0:
+            return np.zeros((0, num_nodes)), np.zeros((0, num_nodes), dtype=np.int32)
+        return np.stack([found[row][0] for row in source_rows.tolist()]), np.stack([found[row][1] for row in source_rows.tolist()])
+
+    def distances(self, source_id, metric="travel_time"):
+        """Cost of the shortest path from node source_id to every node row, inf if unreachable."""
+        return self.trees([self.environment.node_table.row(source_id)], metric)[0][0]
+
+    def distance_matrix(self, source_ids, target_ids=None, metric="travel_time"):
+        """
+        Many-to-many shortest path costs.
+
+        Args:
+            source_ids (array-like): IDs of the source nodes.
+            target_ids (array-like): IDs of the target nodes, every node in row order if None.
+            metric (str): Arc column used as weight.
+
+        Returns:
+            np.ndarray: Costs of shape (len(source_ids), len(target_ids)), inf if unreachable.
+        """
+        distances, _ = self.trees(self._rows(source_ids), metric)
+        if target_ids is None:
+            return distances
+        return distances[:, self._rows(target_ids)]
+
+    def _rows(self, node_ids):
+        rows = self.environment.node_rows(node_ids)
+        if (rows < 0).any():
+            node_ids = np.asarray(node_ids)
+            raise KeyError(f"Nodes with IDs {node_ids[rows < 0].tolist()} do not exist.")
+        return rows
+
+    def path(self, source_id, target_id, metric="travel_time"):
+        """
+        Node IDs of a shortest path, in the format of Vehicle.circuit.
+
+        Returns:
+            list: Node IDs from source_id to target_id, None if target_id is unreachable.
+        """
+        node_table = self.environment.node_table
+        source_row, target_row = node_table.row(source_id), node_table.row(target_id)
+        distances, predecessors = self.trees([source_row], metric)
+        if not np.isfinite(distances[0, target_row]):
+            return None
+        rows = [target_row]
+        while rows[-1] != source_row:
+            rows.append(predecessors[0, rows[-1]])
+        return node_table.ids[rows[::-1]].tolist()
+
+    def cost(self, source_id, target_id, metric="travel_time"):
+        """Cost of the shortest path from source_id to target_id, inf if unreachable."""
+        return float(self.distances(source_id, metric)[self.environment.node_table.row(target_id)])
@@ -0,0 +1,243 @@
+import heapq
+import itertools
+
+import numpy as np
+
+# Event kinds, in the order they are processed when they happen at the same time
+SERVICE_HOURS = 0
+ARC_EXIT = 1
+ARRIVAL = 2
+DEPARTURE = 3
+ARC_ENTRY = 4
+
+
+def operational(service_hours, hour):
+    """
+    Whether nodes are open at the given hour of the day.
+
+    Args:
+        service_hours (np.ndarray): Opening and closing hours, shape (..., 2). (0, 0) means always open,
+            a closing hour before the opening one (e.g. (22, 6)) means open overnight.
+        hour (float or np.ndarray): Hour of the day, broadcast against service_hours[..., 0].
+    """
+    opening, closing = service_hours[..., 0], service_hours[..., 1]
+    always_open = (opening == 0) & (closing == 0)
+    daytime = (opening <= hour) & (hour < closing)
+    overnight = (opening > closing) & ((hour >= opening) | (hour < closing))
+    return always_open | daytime | overnight
+
+
+def hours_until_open(service_hours, hour):
+    """Hours from the given hour of the day to the next opening of closed nodes, inf for nodes that never open."""
+    delays = (service_hours[..., 0] - hour) % 24
+    return np.where(delays > 0, delays, np.inf)
+
+
+class Simulator:
+    def __init__(self, environment):
+        """
+        Discrete-event engine moving the vehicles of an environment.
+
+        Events are kept in a heap ordered by time, so the simulation jumps from one event
+        to the next instead of ticking through idle periods. Time is in hours, like
+        Environment.current_time, and arc traversals last Arc.travel_time minutes.
+
+        A vehicle trip follows its circuit, the list of node IDs from its current node to
+        its destination: departure from the node, entry on the arc towards the next node,
+        exit from the arc after its travel time, arrival at the next node, and so on. The
+        circuit is consumed as the vehicle moves, circuit[0] is always its last node.
+        Departures from a node outside its service hours wait for the node to open, and
+        departures on closed arcs are retried at the next hour.
+
+        Vehicles are rows of the environment's FleetTable: moves rewrite their location
+        columns, and between two events the progress of every vehicle on an arc is
+        advanced at once.
+
+        Args:
+            environment (Environment): Environment whose vehicles are moved.
+        """
+        self.environment = environment
+        self.queue = []
+        self.now = environment.current_time
+        self._sequence = itertools.count()
+        self.waiting = {}
+        self.node_open = None
+        self._service_hours_started = False
+        self.handlers = {
+            SERVICE_HOURS: self._on_service_hours,
+            DEPARTURE: self._on_departure,
+            ARC_ENTRY: self._on_arc_entry,
+            ARC_EXIT: self._on_arc_exit,
+            ARRIVAL: self._on_arrival,
+        }
+
+    def checkpoint(self):
+        return {
+            "queue": list(self.queue),
+            "now": self.now,
+            "waiting": {node_id: list(vehicle_ids) for node_id, vehicle_ids in self.waiting.items()},
+            "node_open": None if self.node_open is None else self.node_open.copy(),
+            "service_hours_started": self._service_hours_started,
+        }
+
+    def restore(self, checkpoint):
+        self.queue = list(checkpoint["queue"])
+        self.now = checkpoint["now"]
+        self.waiting = {node_id: list(vehicle_ids) for node_id, vehicle_ids in checkpoint["waiting"].items()}
+        self.node_open = None if checkpoint["node_open"] is None else checkpoint["node_open"].copy()
+        self._service_hours_started = checkpoint["service_hours_started"]
+
+    def schedule(self, time, kind, *payload):
+        # Times are Python floats, computations on table columns give NumPy scalars
+        heapq.heappush(self.queue, (float(time), kind, next(self._sequence), payload))
+
+    def next_event_time(self):
+        """
+        Time of the next event moving a vehicle, None if there is none. Opening and closing
+        times of the nodes only count while departures are waiting for them.
+        """
+        self._start_service_hours()
+        times = [time for time, kind, _, _ in self.queue if kind != SERVICE_HOURS or self.waiting]
+        return min(times) if times else None
+
+    def run_until(self, end_time):
+        """Process every event happening up to end_time included."""
+        self._start_service_hours()
+        while self.queue and self.queue[0][0] <= end_time:
+            time, kind, _, payload = heapq.heappop(self.queue)
+            self.advance_vehicles(time - self.now)
+            self.now = time
+            self.handlers[kind](*payload)
+        self.advance_vehicles(end_time - self.now)
+        self.now = max(self.now, float(end_time))
+
+    def advance_vehicles(self, elapsed):
+        """
+        Move every vehicle on an arc forward by elapsed hours, at the speed given by the
+        current travel time of its arc. Arrivals are still triggered by ARC_EXIT events,
+        the progress only tells where the vehicles are in between.
+        """
+        fleet = self.environment.fleet
+        if elapsed <= 0 or len(fleet) == 0:
+            return
+        en_route = np.flatnonzero(fleet["is_node"] == 0)
+        arc_rows = self.environment.arc_table.rows(fleet["location_id"][en_route])
+        en_route, arc_rows = en_route[arc_rows >= 0], arc_rows[arc_rows >= 0]
+        if len(en_route) == 0:
+            return
+        hours = self.environment.arc_table["travel_time"][arc_rows] / 60
+        progress = fleet["progress"]
+        progress[en_route] = np.minimum(progress[en_route] + elapsed / np.maximum(hours, 1e-9), 1.0)
+        fleet.mark_dirty("progress")
+
+    def resume(self):
+        """
+        Schedule the events of the trips in progress, for a fleet restored without its event
+        queue (e.g. from a snapshot): vehicles on arcs exit after the rest of their travel
+        time and vehicles starting a trip depart now.
+        """
+        fleet = self.environment.fleet
+        arc_table = self.environment.arc_table
+        for row in range(len(fleet)):
+            vehicle_id = fleet.ids[row].item()
+            if fleet["is_node"][row] == 0:
+                arc_id = fleet["location_id"][row].item()
+                if arc_id not in arc_table:
+                    continue
+                remaining = (1 - fleet["progress"][row]) * arc_table["travel_time"][arc_table.row(arc_id)] / 60
+                self.schedule(self.now + remaining, ARC_EXIT, vehicle_id, arc_id)
+            elif fleet["start"][row] and fleet.circuit_length(row) > 1:
+                self.schedule(self.now, DEPARTURE, vehicle_id)
+
+    def schedule_trip(self, vehicle, departure_time, circuit):
+        """
+        Plan the departure of a vehicle waiting at a node.
+
+        Args:
+            vehicle (Vehicle): Vehicle on a node.
+            departure_time (float): Time of departure in hours, the current time if in the past.
+            circuit (list): Node IDs of the trip, starting with the node of the vehicle.
+        """
+        if not vehicle.is_node:
+            raise ValueError(f"Vehicle {vehicle.id} is on an arc and cannot start a trip.")
+        if len(circuit) < 2 or circuit[0] != vehicle.location_id:
+            raise ValueError(f"Circuit {circuit} of vehicle {vehicle.id} must start at its node {vehicle.location_id} and have a destination.")
+        for source, target in zip(circuit[:-1], circuit[1:]):
+            if not self.arcs_between(source, target):
+                raise ValueError(f"No arc from node {source} to node {target}.")
+        vehicle.circuit = list(circuit)
+        vehicle.start = 1
+        self.schedule(max(departure_time, self.now), DEPARTURE, vehicle.id)
+
+    def arcs_between(self, source, target):
+        """IDs of the arcs from node source to node target."""
+        node_table = self.environment.node_table
+        arc_table = self.environment.arc_table
+        if source not in node_table or target not in node_table:
+            return []
+        arc_rows = self.environment.adjacency.out_arcs(node_table.row(source))
+        arc_rows = arc_rows[arc_table["target_row"][arc_rows] == node_table.row(target)]
+        return arc_table.ids[arc_rows].tolist()
+
+    def _start_service_hours(self):
+        if self._service_hours_started or len(self.environment.node_table) == 0:
+            return
+        self._service_hours_started = True
+        self._on_service_hours()
+
+    def _operational(self, hour):
+        return operational(self.environment.node_table["service_hours"][:, :2], hour)
+
+    def _on_service_hours(self):
+        """Update which nodes are open, release the departures waiting for them and plan the next change."""
+        hour = self.now % 24
+        self.node_open = self._operational(hour)
+        node_ids = self.environment.node_table.ids
+        for node_id in [node_id for node_id in self.waiting if self.node_open[self.environment.node_table.row(node_id)]]:
+            for vehicle_id in self.waiting.pop(node_id):
+                self.schedule(self.now, DEPARTURE, vehicle_id)
+
+        # Next time at which a node opens or closes
+        boundaries = np.unique(self.environment.node_table["service_hours"][:, :2]) % 24
+        if len(node_ids) and len(boundaries):
+            delays = (boundaries - hour) % 24
+            delays[delays == 0] = 24
+            self.schedule(self.now + delays.min(), SERVICE_HOURS)
+
+    def _on_departure(self, vehicle_id):
+        fleet = self.environment.fleet
+        row = fleet.row(vehicle_id)
+        if not fleet["in_service"][row] or fleet.circuit_length(row) < 2:
+            fleet.set("start", row, 0)
+            return
+        node_id = fleet["location_id"][row].item()
+        if self.node_open is not None and not self.node_open[self.environment.node_table.row(node_id)]:
+            self.waiting.setdefault(node_id, []).append(vehicle_id)
+            return
+        arc_table = self.environment.arc_table
+        open_arcs = [arc_id for arc_id in self.arcs_between(node_id, fleet.circuit_node(row, 1)) if arc_table["open"][arc_table.row(arc_id)]]
+        if not open_arcs:
+            self.schedule(np.floor(self.now) + 1, DEPARTURE, vehicle_id)
+            return
+        arc_id = min(open_arcs, key=lambda arc_id: arc_table["travel_time"][arc_table.row(arc_id)])
+        self.schedule(self.now, ARC_ENTRY, vehicle_id, arc_id)
+
+    def _on_arc_entry(self, vehicle_id, arc_id):
+        fleet = self.environment.fleet
+        row = fleet.row(vehicle_id)
+        fleet.relocate(row, 0, arc_id)
+        fleet.set("start", row, 0)
+        arc_table = self.environment.arc_table
+        self.schedule(self.now + arc_table["travel_time"][arc_table.row(arc_id)] / 60, ARC_EXIT, vehicle_id, arc_id)
+
+    def _on_arc_exit(self, vehicle_id, arc_id):
+        fleet = self.environment.fleet
+        self.schedule(self.now, ARRIVAL, vehicle_id, fleet.circuit_node(fleet.row(vehicle_id), 1))
+
+    def _on_arrival(self, vehicle_id, node_id):
+        fleet = self.environment.fleet
+        row = fleet.row(vehicle_id)
+        fleet.relocate(row, 1, node_id)
+        fleet.advance_circuit(row)
+        if fleet.circuit_length(row) > 1:
+            self.schedule(self.now, DEPARTURE, vehicle_id)
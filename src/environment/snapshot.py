@@ -0,0 +1,80 @@
+import json
+import struct
+
+import numpy as np
+
+# File layout:
+#   magic (8 bytes) | format version (uint32) | header size (uint32) | JSON header | padding | arrays
+# Every array starts on an ALIGNMENT boundary, its dtype, shape and offset are described in the header.
+MAGIC = b"TSCNET\x00\x00"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(file_path, arrays, metadata=None):
+    """
+    Write named arrays and JSON metadata to a single snapshot file.
+
+    Args:
+        file_path (str): Destination of the snapshot.
+        arrays (dict): Array name to np.ndarray.
+        metadata (dict): JSON serializable metadata stored in the header.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    schema = {}
+    # The header size depends on the offsets written in it, iterate until it is stable
+    header = b""
+    while True:
+        offset = _align(_PREAMBLE.size + len(header))
+        for name, array in arrays.items():
+            schema[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset = _align(offset + array.nbytes)
+        new_header = json.dumps({"metadata": metadata or {}, "arrays": schema}).encode("utf-8")
+        stable = len(new_header) == len(header)
+        # The offsets of the previous header may differ with the same length, keep the new one
+        header = new_header
+        if stable:
+            break
+
+    with open(file_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b"\x00" * (schema[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+
+
+def read_snapshot(file_path, mode="c"):
+    """
+    Memory-map a snapshot file.
+
+    Args:
+        file_path (str): Path of the snapshot.
+        mode (str): np.memmap mode. "c" (copy-on-write) lets processes share the pages of the file
+            until they write to them, "r" maps the arrays read-only.
+
+    Returns:
+        tuple: (arrays, metadata) with arrays a dict of array name to views on the mapped file.
+    """
+    with open(file_path, "rb") as f:
+        magic, version, header_size = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{file_path} is not a network snapshot.")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version {version}, expected {FORMAT_VERSION}.")
+        header = json.loads(f.read(header_size).decode("utf-8"))
+
+    buffer = np.memmap(file_path, dtype=np.uint8, mode=mode)
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        start = entry["offset"]
+        arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(entry["shape"])
+    return arrays, header["metadata"]
+
@@ -0,0 +1,293 @@
+import multiprocessing as mp
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from vector_environment import schedule_of
+
+
+class RemoteTraceback(Exception):
+    """Traceback of an exception raised in a worker, the cause of the exception raised again in the parent."""
+
+    def __str__(self):
+        return self.args[0]
+
+
+def _send_error(remote, error):
+    trace = traceback.format_exc()
+    try:
+        remote.send(("error", (error, trace)))
+    except Exception:
+        # Exceptions that cannot be pickled are sent as text
+        remote.send(("error", (RuntimeError(repr(error)), trace)))
+
+
+def _receive(remote):
+    """Reply of a worker, exceptions of the worker are raised here."""
+    status, payload = remote.recv()
+    if status == "error":
+        error, trace = payload
+        raise error from RemoteTraceback(trace)
+    return payload
+
+
+def _receive_all(remotes):
+    """Replies of several workers. Every reply is read before raising the first error, to keep the pipes in step."""
+    replies, errors = [], []
+    for remote in remotes:
+        try:
+            replies.append(_receive(remote))
+        except Exception as error:
+            replies.append(None)
+            errors.append(error)
+    if errors:
+        raise errors[0]
+    return replies
+
+
+def _worker(remote, parent_remote, env_fn, ranks, max_episode_steps, auto_reset, action_decoder):
+    """
+    Loop of a worker process owning the environments of the given ranks.
+
+    Observations, rewards and terminals are written in place in the shared buffers,
+    only commands, actions and infos go through the pipe. Every command is answered with
+    ("ok", result) or ("error", (exception, traceback)), the worker keeps serving commands
+    after an error so that the parent can still close it.
+    """
+    parent_remote.close()
+    try:
+        envs = [env_fn() for _ in ranks]
+        checkpoints = [env.checkpoint() for env in envs]
+        data = envs[0].observation()
+    except Exception as error:
+        _send_error(remote, error)
+        remote.close()
+        return
+    episode_steps = np.zeros(len(envs), dtype=np.int64)
+    # Environment r starts episode r and every reset moves it num_envs episodes further, so that
+    # all the episodes of a run draw their sampled demand from different streams
+    for i, env in enumerate(envs):
+        env.episode_id = ranks[i]
+    remote.send(("ok", (tuple(data.x.shape), data.edge_index)))
+
+    message = remote.recv()
+    if message is None:
+        # The parent gave up starting, e.g. another worker failed
+        remote.close()
+        return
+    shm_name, num_envs, observation_shape = message
+    shm = shared_memory.SharedMemory(name=shm_name)
+    observations, rewards, terminals = _buffers(shm, num_envs, observation_shape)
+
+    def observe(i):
+        observations[ranks[i]] = envs[i].observation().x.numpy()
+
+    def reset(i):
+        envs[i].restore(checkpoints[i])
+        envs[i].episode_id += num_envs
+        episode_steps[i] = 0
+        observe(i)
+
+    def step(actions):
+        infos = []
+        for i, env in enumerate(envs):
+            schedule = schedule_of(actions[i]) if action_decoder is None else action_decoder(ranks[i], actions[i])
+            reward, done = env.advance(schedule)
+            episode_steps[i] += 1
+            info = {}
+            if max_episode_steps is not None and episode_steps[i] >= max_episode_steps and not done:
+                info["TimeLimit.truncated"] = True
+                done = True
+            observe(i)
+            if done and auto_reset:
+                info["final_observation"] = observations[ranks[i]].copy()
+                reset(i)
+            rewards[ranks[i]] = reward
+            terminals[ranks[i]] = done
+            infos.append(info)
+        return infos
+
+    try:
+        while True:
+            command, payload = remote.recv()
+            if command == "close":
+                break
+            try:
+                if command == "step":
+                    result = step(payload)
+                elif command == "reset":
+                    for i in payload:
+                        reset(i)
+                    result = None
+                else:
+                    raise ValueError(f"Unknown command {command}.")
+            except Exception as error:
+                _send_error(remote, error)
+            else:
+                remote.send(("ok", result))
+    finally:
+        del observations, rewards, terminals
+        shm.close()
+        remote.close()
+
+
+def _buffers(shm, num_envs, observation_shape):
+    """Views on the shared memory block: observations (float32), rewards (float64), terminals (bool)."""
+    observations = np.ndarray((num_envs,) + tuple(observation_shape), dtype=np.float32, buffer=shm.buf)
+    offset = observations.nbytes
+    rewards = np.ndarray((num_envs,), dtype=np.float64, buffer=shm.buf, offset=offset)
+    offset += rewards.nbytes
+    terminals = np.ndarray((num_envs,), dtype=np.bool_, buffer=shm.buf, offset=offset)
+    return observations, rewards, terminals
+
+
+def _buffers_size(num_envs, observation_shape):
+    return num_envs * (int(np.prod(observation_shape)) * 4 + 8 + 1)
+
+
+class SubprocessVectorEnvironment:
+    def __init__(self, env_fn, num_envs, envs_per_worker=1, max_episode_steps=None, auto_reset=False, copy=True, start_method=None,
+                 action_decoder=None):
+        """
+        Step num_envs environments in worker processes, for simulations that cannot be vectorized.
+
+        Each worker owns envs_per_worker environments and writes their node features, rewards
+        and terminals into buffers shared with the parent process, instead of pickling states.
+        step_async / step_wait let the caller run inference while the workers simulate.
+
+        The action of an environment is turned into the schedule given to Environment.advance,
+        by schedule_of as in VectorEnvironment: schedules pass through and policy actions
+        (numbers) give an empty schedule, unless an action_decoder is given. Exceptions raised
+        in a worker are raised again by the call waiting for it, with the worker traceback as
+        their cause, and the environments can still be closed.
+
+        Args:
+            env_fn (callable): Called without arguments in each worker to build one Environment.
+            num_envs (int): Total number of environments.
+            envs_per_worker (int): Number of environments stepped sequentially by each worker.
+            max_episode_steps (int): Episodes are truncated after this many steps, None for no limit.
+            auto_reset (bool): Reset terminated environments in the worker at the end of step.
+            copy (bool): Return copies of the shared observation buffer instead of views on it.
+            start_method (str): multiprocessing start method, the platform default if None.
+            action_decoder (callable): Called in the workers as action_decoder(rank, action) to get the
+                schedule of an action. Must be picklable with start methods other than fork.
+        """
+        self.num_envs = num_envs
+        self.copy = copy
+        self.waiting = False
+        self.closed = False
+        context = mp.get_context(start_method)
+        # Workers must share the resource tracker of the parent, a tracker of their own would
+        # unlink the shared buffers when the worker exits
+        resource_tracker.ensure_running()
+
+        self.worker_ranks = [list(range(start, min(start + envs_per_worker, num_envs))) for start in range(0, num_envs, envs_per_worker)]
+        self.remotes, self.processes = [], []
+        for ranks in self.worker_ranks:
+            remote, worker_remote = context.Pipe()
+            process = context.Process(target=_worker, args=(worker_remote, remote, env_fn, ranks, max_episode_steps, auto_reset, action_decoder),
+                                      daemon=True)
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        try:
+            graphs = _receive_all(self.remotes)
+            shapes = {shape for shape, _ in graphs}
+            if len(shapes) != 1:
+                raise ValueError(f"Workers built environments with different observation shapes {shapes}.")
+        except Exception:
+            self._terminate()
+            raise
+        self.observation_shape = shapes.pop()
+        # Edge index shared by the observations, as VectorEnvironment.edge_index
+        self.edge_index = graphs[0][1]
+        self.shm = shared_memory.SharedMemory(create=True, size=_buffers_size(num_envs, self.observation_shape))
+        self.observations, self.rewards, self.terminals = _buffers(self.shm, num_envs, self.observation_shape)
+        for remote in self.remotes:
+            remote.send((self.shm.name, num_envs, self.observation_shape))
+
+    def reset(self, ranks=None):
+        """
+        Args:
+            ranks (array-like): Indices of the environments to reset, all of them if None.
+
+        Returns:
+            np.ndarray: Node features of the reset environments, shape (len(ranks), num_nodes, num_node_features).
+        """
+        ranks = np.arange(self.num_envs) if ranks is None else np.asarray(ranks, dtype=np.int64)
+        requests = {}
+        for rank in ranks.tolist():
+            worker, local = divmod(rank, len(self.worker_ranks[0]))
+            requests.setdefault(worker, []).append(local)
+        for worker, local_ranks in requests.items():
+            self.remotes[worker].send(("reset", local_ranks))
+        _receive_all([self.remotes[worker] for worker in requests])
+        return self.observations[ranks].copy()
+
+    def step_async(self, actions):
+        for remote, ranks in zip(self.remotes, self.worker_ranks):
+            remote.send(("step", [actions[rank] for rank in ranks]))
+        self.waiting = True
+
+    def step_wait(self):
+        """
+        Returns:
+            tuple: (observations, rewards, terminals, infos) as in VectorEnvironment.step.
+        """
+        try:
+            replies = _receive_all(self.remotes)
+        finally:
+            self.waiting = False
+        infos = [info for worker_infos in replies for info in worker_infos]
+        if self.copy:
+            return self.observations.copy(), self.rewards.copy(), self.terminals.copy(), infos
+        return self.observations, self.rewards, self.terminals, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.waiting:
+                self.step_wait()
+        except Exception:
+            pass
+        # Workers that died already are not waited for, the shared buffers are released anyway
+        for remote in self.remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        del self.observations, self.rewards, self.terminals
+        self.shm.close()
+        self.shm.unlink()
+
+    def _terminate(self):
+        for remote in self.remotes:
+            try:
+                remote.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.closed = True
+
+    def __del__(self):
+        if not getattr(self, "closed", True):
+            self.close()
+
+    def __repr__(self):
+        return f"SubprocessVectorEnvironment(num_envs={self.num_envs}, workers={len(self.processes)})"
@@ -28,9 +28,153 @@ def additional_demand(hour):
 
     return round(demand)
 
+def hourly_rates(profile=None, sigma=sigma):
+    """
+    Calcule en une fois les taux de demande additionnelle des 24 heures, comme additional_demand.
+
+    Args:
+    - profile (array-like): Demande moyenne de chaque heure, de forme (24,) pour un profil commun
+      à tous les noeuds ou (num_nodes, 24) pour un profil par noeud. Par défaut mu.
+    - sigma (float): Écart type des gaussiennes.
+
+    Returns:
+    - np.array: Taux de forme (24, 1) ou (24, num_nodes), une ligne par heure.
+    """
+    profile = np.asarray(mu if profile is None else profile, dtype=np.float64)
+    if profile.shape[-1] != 24:
+        raise ValueError("Le profil doit contenir une valeur par heure.")
+    profile = profile.reshape(-1, 24)
+    rates = norm.pdf(np.arange(24), profile, sigma)
+    return np.ascontiguousarray(np.maximum(rates, 0).T)
+
+class DemandStream:
+    def __init__(self, seed=0):
+        """
+        Nombres aléatoires reproductibles indexés par (seed, env, noeud, pas de temps).
+
+        Le générateur à compteur Philox est clé par (seed, env) et son compteur est placé au
+        début du bloc du pas de temps, chaque noeud y lisant toujours les deux mêmes mots.
+        N'importe quelle tranche de la chronologie peut donc être regénérée par n'importe quel
+        processus, sans rejouer les pas précédents.
+
+        Args:
+        - seed (int): Graine commune à tous les environnements.
+        """
+        self.seed = seed
+        self.bit_generator = np.random.Philox(key=np.array([seed, 0], dtype=np.uint64))
+        self._state = self.bit_generator.state
+
+    def _raw(self, env, timestep, num_nodes):
+        self._state["state"]["key"] = np.array([self.seed, env], dtype=np.uint64)
+        self._state["state"]["counter"] = np.array([0, timestep, 0, 0], dtype=np.uint64)
+        self._state["buffer_pos"] = 4
+        self.bit_generator.state = self._state
+        return self.bit_generator.random_raw(2 * num_nodes).reshape(num_nodes, 2)
+
+    def uniforms(self, envs, timesteps, num_nodes):
+        """
+        Args:
+        - envs (int ou array-like): Identifiant(s) d'environnement.
+        - timesteps (int ou array-like): Pas de temps, de même forme que envs après broadcast.
+        - num_nodes (int): Nombre de noeuds.
+
+        Returns:
+        - np.array: Deux uniformes dans ]0, 1] par noeud, de forme envs.shape + (num_nodes, 2).
+        """
+        envs, timesteps = np.broadcast_arrays(np.asarray(envs, dtype=np.int64), np.asarray(timesteps, dtype=np.int64))
+        raw = np.empty(envs.shape + (num_nodes, 2), dtype=np.uint64)
+        for index in np.ndindex(envs.shape):
+            raw[index] = self._raw(envs[index], timesteps[index], num_nodes)
+        # 53 bits de poids fort, décalés pour exclure 0 (log dans Box-Muller)
+        return ((raw >> np.uint64(11)) + 1) * 2.0 ** -53
+
+    def poisson(self, rates, envs, timesteps):
+        """Arrivées de loi de Poisson, par inversion de la fonction de répartition."""
+        rates = np.asarray(rates, dtype=np.float64)
+        u = self.uniforms(envs, timesteps, rates.shape[-1])
+        rates = np.broadcast_to(rates, u.shape[:-1])
+        counts = np.zeros(rates.shape, dtype=np.int64)
+        small = rates < 50
+        # Approximation normale pour les grands taux, où l'inversion demande trop d'itérations
+        counts[~small] = np.maximum(np.rint(rates[~small] + np.sqrt(rates[~small]) * _normal(u)[~small]), 0)
+        if small.any():
+            probability = np.exp(-rates[small])
+            cumulative = probability.copy()
+            target = u[..., 0][small]
+            k = np.zeros(len(target), dtype=np.int64)
+            active = target > cumulative
+            while active.any():
+                k[active] += 1
+                probability[active] *= rates[small][active] / k[active]
+                cumulative[active] += probability[active]
+                active &= (target > cumulative) & (probability > 0)
+            counts[small] = k
+        return counts
+
+    def gaussian(self, rates, envs, timesteps, scale=None):
+        """Arrivées gaussiennes arrondies et positives, d'écart type scale (racine du taux par défaut)."""
+        rates = np.asarray(rates, dtype=np.float64)
+        z = _normal(self.uniforms(envs, timesteps, rates.shape[-1]))
+        scale = np.sqrt(rates) if scale is None else scale
+        return np.maximum(np.rint(rates + scale * z), 0).astype(np.int64)
+
+def _normal(u):
+    # Box-Muller sur les deux uniformes de chaque noeud
+    return np.sqrt(-2 * np.log(u[..., 0])) * np.cos(2 * np.pi * u[..., 1])
+
+class DemandModel:
+    def __init__(self, profile=None, sigma=sigma, sampled=False, seed=0, distribution="poisson"):
+        """
+        Demande additionnelle de tous les noeuds, à partir de tables horaires précalculées.
+
+        Args:
+        - profile (array-like): Profil horaire commun (24,) ou par noeud (num_nodes, 24), voir hourly_rates.
+        - sigma (float): Écart type des gaussiennes.
+        - sampled (bool): Si True, les arrivées sont tirées autour du taux de l'heure,
+          sinon elles valent le taux arrondi, comme additional_demand.
+        - seed (int): Graine du DemandStream utilisé quand sampled est True.
+        - distribution (str): "poisson" ou "gaussian", loi des arrivées tirées.
+        """
+        if distribution not in ("poisson", "gaussian"):
+            raise ValueError(f"Loi {distribution} inconnue.")
+        self.rates = hourly_rates(profile, sigma)
+        self.increments = np.rint(self.rates).astype(np.int64)
+        self.sampled = sampled
+        self.distribution = distribution
+        self.stream = DemandStream(seed)
+
+    def arrivals(self, hour, num_nodes, env=0):
+        """
+        Args:
+        - hour (int ou np.array): Heure(s) de la simulation depuis le début, ramenées à l'heure de la journée
+          pour le taux. Elles servent aussi de pas de temps aux tirages.
+        - num_nodes (int): Nombre de noeuds.
+        - env (int ou np.array): Identifiant(s) d'environnement des tirages, de même forme que hour.
+
+        Returns:
+        - np.array: Demande additionnelle de forme (num_nodes,), ou (len(hour), num_nodes) pour un tableau d'heures.
+        """
+        timestep = np.asarray(hour, dtype=np.int64)
+        hour = timestep % 24
+        table = self.rates if self.sampled else self.increments
+        if table.shape[1] not in (1, num_nodes):
+            raise ValueError(f"Le profil est défini pour {table.shape[1]} noeuds, pas {num_nodes}.")
+        values = np.broadcast_to(table[hour], hour.shape + (num_nodes,))
+        if not self.sampled:
+            return values
+        envs = np.broadcast_to(np.asarray(env, dtype=np.int64), hour.shape)
+        if self.distribution == "poisson":
+            return self.stream.poisson(values, envs, timestep)
+        return self.stream.gaussian(values, envs, timestep)
+
+    def apply(self, demand, hour, env=0):
+        """Ajoute en place la demande additionnelle de l'heure au tableau des demandes des noeuds."""
+        demand += self.arrivals(hour, demand.shape[-1], env)
+
 # Exemple d'utilisation
 if __name__ == "__main__":
     for hour in range(24):
         print(f"Demande additionnelle à {hour}h: {additional_demand(hour)}")
+    print(DemandModel(sampled=True, seed=0).arrivals(np.arange(24), 3))
 
 
@@ -0,0 +1,354 @@
+import numpy as np
+import torch
+
+from reward import calculate_batch_penalty
+from simulation import ARC_ENTRY, ARC_EXIT, ARRIVAL, DEPARTURE, hours_until_open, operational
+
+
+def schedule_of(action):
+    """
+    Schedule of trips given by an action, as taken by Environment.advance.
+
+    Lists or tuples of events are schedules already. Actions of a policy (numbers) are not
+    decoded into trips and give an empty schedule, an action_decoder maps them otherwise.
+    """
+    if isinstance(action, (list, tuple)):
+        return list(action)
+    return []
+
+
+class VectorEnvironment:
+    def __init__(self, environment, num_envs, max_episode_steps=None, auto_reset=False, copy=True, action_decoder=None):
+        """
+        Step num_envs copies of a network in lockstep, with the dynamic state of every copy
+        stacked in arrays of shape (num_envs, ...).
+
+        The static part of the network (topology, types, coordinates, lengths, travel times...)
+        is shared with the template environment, only the columns that evolve during an
+        episode are duplicated per copy: the demand of the nodes, whether the arcs are open
+        and the location, progress and circuit of every vehicle.
+
+        A step lasts one hour, like Environment.advance(schedule, duration=1.0): trips of the
+        schedules are planned, every vehicle of every copy moves until the end of the hour
+        with the rules of the Simulator (departures wait for their node to open, closed arcs
+        are retried at the next hour, arcs are crossed in their travel time), then the demand
+        of the hour arrives and the reward is computed for all copies at once.
+
+        Sampled demand (see DemandModel) is drawn from the stream of the episode: copy r
+        starts episode r and every reset gives the copy the next unused episode number, so
+        that a run is reproducible from the seed of the demand model alone.
+
+        Args:
+            environment (Environment): Template network, its current state is the initial state of every copy.
+            num_envs (int): Number of copies.
+            max_episode_steps (int): Episodes are truncated after this many steps, None for no limit.
+            auto_reset (bool): Reset terminated copies at the end of step. The last observation of a
+                reset copy is then returned in infos[rank]["final_observation"].
+            copy (bool): Return copies of the observation buffer instead of the buffer itself.
+            action_decoder (callable): Called as action_decoder(rank, action) to get the schedule of
+                an action, see Environment.apply_event. schedule_of if None.
+        """
+        self.environment = environment
+        self.num_envs = num_envs
+        self.max_episode_steps = max_episode_steps
+        self.auto_reset = auto_reset
+        self.copy = copy
+        self.action_decoder = action_decoder
+
+        node_table = environment.node_table
+        arc_table = environment.arc_table
+        self.initial_demand = node_table["demand"].copy()
+        self.initial_open = arc_table["open"].copy()
+        self.initial_time = float(environment.current_time)
+
+        self.demand = np.tile(self.initial_demand, (num_envs, 1))
+        self.open = np.tile(self.initial_open, (num_envs, 1))
+        self.current_time = np.full(num_envs, self.initial_time, dtype=np.float64)
+        self.episode_steps = np.zeros(num_envs, dtype=np.int64)
+        self.episode_ids = np.arange(num_envs)
+        self._next_episode_id = num_envs
+
+        self.demand_model = environment.demand_model
+
+        # Static arrays of the movement rules
+        self.node_ids = node_table.ids.copy()
+        self.arc_ids = arc_table.ids.copy()
+        self.service_hours = node_table["service_hours"][:, :2].astype(np.float64)
+        self.arc_hours = arc_table["travel_time"].astype(np.float64) / 60
+        self.arc_target_rows = arc_table["target_row"].copy()
+        # Arcs sorted by (source row, target row), then travel time as the Simulator picks them
+        num_nodes = len(node_table)
+        pair_keys = arc_table["source_row"] * num_nodes + arc_table["target_row"]
+        self._pair_arcs = np.lexsort((np.arange(len(arc_table)), self.arc_hours, pair_keys))
+        self._pair_keys = pair_keys[self._pair_arcs]
+        self._max_parallel_arcs = int(np.unique(pair_keys, return_counts=True)[1].max()) if len(pair_keys) else 0
+        self._num_nodes = num_nodes
+        self._init_fleet(environment)
+
+        data = environment.observation(clone=True)
+        self.edge_index = data.edge_index
+        self._demand_column = environment.observation_builder.node_slices["demand"].start
+        self._observations = np.repeat(data.x.numpy()[None], num_envs, axis=0)
+
+    def _init_fleet(self, environment):
+        """Vehicle arrays of the template, with the pending events of its simulator as next times."""
+        fleet = environment.fleet
+        num_vehicles = len(fleet)
+        now = self.initial_time
+        self.vehicle_ids = fleet.ids.copy()
+        self._vehicle_rows = {vehicle_id: row for row, vehicle_id in enumerate(self.vehicle_ids.tolist())}
+        self.in_service = fleet["in_service"].astype(bool)
+
+        is_node = fleet["is_node"].astype(np.int64)
+        location_rows = np.where(is_node == 1, environment.node_table.rows(fleet["location_id"]), environment.arc_table.rows(fleet["location_id"]))
+        lengths = np.array([fleet.circuit_length(row) for row in range(num_vehicles)], dtype=np.int64)
+        circuits = np.zeros((num_vehicles, max(2, int(lengths.max()) if num_vehicles else 0)), dtype=np.int64)
+        for row in range(num_vehicles):
+            circuits[row, :lengths[row]] = environment.node_table.rows(fleet.get("circuit", row))
+
+        pending = {}
+        for time, kind, _, payload in environment.simulator.queue:
+            if kind in (DEPARTURE, ARC_ENTRY, ARC_EXIT, ARRIVAL):
+                pending[payload[0]] = min(time, pending.get(payload[0], np.inf))
+        waiting = {vehicle_id for vehicle_ids in environment.simulator.waiting.values() for vehicle_id in vehicle_ids}
+        next_time = np.full(num_vehicles, np.inf)
+        for row, vehicle_id in enumerate(self.vehicle_ids.tolist()):
+            if vehicle_id in pending:
+                next_time[row] = pending[vehicle_id]
+            elif not is_node[row] and location_rows[row] >= 0:
+                # Trip restored without its events, as in Simulator.resume
+                next_time[row] = now + (1 - fleet["progress"][row]) * self.arc_hours[location_rows[row]]
+            elif vehicle_id in waiting or (fleet["start"][row] and lengths[row] > 1):
+                next_time[row] = now
+
+        self._initial_fleet = {
+            "is_node": is_node, "location_rows": location_rows, "progress": fleet["progress"].astype(np.float64),
+            "start": fleet["start"].astype(np.int64), "circuits": circuits, "circuit_positions": np.zeros(num_vehicles, dtype=np.int64),
+            "circuit_lengths": lengths, "next_time": next_time,
+        }
+        for name, array in self._initial_fleet.items():
+            setattr(self, name, np.repeat(array[None], self.num_envs, axis=0))
+
+    def reset(self, ranks=None):
+        """
+        Reset the given copies to the initial state.
+
+        Args:
+            ranks (array-like): Indices of the copies to reset, all of them if None.
+
+        Returns:
+            np.ndarray: Node features of the reset copies, shape (len(ranks), num_nodes, num_node_features).
+        """
+        ranks = np.arange(self.num_envs) if ranks is None else np.asarray(ranks, dtype=np.int64)
+        self.demand[ranks] = self.initial_demand
+        self.open[ranks] = self.initial_open
+        for name, array in self._initial_fleet.items():
+            if name == "circuits":
+                # Circuits may have been widened by longer trips
+                self.circuits[ranks] = 0
+                self.circuits[ranks, :, :array.shape[1]] = array
+            else:
+                getattr(self, name)[ranks] = array
+        self.current_time[ranks] = self.initial_time
+        self.episode_steps[ranks] = 0
+        self.episode_ids[ranks] = self._next_episode_id + np.arange(len(ranks))
+        self._next_episode_id += len(ranks)
+        return self._observe(ranks)
+
+    def step(self, actions):
+        """
+        Advance every copy by one hour.
+
+        Args:
+            actions (array-like): One action per copy, see apply_actions.
+
+        Returns:
+            tuple: (observations, rewards, terminals, infos) with observations of shape
+                (num_envs, num_nodes, num_node_features), rewards and terminals of shape (num_envs,)
+                and infos a list of num_envs dicts.
+        """
+        self.apply_actions(actions)
+        start = self.current_time.copy()
+        end = start + 1
+        self.move_vehicles(end)
+        # Demand arrives for the hour started during the step, as in Environment.advance
+        self.current_time = np.ceil(start)
+        self.update_state()
+        self.current_time = end
+        self.episode_steps += 1
+        rewards = self.calculate_reward()
+
+        terminals = np.zeros(self.num_envs, dtype=bool)
+        infos = [{} for _ in range(self.num_envs)]
+        if self.max_episode_steps is not None:
+            truncated = np.flatnonzero(self.episode_steps >= self.max_episode_steps)
+            terminals[truncated] = True
+            for rank in truncated:
+                infos[rank]["TimeLimit.truncated"] = True
+
+        observations = self._observe()
+        if self.auto_reset and terminals.any():
+            ranks = np.flatnonzero(terminals)
+            for rank in ranks:
+                infos[rank]["final_observation"] = observations[rank].copy()
+            observations[ranks] = self.reset(ranks)
+        return observations, rewards, terminals, infos
+
+    def apply_actions(self, actions):
+        """
+        Plan the trips of the schedule of each copy, the counterpart of Environment.apply_event.
+
+        Args:
+            actions (array-like): One action per copy, turned into a schedule of (vehicle_id,
+                departure_time, circuit) events by the action_decoder.
+        """
+        for rank, action in enumerate(actions):
+            schedule = schedule_of(action) if self.action_decoder is None else self.action_decoder(rank, action)
+            for vehicle_id, departure_time, circuit in schedule:
+                self.schedule_trip(rank, vehicle_id, departure_time, circuit)
+
+    def schedule_trip(self, rank, vehicle_id, departure_time, circuit):
+        """Simulator.schedule_trip in one copy."""
+        if vehicle_id not in self._vehicle_rows:
+            raise ValueError(f"Vehicle with ID {vehicle_id} does not exist.")
+        row = self._vehicle_rows[vehicle_id]
+        if not self.is_node[rank, row]:
+            raise ValueError(f"Vehicle {vehicle_id} is on an arc and cannot start a trip.")
+        node_id = self.node_ids[self.location_rows[rank, row]]
+        if len(circuit) < 2 or circuit[0] != node_id:
+            raise ValueError(f"Circuit {circuit} of vehicle {vehicle_id} must start at its node {node_id} and have a destination.")
+        node_rows = self.environment.node_rows(circuit)
+        first, last = self._arc_range(node_rows[:-1], node_rows[1:])
+        missing = np.flatnonzero((first == last) | (node_rows[:-1] < 0) | (node_rows[1:] < 0))
+        if len(missing):
+            raise ValueError(f"No arc from node {circuit[missing[0]]} to node {circuit[missing[0] + 1]}.")
+        if len(circuit) > self.circuits.shape[2]:
+            widened = np.zeros(self.circuits.shape[:2] + (len(circuit),), dtype=np.int64)
+            widened[:, :, :self.circuits.shape[2]] = self.circuits
+            self.circuits = widened
+        self.circuits[rank, row, :len(circuit)] = node_rows
+        self.circuit_positions[rank, row] = 0
+        self.circuit_lengths[rank, row] = len(circuit)
+        self.start[rank, row] = 1
+        self.next_time[rank, row] = max(float(departure_time), self.current_time[rank])
+
+    def move_vehicles(self, end):
+        """
+        Process the departures and arc exits of every vehicle of every copy up to the end time of
+        its copy, one transition per vehicle and iteration, so that trips chain arcs within a step.
+
+        Args:
+            end (np.ndarray): End time of each copy, shape (num_envs,).
+        """
+        while True:
+            ranks, rows = np.nonzero(self.next_time <= end[:, None])
+            if len(ranks) == 0:
+                break
+            times = self.next_time[ranks, rows]
+            on_arc = self.is_node[ranks, rows] == 0
+            self._arrive(ranks[on_arc], rows[on_arc], times[on_arc])
+            self._depart(ranks[~on_arc], rows[~on_arc], times[~on_arc])
+
+        # Progress of the vehicles on arcs at the end of the step
+        ranks, rows = np.nonzero(self.is_node == 0)
+        hours = np.maximum(self.arc_hours[self.location_rows[ranks, rows]], 1e-9)
+        self.progress[ranks, rows] = np.clip(1 - (self.next_time[ranks, rows] - end[ranks]) / hours, 0.0, 1.0)
+
+    def _arrive(self, ranks, rows, times):
+        positions = self.circuit_positions[ranks, rows] + 1
+        self.circuit_positions[ranks, rows] = positions
+        self.is_node[ranks, rows] = 1
+        self.location_rows[ranks, rows] = self.circuits[ranks, rows, positions]
+        self.progress[ranks, rows] = 0
+        # The trip goes on at once while the circuit has a next node
+        self.next_time[ranks, rows] = np.where(self.circuit_lengths[ranks, rows] - positions > 1, times, np.inf)
+
+    def _depart(self, ranks, rows, times):
+        positions = self.circuit_positions[ranks, rows]
+        done = ~self.in_service[rows] | (self.circuit_lengths[ranks, rows] - positions < 2)
+        self.start[ranks[done], rows[done]] = 0
+        self.next_time[ranks[done], rows[done]] = np.inf
+        ranks, rows, times, positions = ranks[~done], rows[~done], times[~done], positions[~done]
+
+        # Departures from closed nodes wait for them to open
+        node_rows = self.location_rows[ranks, rows]
+        service_hours = self.service_hours[node_rows]
+        closed = ~operational(service_hours, times % 24)
+        self.next_time[ranks[closed], rows[closed]] = times[closed] + hours_until_open(service_hours[closed], times[closed] % 24)
+        ranks, rows, times, positions, node_rows = ranks[~closed], rows[~closed], times[~closed], positions[~closed], node_rows[~closed]
+
+        # Fastest open arc towards the next node of the copy, retried at the next hour if there is none
+        first, last = self._arc_range(node_rows, self.circuits[ranks, rows, positions + 1])
+        arcs = np.full(len(ranks), -1, dtype=np.int64)
+        for offset in range(self._max_parallel_arcs):
+            arc_rows = self._pair_arcs[np.minimum(first + offset, len(self._pair_arcs) - 1)]
+            usable = (arcs < 0) & (first + offset < last) & (self.open[ranks, arc_rows] != 0)
+            arcs[usable] = arc_rows[usable]
+        blocked = arcs < 0
+        self.next_time[ranks[blocked], rows[blocked]] = np.floor(times[blocked]) + 1
+
+        ranks, rows, times, arcs = ranks[~blocked], rows[~blocked], times[~blocked], arcs[~blocked]
+        self.is_node[ranks, rows] = 0
+        self.location_rows[ranks, rows] = arcs
+        self.progress[ranks, rows] = 0
+        self.start[ranks, rows] = 0
+        self.next_time[ranks, rows] = times + self.arc_hours[arcs]
+
+    def _arc_range(self, source_rows, target_rows):
+        """Range of the arcs from each source to each target node row in the sorted pair arrays."""
+        keys = np.asarray(source_rows) * self._num_nodes + np.asarray(target_rows)
+        return np.searchsorted(self._pair_keys, keys, side="left"), np.searchsorted(self._pair_keys, keys, side="right")
+
+    def set_arc_open(self, rank, arc_id, open):
+        """Open or close an arc in one copy, the counterpart of Arc.open."""
+        self.open[rank, self.environment.arc_table.row(arc_id)] = open
+
+    def locations(self):
+        """
+        Location of every vehicle of every copy.
+
+        Returns:
+            tuple: is_node and location_id (node or arc ID) arrays of shape (num_envs, num_vehicles),
+                in the order of vehicle_ids.
+        """
+        location_ids = np.full(self.location_rows.shape, -1, dtype=np.int64)
+        for is_node, ids in ((1, self.node_ids), (0, self.arc_ids)):
+            located = (self.is_node == is_node) & (self.location_rows >= 0)
+            location_ids[located] = ids[self.location_rows[located]]
+        return self.is_node.copy(), location_ids
+
+    def circuit(self, rank, vehicle_id):
+        """Node IDs of the rest of the circuit of a vehicle in one copy, as Vehicle.circuit."""
+        row = self._vehicle_rows[vehicle_id]
+        position, length = self.circuit_positions[rank, row], self.circuit_lengths[rank, row]
+        return self.node_ids[self.circuits[rank, row, position:length]].tolist()
+
+    def update_state(self):
+        self.update_demand()
+
+    def update_demand(self):
+        self.demand_model.apply(self.demand, self.current_time, env=self.episode_ids)
+
+    def calculate_reward(self):
+        """Environment.calculate_reward for every copy at once."""
+        return calculate_batch_penalty(self.demand)
+
+    def _observe(self, ranks=None):
+        if ranks is None:
+            self._observations[:, :, self._demand_column] = self.demand
+            observations = self._observations
+        else:
+            self._observations[ranks, :, self._demand_column] = self.demand[ranks]
+            observations = self._observations[ranks]
+        return observations.copy() if self.copy else observations
+
+    def get_graph(self, rank):
+        """PyTorch Geometric observation of one copy, with its own demand and open columns."""
+        data = self.environment.observation(clone=True)
+        data.x = torch.from_numpy(self._observations[rank].copy())
+        arc_slices = self.environment.observation_builder.arc_slices
+        data.edge_attr[:, arc_slices["open"].start] = torch.from_numpy(self.open[rank].astype(np.float32))
+        return data
+
+    def __repr__(self):
+        return f"VectorEnvironment(num_envs={self.num_envs}, nodes={len(self.environment.nodes)}, arcs={len(self.environment.arcs)})"
@@ -1,7 +1,21 @@
 import torch
+from network_state import RowView, column_property
 
-class Vehicle:
-    def __init__(self, id, in_service, type, is_node, location_id, start, capacity, capacity_left, service_hours, circuit):
+class Vehicle(RowView):
+    columns = ("in_service", "type", "is_node", "location_id", "start", "capacity", "capacity_left", "service_hours", "progress", "circuit")
+
+    in_service = column_property("in_service")
+    type = column_property("type")
+    is_node = column_property("is_node")
+    location_id = column_property("location_id")
+    start = column_property("start")
+    capacity = column_property("capacity")
+    capacity_left = column_property("capacity_left")
+    service_hours = column_property("service_hours")
+    progress = column_property("progress")
+    circuit = column_property("circuit")
+
+    def __init__(self, id, in_service, type, is_node, location_id, start, capacity, capacity_left, service_hours, circuit, progress=0.0):
         """
         Initialize a vehicle in the transportation network.
 
@@ -16,7 +30,11 @@ class Vehicle:
             capacity_left (int): Remaining capacity of the vehicle.
             service_hours (torch.Tensor): Tensor [opening hour, closing hour] representing operational hours.
             circuit (list): List of node IDs representing the path for the next trip/current trip.
+            progress (float): Fraction of its arc already travelled by a vehicle on an arc.
+
+        Once the vehicle is added to an Environment, its attributes are views on a row of the environment's FleetTable.
         """
+        self._init_view()
         self.id = id
         self.in_service = in_service
         self.type = type
@@ -27,6 +45,7 @@ class Vehicle:
         self.capacity_left = capacity_left
         self.service_hours = service_hours
         self.circuit = circuit
+        self.progress = progress
 
     def to_tensor(self):
         main_attributes_tensor = torch.tensor([
@@ -1,10 +1,8 @@
 import sys
 sys.path.append("../environment/")
 
-import torch
 import networkx as nx
 import matplotlib.pyplot as plt
-import pandas as pd
 from environment import Environment
 
 def visualize_network(network):
@@ -34,14 +32,10 @@ def visualize_network(network):
 
 if __name__ == "__main__":
     # Load the TransportNetwork object
-    network = Environment()
-    pyg_data = torch.load("../../data/generated/environment.pth")
-    node_sizes_df = pd.read_csv("../../data/generated/node_sizes.csv")
-    arc_sizes_df = pd.read_csv("../../data/generated/arc_sizes.csv")
-    
-    network.from_pyg_data(pyg_data, node_sizes_df, arc_sizes_df)
-    
-    print("Graph loaded from environment.pth")
+    # Written by running environment.py
+    network = Environment.load_snapshot("../../data/generated/environment.snap")
+
+    print("Graph loaded from environment.snap")
     
     # Print out nodes and their coordinates for debugging
     for node_id, node in network.nodes.items():
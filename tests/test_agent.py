@@ -0,0 +1,477 @@
+import sys
+sys.path.append("../src/")
+sys.path.append("../src/environment/")
+sys.path.append("../src/agent/")
+
+import functools
+import os
+import tempfile
+import types
+import unittest
+import numpy as np
+import torch
+from environment import load_network_from_csv, VectorEnvironment, SubprocessVectorEnvironment
+from torch_geometric.data import Batch, Data
+from torch_geometric.nn import global_mean_pool
+from episode_buffer import EpisodeBuffer, batch_graphs, discounted_cumsum, prefetch
+from optimize_model import optimize_model
+from graph_embedder import GraphEmbedder
+from actor_critic import ActorCritic
+from inference_server import InferenceServer
+from export import export_policy, check_parity, latency_percentiles, example_inputs
+import threading
+from torch_geometric.nn import GCNConv
+
+
+class RandomPolicy:
+    def __init__(self, num_actions, seed=0):
+        self.num_actions = num_actions
+        self.rng = np.random.default_rng(seed)
+
+    def np_pass(self, states):
+        actions = self.rng.integers(self.num_actions, size=len(states))
+        logpas = np.full(len(states), -np.log(self.num_actions), dtype=np.float32)
+        return actions, logpas, self.rng.random(len(states)) < 0.5
+
+
+def mean_feature_value(states):
+    return torch.as_tensor(states).mean(dim=(1, 2))
+
+
+class PooledLinear(torch.nn.Module):
+    """Linear layer on the mean node features of each graph, a minimal policy or value model."""
+
+    def __init__(self, num_features, num_outputs):
+        super().__init__()
+        self.linear = torch.nn.Linear(num_features, num_outputs)
+        self.device = torch.device("cpu")
+
+    def forward(self, states):
+        return self.linear(global_mean_pool(states.x, states.batch))
+
+    def get_predictions(self, states, actions):
+        distribution = torch.distributions.Categorical(logits=self(states))
+        return distribution.log_prob(actions), distribution.entropy()
+
+
+class PPOAgent:
+    optimize_model = optimize_model
+
+    def __init__(self, episode_buffer, num_features, num_actions, **settings):
+        self.episode_buffer = episode_buffer
+        self.policy_model = PooledLinear(num_features, num_actions)
+        self.value_model = PooledLinear(num_features, 1)
+        self.policy_optimizer = torch.optim.Adam(self.policy_model.parameters(), lr=1e-2)
+        self.value_optimizer = torch.optim.Adam(self.value_model.parameters(), lr=1e-2)
+        self.policy_optimization_epochs = 4
+        self.policy_sample_ratio = 0.25
+        self.policy_clip_range = 0.1
+        self.policy_stopping_kl = 0.02
+        self.policy_model_max_grad_norm = 1.0
+        self.entropy_loss_weight = 0.01
+        self.value_optimization_epochs = 4
+        self.value_sample_ratio = 0.25
+        self.value_clip_range = float("inf")
+        self.value_stopping_mse = 25
+        self.value_model_max_grad_norm = 1.0
+        self.__dict__.update(settings)
+
+
+class TestAgent(unittest.TestCase):
+
+    def test_discounted_cumsum(self):
+        rng = np.random.default_rng(0)
+        rewards = rng.normal(size=(3, 50))
+        lengths = [50, 17, 1]
+        for row, length in enumerate(lengths):
+            rewards[row, length:] = 0
+        discounts = 0.99 ** np.arange(50)
+        returns = discounted_cumsum(rewards, 0.99)
+        self.assertEqual(returns.shape, rewards.shape)
+        for row, length in enumerate(lengths):
+            expected = [np.sum(discounts[:length - t] * rewards[row, t:length]) for t in range(length)]
+            np.testing.assert_allclose(returns[row, :length], expected)
+        np.testing.assert_allclose(discounted_cumsum([1.0, 2.0, 3.0], 0.0), [1.0, 2.0, 3.0])
+
+    def test_episode_buffer_fill(self):
+        environment = load_network_from_csv("../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        envs = VectorEnvironment(environment, num_envs=3)
+        # With tau = 1 the GAEs are the returns minus the values
+        gamma = 0.9
+        discounts = gamma ** np.arange(8)
+        buffer = EpisodeBuffer(7, 8, discounts, discounts, gamma)
+        ep_t, ep_r, ep_x, ep_s = buffer.fill(envs, RandomPolicy(4), mean_feature_value)
+
+        self.assertGreaterEqual(buffer.n_episodes, 4)
+        self.assertEqual(len(ep_t), buffer.n_episodes)
+        self.assertTrue(np.all(ep_t == 7))
+        self.assertEqual(len(buffer), ep_t.sum())
+        np.testing.assert_array_equal(np.diff(buffer.episode_offsets[:buffer.n_episodes + 1]), ep_t)
+        self.assertEqual(buffer.states_mem.dtype, torch.float32)
+        self.assertEqual(buffer.states_mem.shape[1:], environment.observation().x.shape)
+        self.assertEqual(buffer.actions_mem.dtype, torch.int64)
+        self.assertTrue(torch.equal(buffer.edge_index, envs.edge_index))
+
+        steps = slice(0, len(buffer))
+        values = mean_feature_value(buffer.states_mem[steps])
+        torch.testing.assert_close(buffer.values_mem[steps], values)
+        torch.testing.assert_close(buffer.gaes_mem[steps], buffer.returns_mem[steps] - values, rtol=1e-4, atol=1e-3)
+
+        # Returns of an episode follow R[t] = r[t] + gamma * R[t + 1]
+        start, T = buffer.episode_offsets[1], ep_t[1]
+        returns = buffer.returns_mem[start:start + T].double().numpy()
+        rewards = returns[:-1] - gamma * returns[1:]
+        self.assertTrue(np.all(rewards < 0))
+
+        # A second fill reuses the storage
+        states_mem = buffer.states_mem
+        buffer.fill(envs, RandomPolicy(4, seed=1), mean_feature_value)
+        self.assertIs(buffer.states_mem, states_mem)
+
+    def test_episode_buffer_fill_subprocess(self):
+        env_fn = functools.partial(load_network_from_csv, "../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        envs = SubprocessVectorEnvironment(env_fn, num_envs=2, start_method="fork")
+        try:
+            discounts = 0.9 ** np.arange(5)
+            buffer = EpisodeBuffer(4, 4, discounts, discounts, 0.9)
+            ep_t, ep_r, _, _ = buffer.fill(envs, RandomPolicy(3), mean_feature_value)
+            self.assertGreaterEqual(buffer.n_episodes, 2)
+            self.assertTrue(np.all(ep_t == 4))
+            self.assertTrue(torch.equal(buffer.edge_index, env_fn().observation().edge_index))
+            self.assertTrue(np.all(ep_r < 0))
+        finally:
+            envs.close()
+
+    def test_episode_buffer_fill_without_edge_index(self):
+        environment = load_network_from_csv("../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        envs = VectorEnvironment(environment, num_envs=2)
+        discounts = 0.9 ** np.arange(4)
+        buffer = EpisodeBuffer(3, 2, discounts, discounts, 0.9)
+        buffer.fill(types.SimpleNamespace(num_envs=2, reset=envs.reset, step=envs.step), RandomPolicy(3), mean_feature_value)
+        self.assertIsNone(buffer.edge_index)
+        self.assertEqual(next(iter(buffer.sample(2, graph=False))).states.dim(), 3)
+        with self.assertRaises(ValueError):
+            next(iter(buffer.sample(2)))
+        buffer.edge_index = envs.edge_index
+        self.assertEqual(next(iter(buffer.sample(2))).states.num_graphs, 2)
+
+    def test_episode_buffer_sample(self):
+        environment = load_network_from_csv("../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        envs = VectorEnvironment(environment, num_envs=2)
+        discounts = 0.9 ** np.arange(6)
+        buffer = EpisodeBuffer(5, 4, discounts, discounts, 0.9)
+        buffer.fill(envs, RandomPolicy(3), mean_feature_value)
+        num_nodes, num_edges = envs.edge_index.max().item() + 1, envs.edge_index.size(1)
+
+        # Each epoch covers every step once
+        generator = torch.Generator().manual_seed(0)
+        seen = []
+        for batch in buffer.sample(3, epochs=2, generator=generator):
+            self.assertIsInstance(batch.states, Batch)
+            size = len(batch.actions)
+            self.assertEqual(batch.states.num_graphs, size)
+            self.assertEqual(batch.states.edge_index.shape, (2, size * num_edges))
+            self.assertEqual(batch.states.edge_index[:, -1].tolist(), (envs.edge_index[:, -1] + (size - 1) * num_nodes).tolist())
+            seen.append(batch.returns)
+        returns = torch.cat(seen)
+        self.assertEqual(len(returns), 2 * len(buffer))
+        torch.testing.assert_close(returns[:len(buffer)].sort().values, buffer.returns_mem[:len(buffer)].sort().values)
+
+        # Graph and dense states hold the same node features
+        idxs = torch.tensor([4, 0, 2])
+        graphs, dense = buffer.collate(idxs), buffer.collate(idxs, graph=False)
+        self.assertEqual(dense.states.shape, (3,) + tuple(buffer.states_mem.shape[1:]))
+        torch.testing.assert_close(graphs.states.x.view_as(dense.states), buffer.states_mem[idxs])
+        self.assertEqual(len(list(buffer.sample(len(buffer), epochs=3, batches_per_epoch=1))), 3)
+
+    def test_optimize_model(self):
+        environment = load_network_from_csv("../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        envs = VectorEnvironment(environment, num_envs=2)
+        discounts = 0.9 ** np.arange(6)
+        buffer = EpisodeBuffer(5, 4, discounts, discounts, 0.9)
+        buffer.fill(envs, RandomPolicy(3), lambda states: torch.zeros(len(states)))
+        num_features = buffer.states_mem.shape[-1]
+
+        # 10 steps in batches of 2: 5 batches per epoch, 4 epochs unless stopped by the KL divergence
+        cases = [
+            ({"policy_stopping_kl": float("inf")}, [2] * 20),
+            ({"policy_stopping_kl": float("inf"), "policy_full_kl_every": 2, "value_full_mse_every": 1}, [2] * 10 + [10] + [2] * 10 + [10]),
+            ({"policy_stopping_kl": -float("inf")}, [2] * 5),
+        ]
+        for settings, expected_calls in cases:
+            torch.manual_seed(0)
+            agent = PPOAgent(buffer, num_features, 3, **settings)
+            # Uniform policy, the one that collected the rollout
+            torch.nn.init.zeros_(agent.policy_model.linear.weight)
+            torch.nn.init.zeros_(agent.policy_model.linear.bias)
+            calls = []
+            get_predictions = agent.policy_model.get_predictions
+            agent.policy_model.get_predictions = lambda states, actions: calls.append(states.num_graphs) or get_predictions(states, actions)
+            agent.optimize_model()
+            self.assertEqual(len(buffer), 10)
+            self.assertEqual(calls, expected_calls)
+            self.assertFalse(torch.equal(agent.policy_model.linear.weight, torch.zeros_like(agent.policy_model.linear.weight)))
+
+        # The early-stopping MSE is the mean over the epoch of the errors of the (batch_size, 1) predictions
+        torch.manual_seed(0)
+        agent = PPOAgent(buffer, num_features, 3, policy_stopping_kl=float("inf"), value_stopping_mse=float("inf"),
+                         value_clip_range=0.5, value_optimization_epochs=2)
+        batches, predictions = [], []
+        sample = buffer.sample
+        buffer.sample = lambda *args, **kwargs: (batches.append(batch) or batch for batch in sample(*args, **kwargs))
+        agent.value_model.register_forward_hook(lambda module, inputs, output: predictions.append(output.detach()))
+        try:
+            stats = agent.optimize_model()
+        finally:
+            del buffer.sample
+        values = torch.cat([batch.values for batch in batches[20:]])
+        errors = (values - torch.cat(predictions).reshape(-1)).pow(2).mul(0.5)
+        self.assertEqual(len(stats["mse"]), 2)
+        np.testing.assert_allclose(stats["mse"], [errors[:10].mean().item(), errors[10:].mean().item()], rtol=1e-5)
+
+    def test_graph_embedder_static_topology(self):
+        torch.manual_seed(0)
+        environment = load_network_from_csv("../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        data = environment.observation(clone=True)
+        num_features = data.x.size(1)
+        embedder = GraphEmbedder(num_features + 3, 8, static_topology=True)
+        states = data.x[None] * torch.rand(5, 1, num_features) * 10
+        embedder.fit(states)
+
+        # Reference: standardized and padded features through GCN layers normalizing at each call
+        x = (data.x - states.reshape(-1, num_features).mean(0)) / states.reshape(-1, num_features).std(0).where(states.reshape(-1, num_features).std(0) > 0, torch.ones(num_features))
+        x = torch.cat([x, torch.zeros(len(x), 3)], dim=1)
+        conv1, conv2 = GCNConv(num_features + 3, 16), GCNConv(16, 8)
+        conv1.load_state_dict(embedder.conv1.state_dict())
+        conv2.load_state_dict(embedder.conv2.state_dict())
+        expected = torch.relu(conv2(torch.relu(conv1(x, data.edge_index)), data.edge_index)).mean(dim=0, keepdim=True)
+
+        torch.testing.assert_close(embedder(data), expected, rtol=1e-4, atol=1e-5)
+        with torch.no_grad():
+            torch.testing.assert_close(embedder(data), expected, rtol=1e-4, atol=1e-5)
+            cached = embedder._normalized_edges[2]
+            embedder(data)
+            self.assertIs(embedder._normalized_edges[2], cached)
+
+        # Truncated features and a batch of graphs
+        narrow = GraphEmbedder(num_features - 1, 4, static_topology=True)
+        self.assertEqual(narrow(data).shape, (1, 4))
+        discounts = 0.9 ** np.arange(4)
+        buffer = EpisodeBuffer(3, 2, discounts, discounts, 0.9)
+        buffer.fill(VectorEnvironment(environment, num_envs=2), RandomPolicy(2), lambda states: torch.zeros(len(states)))
+        batch = buffer.collate(torch.arange(len(buffer)))
+        self.assertEqual(embedder(batch.states).shape, (len(buffer), 8))
+
+        # The fitted standardization is saved in static mode only, the default mode keeps the keys of its layers
+        restored = GraphEmbedder(num_features + 3, 8, static_topology=True)
+        restored.load_state_dict(embedder.state_dict())
+        torch.testing.assert_close(restored.feature_shift, embedder.feature_shift)
+        dynamic = GraphEmbedder(num_features + 3, 8)
+        self.assertFalse({"feature_scale", "feature_shift"} & set(dynamic.state_dict()))
+        dynamic.load_state_dict({name: value for name, value in embedder.state_dict().items() if not name.startswith("feature_")})
+
+    def test_actor_critic_step(self):
+        torch.manual_seed(0)
+        model = ActorCritic(5, 2, 8, 4, 7, 3, 1)
+        graph = Batch(x=torch.rand(6, 5), edge_index=torch.tensor([[0, 1, 3, 4], [1, 2, 4, 5]]), batch=torch.tensor([0, 0, 0, 1, 1, 1]))
+        sequence = torch.rand(2, 6, 5)
+        with torch.no_grad():
+            action_probs, state_value = model(graph, sequence)
+            state = None
+            for t in range(6):
+                step_probs, step_value, state = model.step(graph, sequence[:, t], state)
+            self.assertEqual(state[0].shape, (6, 2, 7))
+            torch.testing.assert_close(step_probs, action_probs)
+            torch.testing.assert_close(step_value, state_value)
+
+            # Truncated sequences resumed from a stored state, padded to a common length
+            middle = None
+            for t in range(2):
+                _, _, middle = model.step(graph, sequence[:, t], middle)
+            resumed_probs, resumed_value = model(graph, sequence[:, 2:], middle)
+            torch.testing.assert_close(resumed_probs, action_probs)
+            padded = torch.cat([sequence[:, 2:], torch.rand(2, 2, 5)], dim=1)
+            torch.testing.assert_close(model(graph, padded, middle, lengths=torch.tensor([4, 4]))[1], state_value)
+
+            reset = model.reset_state(state, np.array([True, False]))
+            self.assertTrue(torch.all(reset[0][:, 0] == 0) and torch.equal(reset[1][:, 1], state[1][:, 1]))
+
+    def test_shared_actor_critic(self):
+        environment = load_network_from_csv("../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        envs = VectorEnvironment(environment, num_envs=2)
+        discounts = 0.9 ** np.arange(6)
+        buffer = EpisodeBuffer(5, 4, discounts, discounts, 0.9)
+        torch.manual_seed(0)
+        model = ActorCritic(environment.observation().x.size(1), 2, 8, 2, 8, 3, 1, sequence_dim=0, edge_index=envs.edge_index)
+        buffer.fill(envs, model, None)
+
+        # Values of the rollout come from the same pass as the actions, the recurrent state carried along each episode
+        with torch.no_grad():
+            states = buffer.states_mem[:len(buffer)]
+            hidden = buffer.hidden_mem[:len(buffer)].permute(1, 2, 0, 3)
+            _, values, _ = model.step(model.graphs(states), states.new_zeros((len(states), 0)), (hidden[0].contiguous(), hidden[1].contiguous()))
+        torch.testing.assert_close(buffer.values_mem[:len(buffer)], values.squeeze(-1))
+
+        # Windows replayed from their stored state by get_predictions give the same values
+        batch = buffer.collate_sequences(torch.arange(len(buffer)), 3)
+        with torch.no_grad():
+            _, _, window_values = model.get_predictions(batch.states, batch.actions, batch.hidden, batch.lengths)
+        torch.testing.assert_close(window_values, buffer.values_mem[:len(buffer)])
+
+        # The first batch is evaluated on windows replayed from the stored recurrent state, the
+        # ratios are 1 before the first update, as is the KL divergence over the whole rollout
+        agent = PPOAgent(buffer, 1, 1, policy_model=model, value_model=None, policy_stopping_kl=float("inf"), value_stopping_mse=float("inf"),
+                         policy_sequence_length=3, policy_full_kl_every=1, policy_optimization_epochs=1)
+        agent.policy_optimizer = torch.optim.SGD(model.parameters(), lr=0.0)
+        batches, predictions = [], []
+        sample, get_predictions = buffer.sample, model.get_predictions
+        buffer.sample = lambda *args, **kwargs: (batches.append(batch) or batch for batch in sample(*args, **kwargs))
+        model.get_predictions = lambda *args: predictions.append(get_predictions(*args)) or predictions[-1]
+        try:
+            stats = agent.optimize_model()
+        finally:
+            del buffer.sample, model.get_predictions
+        self.assertTrue(torch.all(batches[0].lengths <= 3))
+        torch.testing.assert_close((predictions[0][0] - batches[0].logpas).exp(), torch.ones(len(batches[0].logpas)))
+        torch.testing.assert_close(predictions[-1][0], buffer.logpas_mem[:len(buffer)])
+        self.assertAlmostEqual(stats["kl"][0], 0.0, places=5)
+
+        # One embedding of the graphs of the windows per batch for both losses
+        agent = PPOAgent(buffer, 1, 1, policy_model=model, value_model=None, policy_stopping_kl=float("inf"), value_stopping_mse=float("inf"),
+                         policy_sequence_length=3)
+        agent.policy_optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+        embedded = []
+        embed_graph = model.embed_graph
+        model.embed_graph = lambda graph_data: embedded.append(graph_data.num_graphs) or embed_graph(graph_data)
+        critic = model.critic_head.weight.detach().clone()
+        agent.optimize_model()
+        self.assertEqual(embedded, [2 * 3] * 20)
+        self.assertFalse(torch.equal(critic, model.critic_head.weight))
+
+    def test_episode_buffer_recurrent_state(self):
+        environment = load_network_from_csv("../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        envs = VectorEnvironment(environment, num_envs=3)
+        discounts = 0.9 ** np.arange(7)
+        buffer = EpisodeBuffer(6, 6, discounts, discounts, 0.9)
+        torch.manual_seed(0)
+        policy = ActorCritic(environment.observation().x.size(1), 2, 8, 2, 6, 4, 1, sequence_dim=0, edge_index=envs.edge_index)
+        buffer.fill(envs, policy, mean_feature_value)
+        # (h, c) of the shared, actor and critic LSTMs
+        self.assertEqual(buffer.hidden_mem.shape[1:], (2, 3, 6))
+
+        # Episodes start from a zero state
+        starts = torch.from_numpy(buffer.episode_offsets[:buffer.n_episodes])
+        self.assertTrue(torch.all(buffer.hidden_mem[starts] == 0))
+
+        # Replaying a window from its stored state gives the state stored at the next step
+        idxs = torch.tensor([1, 4, 6, 10])
+        batch = buffer.collate_sequences(idxs, 3)
+        self.assertEqual(batch.lengths.tolist(), [2, 3, 1, 3])
+        self.assertEqual(batch.states.shape[:2], (4, 3))
+        with torch.no_grad():
+            for row, idx in enumerate(idxs.tolist()):
+                state = (batch.hidden[0][:, row:row + 1], batch.hidden[1][:, row:row + 1])
+                for t in range(batch.lengths[row]):
+                    _, _, state = policy.step(policy.graphs(batch.states[row, t][None]), torch.zeros(1, 0), state)
+                if idx + 1 not in buffer.episode_offsets:
+                    torch.testing.assert_close(state[0][:, 0], buffer.hidden_mem[idx + 1, 0])
+
+        batches = list(buffer.sample(4, sequence_length=3))
+        self.assertEqual(sum(len(batch.lengths) for batch in batches), len(buffer))
+
+    def test_inference_server(self):
+        torch.manual_seed(0)
+        edge_index = torch.tensor([[0, 1, 2, 3], [1, 2, 3, 0]])
+        model = ActorCritic(3, 2, 8, 2, 6, 4, 1, sequence_dim=2)
+        rng = np.random.default_rng(0)
+        x = rng.random((12, 4, 3), dtype=np.float32)
+        observations = rng.random((12, 2), dtype=np.float32)
+
+        server = InferenceServer(model, edge_index, max_batch_size=8, max_wait=0.05, greedy=True)
+        clients = [server.client() for _ in range(6)]
+        results = [None] * 6
+
+        def worker(i):
+            # Two environments per worker, two steps carrying the recurrent state
+            rows = slice(2 * i, 2 * i + 2)
+            first = clients[i].act(x[rows], observations[rows])
+            results[i] = (first, clients[i].act(x[rows], observations[rows], first[3]))
+
+        with server:
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(server.num_requests, 12)
+        self.assertLess(server.num_batches, 12)
+        # One batch topology built for max_batch_size, sliced for every batch size
+        self.assertEqual(list(server._graph_index), ["topology"])
+        self.assertEqual(server._graph_index["topology"][0], 8)
+
+        # Views of the cached topology are the topologies of the smaller batches
+        cache = {}
+        for num_graphs in (3, 5, 2):
+            features = torch.rand(num_graphs, 4, 3)
+            cached, built = batch_graphs(features, edge_index, cache), batch_graphs(features, edge_index)
+            for key in ("x", "edge_index", "batch", "ptr"):
+                self.assertTrue(torch.equal(cached[key], built[key]))
+        self.assertEqual(cache["topology"][0], 6)
+
+        with torch.no_grad():
+            graphs = Batch.from_data_list([Data(x=torch.from_numpy(features), edge_index=edge_index) for features in x])
+            actions, logpas, _, values, state = model.act(graphs, torch.from_numpy(observations), greedy=True)
+            second = model.act(graphs, torch.from_numpy(observations), state, greedy=True)
+        for i, (first, last) in enumerate(results):
+            rows = slice(2 * i, 2 * i + 2)
+            np.testing.assert_array_equal(first[0], actions[rows].numpy())
+            np.testing.assert_allclose(first[1], logpas[rows].numpy(), rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(first[2], values[rows].numpy(), rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(last[2], second[3][rows].numpy(), rtol=1e-5, atol=1e-6)
+            self.assertEqual(first[3][0].shape, (3, 2, 6))
+
+        # Errors of the forward are raised in the workers
+        with InferenceServer(model, edge_index) as server:
+            with self.assertRaises(RuntimeError):
+                server.client().act(np.zeros((4, 5), dtype=np.float32))
+
+    def test_export_policy(self):
+        torch.manual_seed(0)
+        environment = load_network_from_csv("../data/generated/nodes_example_1.csv", "../data/generated/arcs_example_1.csv", cache=False)
+        data = environment.observation(clone=True)
+        num_nodes, num_features = data.x.shape
+        model = ActorCritic(num_features, 2, 16, 4, 16, 5, 1, sequence_dim=3).eval()
+        x = torch.rand(4, num_nodes, num_features)
+        observation = torch.rand(4, 3)
+        _, _, state = model.step(batch_graphs(x, data.edge_index), observation)
+
+        for method in ("trace", "script"):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "policy.pt")
+                export_policy(model, data.edge_index, num_nodes, method=method, path=path)
+                exported = torch.jit.load(path)
+            differences = check_parity(model, exported, data.edge_index, x, observation, state)
+            self.assertEqual(set(differences), {"action_probs", "state_value", "h", "c"})
+            self.assertLess(max(differences.values()), 1e-5)
+
+        latencies = latency_percentiles(exported, example_inputs(model, num_nodes), num_threads=1, repeats=20, warmup=2)
+        self.assertEqual(list(latencies), ["p50", "p90", "p99"])
+        self.assertTrue(0 < latencies["p50"] <= latencies["p90"] <= latencies["p99"])
+        with self.assertRaises(ValueError):
+            export_policy(model, data.edge_index, num_nodes, method="onnx")
+
+    def test_prefetch(self):
+        self.assertEqual(list(prefetch(range(10), size=2)), list(range(10)))
+        for item in prefetch(iter(range(1000)), size=1):
+            if item == 3:
+                break
+
+        def failing():
+            yield 1
+            raise RuntimeError("collation failed")
+        with self.assertRaises(RuntimeError):
+            list(prefetch(failing()))
+
+
+if __name__ == "__main__":
+    unittest.main()
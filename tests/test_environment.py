@@ -2,10 +2,26 @@ import sys
 sys.path.append("../src/")
 sys.path.append("../src/environment/")
 
+import functools
+import os
+import tempfile
 import unittest
+import unittest.mock
+import numpy as np
 import pandas as pd
 import torch
-from environment import Environment, load_network_from_csv, Node, Vehicle, Arc
+from environment import Environment, load_network, load_network_from_csv, Node, Vehicle, Arc, NetworkCache, VectorEnvironment, SubprocessVectorEnvironment, Router
+from environment.environment import parse_list_column
+from update import DemandModel, DemandStream, additional_demand
+from reward import RewardCalculator, RewardTracker
+
+
+def sampled_network(node_file_path, arc_file_path):
+    # Example network with sampled demand, 4 arrivals per node on average at 2h
+    environment = load_network_from_csv(node_file_path, arc_file_path, cache=False)
+    environment.demand_model = DemandModel(sigma=0.1, sampled=True, seed=0)
+    environment.current_time = 1.5
+    return environment
 
 
 class TestEnvironment(unittest.TestCase):
@@ -15,13 +31,92 @@ class TestEnvironment(unittest.TestCase):
         # Setup for loading from CSV file paths
         self.node_file_path = "../data/generated/nodes_example_1.csv"
         self.arc_file_path = "../data/generated/arcs_example_1.csv"
-        self.environment = load_network_from_csv(self.node_file_path, self.arc_file_path)
+        # The on-disk cache is exercised by test_network_cache in a temporary directory only
+        self.environment = load_network_from_csv(self.node_file_path, self.arc_file_path, cache=False)
 
     def test_load_from_csv(self):
         # Check if nodes and arcs are loaded correctly
         self.assertEqual(len(self.environment.nodes), 18)  # As per the number of nodes in the CSV
         self.assertEqual(len(self.environment.arcs), 40)   # As per the number of arcs in the CSV
 
+    def test_parse_list_column(self):
+        df = pd.DataFrame({"coordinates": ["(1.5, -2.0)", "(3, 4)"], "service_hours": ["[6, 22]", "[]"]})
+        self.assertEqual(parse_list_column(df, "coordinates").tolist(), [[1.5, -2.0], [3.0, 4.0]])
+        self.assertEqual(parse_list_column(df, "service_hours").tolist(), [[6.0, 22.0], [0.0, 0.0]])
+        flat = pd.DataFrame({"node_type_1": [0, 1], "node_type_0": [1, 0]})
+        self.assertEqual(parse_list_column(flat, "node_type").tolist(), [[1.0, 0.0], [0.0, 1.0]])
+
+    def test_load_flat_parquet(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        df_nodes = pd.read_csv(self.node_file_path)
+        df_arcs = pd.read_csv(self.arc_file_path)
+        coordinates = parse_list_column(df_nodes, "coordinates")
+        df_nodes["coordinates_0"], df_nodes["coordinates_1"] = coordinates[:, 0], coordinates[:, 1]
+        df_nodes = df_nodes.drop(columns=["coordinates", "vehicles"])
+        df_arcs = df_arcs.drop(columns=["vehicles"])
+        with tempfile.TemporaryDirectory() as directory:
+            node_path = os.path.join(directory, "nodes.parquet")
+            arc_path = os.path.join(directory, "arcs.feather")
+            df_nodes.to_parquet(node_path)
+            df_arcs.to_feather(arc_path)
+            environment = load_network(node_path, arc_path)
+        self.assertTrue(torch.equal(environment.observation().x, self.environment.observation().x))
+        self.assertTrue(torch.equal(environment.observation().edge_attr, self.environment.observation().edge_attr))
+
+    def test_load_rejects_unknown_nodes(self):
+        df_arcs = pd.read_csv(self.arc_file_path)
+        df_arcs.loc[0, "target"] = 99
+        with tempfile.TemporaryDirectory() as directory:
+            arc_path = os.path.join(directory, "arcs.csv")
+            df_arcs.to_csv(arc_path, index=False)
+            with self.assertRaises(ValueError):
+                load_network(self.node_file_path, arc_path)
+
+    def test_network_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = NetworkCache(os.path.join(directory, "cache"))
+            first = load_network_from_csv(self.node_file_path, self.arc_file_path, cache=cache)
+            entries = os.listdir(cache.cache_dir)
+            self.assertEqual(len(entries), 1)
+            second = load_network_from_csv(self.node_file_path, self.arc_file_path, cache=cache)
+            self.assertTrue(torch.equal(first.observation().x, second.observation().x))
+            self.assertEqual(os.listdir(cache.cache_dir), entries)
+
+            # Truncated entries are dropped and rebuilt, the file is replaced since it is mapped by first
+            path = os.path.join(cache.cache_dir, entries[0])
+            with open(path, "rb") as f:
+                content = f.read()
+            for size in (5, 40, len(content) // 2):
+                os.remove(path)
+                with open(path, "wb") as f:
+                    f.write(content[:size])
+                rebuilt = load_network_from_csv(self.node_file_path, self.arc_file_path, cache=cache)
+                self.assertTrue(torch.equal(rebuilt.observation().x, first.observation().x))
+                self.assertEqual(os.path.getsize(path), len(content))
+
+            # Without an explicit cache, the cache is only used when its directory is configured
+            load_network_from_csv(self.node_file_path, self.arc_file_path)
+            self.assertEqual(os.listdir(cache.cache_dir), entries)
+            with unittest.mock.patch.dict(os.environ, {"TSC_NETWORK_CACHE_DIR": os.path.join(directory, "configured")}):
+                load_network_from_csv(self.node_file_path, self.arc_file_path)
+            self.assertEqual(len(os.listdir(os.path.join(directory, "configured"))), 1)
+
+            # Changing an input file gives a new entry
+            arc_path = os.path.join(directory, "arcs.csv")
+            df_arcs = pd.read_csv(self.arc_file_path)
+            df_arcs.loc[0, "open"] = 1 - df_arcs.loc[0, "open"]
+            df_arcs.to_csv(arc_path, index=False)
+            changed = load_network_from_csv(self.node_file_path, arc_path, cache=cache)
+            self.assertEqual(changed.get_arc(1)[0].open, df_arcs.loc[0, "open"])
+            self.assertEqual(len(os.listdir(cache.cache_dir)), 2)
+
+            cache.max_bytes = 0
+            cache.evict()
+            self.assertEqual(os.listdir(cache.cache_dir), [])
+
     def test_to_from_pyg_data(self):
         # Converting to PyTorch Geometric data format and back
         pyg_data, node_sizes_df, arc_sizes_df = self.environment.to_pyg_data()
@@ -33,6 +128,88 @@ class TestEnvironment(unittest.TestCase):
         self.assertEqual(len(self.environment.nodes), 18)
         self.assertEqual(len(self.environment.arcs), 40)
 
+    def test_from_pyg_data_round_trip(self):
+        pyg_data, node_sizes_df, arc_sizes_df = self.environment.to_pyg_data()
+        restored = Environment()
+        restored.from_pyg_data(pyg_data, node_sizes_df, arc_sizes_df)
+        restored_data, _, _ = restored.to_pyg_data()
+        self.assertTrue(torch.equal(restored_data.x, pyg_data.x))
+        self.assertTrue(torch.equal(restored_data.edge_index, pyg_data.edge_index))
+        self.assertTrue(torch.equal(restored_data.edge_attr, pyg_data.edge_attr))
+        arc, source, target = restored.get_arc(1)
+        original, original_source, original_target = self.environment.get_arc(1)
+        self.assertEqual((source, target), (original_source, original_target))
+        self.assertEqual((arc.source, arc.target), (original.source, original.target))
+        self.assertEqual(restored.get_node(5).capacity, self.environment.get_node(5).capacity)
+
+    def test_from_pyg_data_resets_fleet(self):
+        pyg_data, node_sizes_df, arc_sizes_df = self.environment.to_pyg_data()
+        environment, vehicle = self._line_network()
+        environment.advance([(1, 0, [1, 2, 3])], duration=1.0)
+        environment.from_pyg_data(pyg_data, node_sizes_df, arc_sizes_df)
+        self.assertEqual((len(environment.vehicles), len(environment.fleet)), (0, 0))
+        self.assertEqual(environment.get_arc(1)[0].vehicles, [])
+        self.assertEqual(environment.simulator.queue, [])
+        self.assertEqual(environment.adjacency.degrees().sum(), 40)
+        self.assertEqual(environment.router.distances(1).shape, (18,))
+        environment.advance([], duration=1.0)
+        self.assertEqual(environment.current_time, 2.0)
+
+    def test_to_pyg_data_layout(self):
+        pyg_data, node_sizes_df, arc_sizes_df = self.environment.to_pyg_data()
+        node = self.environment.get_node(1)
+        expected = torch.cat([
+            node.node_type, node.coordinates, torch.tensor([node.capacity, node.staff], dtype=torch.float),
+            node.service_hours, torch.tensor([node.demand], dtype=torch.float)
+        ])
+        self.assertTrue(torch.equal(pyg_data.x[0], expected))
+        self.assertEqual(tuple(pyg_data.edge_attr.shape), (40, 12))
+        self.assertEqual(list(node_sizes_df.iloc[0]), [1, 4, 2, 1, 1, 2, 1])
+        self.assertEqual(list(arc_sizes_df.columns)[0], "arc_id")
+
+    def test_observation_is_incremental(self):
+        data = self.environment.observation()
+        x_before = data.x.clone()
+        node = self.environment.get_node(2)
+        node.demand = node.demand + 10
+        arc, _, _ = self.environment.get_arc(2)
+        arc.open = 1 - arc.open
+        new_data = self.environment.observation()
+        self.assertIs(new_data, data)
+        row = self.environment.node_table.row(2)
+        self.assertEqual(new_data.x[row, -1].item(), x_before[row, -1].item() + 10)
+        self.assertEqual(new_data.edge_attr[self.environment.arc_table.row(2), -1].item(), arc.open)
+        clone = self.environment.observation(clone=True)
+        self.assertIsNot(clone.x, data.x)
+        self.assertTrue(torch.equal(clone.x, data.x))
+
+    def test_snapshot_round_trip(self):
+        vehicle = Vehicle(id=7, in_service=1, type=torch.tensor([1.0, 0.0, 0.0, 0.0]), is_node=1, location_id=3,
+                          start=0, capacity=40, capacity_left=25, service_hours=torch.tensor([6.0, 22.0]), circuit=[3, 5, 8])
+        self.environment.add_vehicle(vehicle)
+        self.environment.current_time = 5
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "network.snap")
+            self.environment.save_snapshot(path)
+            restored = Environment.load_snapshot(path)
+            self.assertEqual(restored.current_time, 5)
+            self.assertEqual(list(restored.nodes), list(self.environment.nodes))
+            self.assertTrue(torch.equal(restored.observation().x, self.environment.observation().x))
+            self.assertTrue(torch.equal(restored.observation().edge_index, self.environment.observation().edge_index))
+            self.assertEqual(restored.get_arc(4)[1:], self.environment.get_arc(4)[1:])
+            restored_vehicle = restored.vehicles[7]
+            self.assertEqual(restored_vehicle.circuit, [3, 5, 8])
+            self.assertIn(restored_vehicle, restored.get_node(3).vehicles)
+            # Copy-on-write mapping: modifying the restored network does not touch the file
+            restored.get_node(1).demand = 0
+            self.assertNotEqual(Environment.load_snapshot(path).get_node(1).demand, 0)
+            del restored
+            read_only = Environment.load_snapshot(path, mode="r")
+            self.assertEqual(read_only.get_node(1).demand, self.environment.get_node(1).demand)
+            with self.assertRaises(ValueError):
+                read_only.advance([])
+            del read_only
+
     def test_get_state(self):
         state = self.environment.get_state()
         self.assertTrue("nodes" in state)
@@ -97,6 +274,438 @@ class TestEnvironment(unittest.TestCase):
         self.environment.update_demand(node)
         #  self.assertNotEqual(node.demand, initial_demand)  # Assuming the demand changes
 
+    def test_node_view_writes_through_table(self):
+        node = self.environment.get_node(3)
+        row = self.environment.node_table.row(3)
+        node.demand = 42
+        self.assertEqual(self.environment.node_table["demand"][row], 42)
+        self.environment.node_table["demand"][row] = 7
+        self.assertEqual(node.demand, 7)
+        self.assertEqual(node.node_type.tolist(), [0.0, 0.0, 1.0, 0.0])
+
+    def test_arc_table_rows(self):
+        arc, source, target = self.environment.get_arc(1)
+        row = self.environment.arc_table.row(1)
+        self.assertEqual(self.environment.arc_table["source_row"][row], self.environment.node_table.row(source))
+        self.assertEqual(self.environment.arc_table["target_row"][row], self.environment.node_table.row(target))
+        arc.open = 1
+        self.assertEqual(self.environment.arc_table["open"][row], 1)
+        with self.assertRaises(AttributeError):
+            arc.target = source
+        self.assertEqual(arc.target, target)
+
+    def test_calculate_reward_matches_nodes(self):
+        demands = [node.demand for node in self.environment.nodes.values()]
+        expected = -(sum(demands) + 0.1 * np.std(demands))
+        self.assertAlmostEqual(self.environment.calculate_reward(), expected)
+
+    def test_vector_environment_step(self):
+        envs = VectorEnvironment(self.environment, num_envs=3, max_episode_steps=2)
+        states = envs.reset()
+        self.assertEqual(states.shape, (3, 18, self.environment.observation().x.shape[1]))
+        next_states, rewards, terminals, infos = envs.step(np.zeros(3))
+        self.environment.step([])
+        self.assertTrue(np.allclose(rewards, self.environment.calculate_reward()))
+        self.assertTrue(np.array_equal(next_states[1], self.environment.observation().x.numpy()))
+        self.assertFalse(terminals.any())
+        _, _, terminals, infos = envs.step(np.zeros(3))
+        self.assertTrue(terminals.all())
+        self.assertTrue(infos[0]["TimeLimit.truncated"])
+        reset_states = envs.reset(ranks=[0, 2])
+        self.assertTrue(np.array_equal(envs.demand[0], envs.initial_demand))
+        self.assertEqual(envs.episode_steps.tolist(), [0, 2, 0])
+        self.assertEqual(reset_states.shape[0], 2)
+        graph = envs.get_graph(1)
+        self.assertTrue(torch.equal(graph.edge_index, self.environment.observation().edge_index))
+
+    def test_vector_environment_moves_vehicles(self):
+        # Copy 0 follows Environment.advance hour by hour, through waits at a closed node
+        for service_hours, departure in ((((0, 24), (0, 24), (0, 24)), 0.5), (((6, 22), (0, 24), (0, 24)), 0)):
+            environment, vehicle = self._line_network(service_hours)
+            envs = VectorEnvironment(environment, num_envs=2)
+            envs.reset()
+            schedules = [[(1, departure, [1, 2, 3])], []]
+            for _ in range(9):
+                _, rewards, _, _ = envs.step([schedules[0], []])
+                reward, _ = environment.advance(schedules[0], duration=1.0)
+                schedules[0] = []
+                is_node, location_ids = envs.locations()
+                self.assertEqual((is_node[0, 0], location_ids[0, 0]), (vehicle.is_node, vehicle.location_id))
+                self.assertAlmostEqual(envs.progress[0, 0], vehicle.progress)
+                self.assertEqual(envs.circuit(0, 1), vehicle.circuit)
+                self.assertEqual((is_node[1, 0], location_ids[1, 0]), (1, 1))
+                self.assertAlmostEqual(rewards[0], reward)
+                self.assertEqual(envs.current_time[0], environment.current_time)
+            self.assertEqual(envs.current_time.dtype, np.float64)
+            self.assertEqual((vehicle.is_node, vehicle.location_id), (1, 3))
+
+        # Trips in progress in the template go on in every copy
+        environment, vehicle = self._line_network()
+        environment.advance([(1, 0, [1, 2, 3])], duration=0.75)
+        envs = VectorEnvironment(environment, num_envs=2)
+        for _ in range(2):
+            envs.step([[], []])
+            environment.advance([], duration=1.0)
+            is_node, location_ids = envs.locations()
+            self.assertEqual(location_ids[:, 0].tolist(), [vehicle.location_id] * 2)
+            self.assertTrue(np.allclose(envs.progress[:, 0], vehicle.progress))
+        with self.assertRaises(ValueError):
+            envs.step([[], [(1, 0, [1, 2])]])
+
+    def test_vector_environment_closed_arcs(self):
+        environment, _ = self._line_network()
+        envs = VectorEnvironment(environment, num_envs=2)
+        envs.reset()
+        envs.set_arc_open(1, 1, 0)
+        envs.step([[(1, 0, [1, 2])], [(1, 0, [1, 2])]])
+        is_node, location_ids = envs.locations()
+        self.assertEqual(is_node[:, 0].tolist(), [1, 1])
+        self.assertEqual(location_ids[:, 0].tolist(), [2, 1])
+        # The departure is retried every hour, it leaves at the first retry after the arc opens
+        envs.set_arc_open(1, 1, 1)
+        envs.step([[], []])
+        is_node, location_ids = envs.locations()
+        self.assertEqual((is_node[1, 0], location_ids[1, 0], envs.progress[1, 0]), (0, 1, 0.0))
+        envs.reset()
+        self.assertEqual(envs.open[1].tolist(), [1, 1])
+        self.assertEqual(envs.locations()[1][:, 0].tolist(), [1, 1])
+
+    def test_vector_environment_auto_reset(self):
+        envs = VectorEnvironment(self.environment, num_envs=2, max_episode_steps=1, auto_reset=True)
+        initial_states = envs.reset()
+        states, _, terminals, infos = envs.step(np.zeros(2))
+        self.assertTrue(terminals.all())
+        self.assertTrue(np.array_equal(states, initial_states))
+        self.assertIn("final_observation", infos[0])
+
+    def test_subprocess_vector_environment(self):
+        env_fn = functools.partial(load_network_from_csv, self.node_file_path, self.arc_file_path, cache=False)
+        envs = SubprocessVectorEnvironment(env_fn, num_envs=4, envs_per_worker=2, max_episode_steps=2, start_method="fork")
+        try:
+            states = envs.reset()
+            self.assertTrue(np.array_equal(states[3], self.environment.observation().x.numpy()))
+            envs.step_async([[]] * 4)
+            next_states, rewards, terminals, infos = envs.step_wait()
+            reward, _ = self.environment.advance([])
+            self.assertTrue(np.allclose(rewards, reward))
+            self.assertTrue(np.array_equal(next_states[0], self.environment.observation().x.numpy()))
+            self.assertFalse(terminals.any())
+            _, _, terminals, infos = envs.step([[]] * 4)
+            self.assertTrue(terminals.all())
+            self.assertTrue(infos[2]["TimeLimit.truncated"])
+            self.assertEqual(envs.reset(ranks=[1, 2]).shape, (2,) + envs.observation_shape)
+            self.assertTrue(torch.equal(envs.edge_index, self.environment.observation().edge_index))
+            # Errors of a worker are raised in the parent, the workers go on serving commands
+            with self.assertRaises(KeyError):
+                envs.step([[], [], [(-1, 0, [1, 2])], []])
+            self.assertEqual(envs.step(np.zeros(4, dtype=np.int64))[0].shape, (4,) + envs.observation_shape)
+        finally:
+            envs.close()
+        with self.assertRaises(FileNotFoundError):
+            SubprocessVectorEnvironment(functools.partial(load_network_from_csv, "missing.csv", self.arc_file_path, cache=False),
+                                        num_envs=2, start_method="fork")
+
+    def test_checkpoint_restore(self):
+        checkpoint = self.environment.checkpoint()
+        node = self.environment.get_node(1)
+        demand = node.demand
+        node.demand = demand + 5
+        self.environment.current_time = 3
+        self.environment.restore(checkpoint)
+        self.assertEqual(node.demand, demand)
+        self.assertEqual(self.environment.current_time, 0)
+        self.assertEqual(self.environment.observation().x[0, -1].item(), demand)
+
+    def _line_network(self, service_hours=((0, 24), (0, 24), (0, 24))):
+        # 1 -> 2 -> 3 with travel times of 30 and 60 minutes
+        environment = Environment()
+        environment.add_nodes([1, 2, 3], {
+            "node_type": np.eye(4)[:3], "coordinates": np.zeros((3, 2)), "capacity": [10, 10, 10],
+            "staff": [1, 1, 1], "service_hours": np.array(service_hours), "demand": [0, 0, 0]
+        })
+        environment.add_arcs([1, 2], [1, 2], [2, 3], {
+            "arc_type": np.eye(5)[:2], "length": [10.0, 20.0], "travel_time": [30.0, 60.0], "capacity": [5, 5],
+            "traffic_condition": [2, 2], "safety": [5, 5], "usage_cost": [1.0, 1.0], "open": [1, 1]
+        })
+        vehicle = Vehicle(id=1, in_service=1, type=torch.tensor([1.0, 0.0, 0.0, 0.0]), is_node=1, location_id=1,
+                          start=0, capacity=10, capacity_left=10, service_hours=torch.tensor([0.0, 24.0]), circuit=[])
+        environment.add_vehicle(vehicle)
+        return environment, vehicle
+
+    def test_simulator_trip(self):
+        environment, vehicle = self._line_network()
+        environment.advance([(1, 0.5, [1, 2, 3])])
+        self.assertEqual(environment.current_time, 0.5)
+        self.assertEqual((vehicle.is_node, vehicle.location_id), (0, 1))
+        self.assertIn(vehicle, environment.get_arc(1)[0].vehicles)
+        self.assertNotIn(vehicle, environment.get_node(1).vehicles)
+        # Time jumps to the end of the first arc, then to the end of the second one
+        environment.advance([])
+        self.assertEqual(environment.current_time, 1.0)
+        self.assertEqual((vehicle.is_node, vehicle.location_id), (0, 2))
+        environment.advance([])
+        self.assertEqual(environment.current_time, 2.0)
+        self.assertEqual((vehicle.is_node, vehicle.location_id, vehicle.circuit), (1, 3, [3]))
+        self.assertIn(vehicle, environment.get_node(3).vehicles)
+
+    def test_simulator_service_hours_and_closed_arcs(self):
+        environment, vehicle = self._line_network(service_hours=((6, 22), (0, 24), (0, 24)))
+        environment.get_arc(1)[0].open = 0
+        environment.advance([(1, 0, [1, 2])])
+        # Node 1 opens at 6, the departure waits for it
+        self.assertEqual(environment.current_time, 6)
+        self.assertEqual(vehicle.is_node, 1)
+        # The arc is closed, the departure is retried every hour until it opens
+        environment.advance([], duration=2)
+        self.assertEqual(vehicle.is_node, 1)
+        environment.get_arc(1)[0].open = 1
+        environment.advance([], duration=1)
+        self.assertEqual((vehicle.is_node, vehicle.location_id), (0, 1))
+        with self.assertRaises(ValueError):
+            environment.apply_event((1, 0, [2, 3]))
+
+    def test_simulator_overnight_service_hours(self):
+        # Node 1 is open from 22 to 6, a departure at midnight leaves at once
+        environment, vehicle = self._line_network(service_hours=((22, 6), (0, 24), (0, 24)))
+        environment.advance([(1, 0, [1, 2])], duration=0.25)
+        self.assertEqual((vehicle.is_node, vehicle.location_id), (0, 1))
+        # A departure after closing waits for the evening opening
+        environment, vehicle = self._line_network(service_hours=((22, 6), (0, 24), (0, 24)))
+        envs = VectorEnvironment(environment, num_envs=1)
+        environment.advance([(1, 7, [1, 2])], duration=21.75)
+        self.assertEqual(vehicle.is_node, 1)
+        environment.advance([], duration=0.5)
+        self.assertEqual((vehicle.is_node, vehicle.location_id), (0, 1))
+        # Same wait in the vectorized copies
+        envs.step([[(1, 7, [1, 2])]])
+        for _ in range(21):
+            self.assertEqual(envs.locations()[0][0, 0], 1)
+            envs.step([[]])
+        self.assertEqual((envs.locations()[0][0, 0], envs.locations()[1][0, 0]), (0, 1))
+        envs.step([[]])
+        self.assertEqual(envs.locations()[1][0, 0], 2)
+
+    def test_adjacency_index(self):
+        adjacency = self.environment.adjacency
+        arc_table = self.environment.arc_table
+        sources, targets = arc_table["source_row"], arc_table["target_row"]
+        for row in range(len(self.environment.nodes)):
+            self.assertEqual(adjacency.out_arcs(row).tolist(), np.flatnonzero(sources == row).tolist())
+            self.assertEqual(adjacency.predecessors(row).tolist(), sources[targets == row].tolist())
+        self.assertEqual(adjacency.indptr[-1], len(arc_table))
+        # Arcs added one at a time are visible before the next rebuild
+        arc = Arc(arc_id=100, arc_type=torch.tensor([1.0, 0.0, 0.0, 0.0, 0.0]), length=1.0, travel_time=1.0, capacity=1,
+                  traffic_condition=2, safety=5, usage_cost=1.0, open=1, source=1, target=2, vehicles=[])
+        self.environment.add_arc(arc, 1, 2)
+        row = arc_table.row(100)
+        self.assertIn(row, adjacency.out_arcs(self.environment.node_table.row(1)).tolist())
+        self.assertIn(row, adjacency.in_arcs(self.environment.node_table.row(2)).tolist())
+        self.assertIn(100, self.environment.simulator.arcs_between(1, 2))
+        indptr, indices, arc_rows = adjacency.csr(reverse=True)
+        self.assertEqual(sorted(arc_rows.tolist()), list(range(len(arc_table))))
+        self.assertTrue(np.array_equal(indices, arc_table["source_row"][arc_rows]))
+
+    def test_router(self):
+        environment, _ = self._line_network()
+        router = environment.router
+        self.assertEqual(router.path(1, 3), [1, 2, 3])
+        self.assertEqual(router.cost(1, 3), 90.0)
+        self.assertIsNone(router.path(3, 1))
+        environment.add_arc(Arc(arc_id=3, arc_type=torch.tensor([1.0, 0.0, 0.0, 0.0, 0.0]), length=1.0, travel_time=100.0, capacity=1,
+                                traffic_condition=2, safety=5, usage_cost=5.0, open=1, source=1, target=3, vehicles=[]), 1, 3)
+        self.assertEqual(router.cost(1, 3), 90.0)
+        self.assertEqual(router.path(1, 3, metric="usage_cost"), [1, 2, 3])
+        router.distances(3)
+        # Only the trees going through the slower arc are dropped
+        environment.get_arc(2)[0].travel_time = 200.0
+        self.assertEqual(router.cost(1, 3), 100.0)
+        self.assertIn((environment.node_table.row(3), "travel_time"), router._trees)
+        self.assertEqual(router.path(1, 3), [1, 3])
+        environment.get_arc(3)[0].open = 0
+        self.assertEqual(router.distance_matrix([1, 2], [3]).tolist(), [[230.0], [200.0]])
+
+    def test_router_repair(self):
+        rng = np.random.default_rng(0)
+        environment = Environment()
+        environment.add_nodes(np.arange(60), {"service_hours": np.zeros((60, 2))})
+        num_arcs = 300
+        environment.add_arcs(np.arange(num_arcs), rng.integers(0, 60, num_arcs), rng.integers(0, 60, num_arcs), {
+            "travel_time": rng.uniform(1, 10, num_arcs), "open": rng.integers(0, 2, num_arcs)
+        })
+        router = environment.router
+        sources = np.arange(0, 60, 6)
+        router.trees(sources)
+        arc_table = environment.arc_table
+        for _ in range(20):
+            changed = rng.choice(num_arcs, 5, replace=False)
+            arc_table["open"][changed] = rng.integers(0, 2, 5)
+            arc_table["travel_time"][changed] = rng.uniform(1, 10, 5)
+            arc_table.mark_dirty("open")
+            arc_table.mark_dirty("travel_time")
+            distances, predecessors = router.trees(sources)
+            expected = Router(environment).trees(sources)[0]
+            self.assertTrue(np.allclose(distances, expected))
+            # Predecessors give routes of the repaired cost
+            weights = np.where(arc_table["open"] != 0, arc_table["travel_time"], np.inf)
+            for source, row in enumerate(sources):
+                for node in np.flatnonzero(np.isfinite(distances[source]) & (np.arange(60) != row)):
+                    between = (arc_table["source_row"] == predecessors[source, node]) & (arc_table["target_row"] == node)
+                    self.assertAlmostEqual(distances[source, predecessors[source, node]] + weights[between].min(), distances[source, node])
+
+    def test_router_changes(self):
+        environment, vehicle = self._line_network()
+        environment.advance([(1, 5, [1, 2, 3])])
+        router = environment.router
+        router.distances(1)
+        router.distances(3)
+        self.assertEqual(router.pop_changes(), {"routes": {}, "circuits": []})
+        environment.get_arc(2)[0].open = 0
+        changes = router.pop_changes()
+        self.assertEqual(changes["routes"], {1: [3]})
+        self.assertEqual(changes["circuits"], [1])
+        self.assertEqual(router.cost(1, 3), float("inf"))
+        self.assertEqual(router.pop_changes()["circuits"], [])
+
+    def test_fleet_relocation(self):
+        environment, vehicle = self._line_network()
+        self.assertIs(environment.vehicles[1], vehicle)
+        self.assertEqual(environment.get_node(1).vehicles, [vehicle])
+        environment.get_arc(1)[0].add_vehicle(vehicle)
+        self.assertEqual((vehicle.is_node, vehicle.location_id), (0, 1))
+        self.assertEqual(environment.get_node(1).vehicles, [])
+        environment.get_arc(1)[0].remove_vehicle(vehicle.id)
+        self.assertEqual(environment.get_arc(1)[0].vehicles, [])
+        # Replaced circuits are compacted when the flat circuit array is full
+        for length in range(2, 40):
+            vehicle.circuit = list(range(length))
+        self.assertEqual(vehicle.circuit, list(range(39)))
+        self.assertLessEqual(environment.fleet.circuits_size, 2 * 39)
+
+    def test_simulator_progress_and_snapshot_resume(self):
+        environment, vehicle = self._line_network()
+        environment.advance([(1, 0, [1, 2, 3])], duration=1.0)
+        # Half way through the 60 minutes of arc 2
+        self.assertEqual((vehicle.is_node, vehicle.location_id), (0, 2))
+        self.assertAlmostEqual(vehicle.progress, 0.5)
+        checkpoint = environment.checkpoint()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "network.snap")
+            environment.episode_id = 7
+            environment.save_snapshot(path)
+            restored = Environment.load_snapshot(path)
+            self.assertEqual(restored.episode_id, 7)
+            restored.advance([])
+            self.assertEqual(restored.current_time, 1.5)
+            self.assertEqual((restored.vehicles[1].location_id, restored.vehicles[1].circuit), (3, [3]))
+            del restored
+        environment.advance([])
+        self.assertEqual(vehicle.location_id, 3)
+        environment.restore(checkpoint)
+        self.assertEqual((vehicle.is_node, vehicle.location_id, vehicle.circuit), (0, 2, [2, 3]))
+
+    def test_snapshot_after_step(self):
+        # Without trips, a step lasts one hour whatever the service hours of the nodes
+        self.environment.step([])
+        self.environment.step([])
+        self.assertEqual(self.environment.current_time, 2.0)
+        self.assertIs(type(self.environment.current_time), float)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "network.snap")
+            self.environment.save_snapshot(path)
+            restored = Environment.load_snapshot(path)
+            self.assertEqual(restored.current_time, 2.0)
+            self.assertTrue(np.array_equal(restored.node_table["demand"], self.environment.node_table["demand"]))
+            del restored
+
+    def test_demand_model(self):
+        model = DemandModel()
+        self.assertEqual(model.arrivals(np.arange(24), 1)[:, 0].tolist(), [additional_demand(hour) for hour in range(24)])
+        # Peaked profile: 4 arrivals at 2h, repeated every day
+        model = DemandModel(sigma=0.1)
+        self.assertEqual(model.arrivals(2, 3).tolist(), [4, 4, 4])
+        self.assertEqual(model.arrivals(26, 3).tolist(), [4, 4, 4])
+        per_node = DemandModel(profile=np.stack([np.full(24, 2.0), np.full(24, 5.0)]), sigma=0.1)
+        self.assertEqual(per_node.arrivals([2, 5], 2).tolist(), [[4, 0], [0, 4]])
+        with self.assertRaises(ValueError):
+            per_node.arrivals(2, 3)
+        sampled = DemandModel(sigma=0.1, sampled=True, seed=0)
+        self.assertEqual(sampled.arrivals(np.full(1000, 2), 2, env=np.arange(1000)).shape, (1000, 2))
+        self.assertAlmostEqual(sampled.arrivals(np.full(1000, 2), 2, env=np.arange(1000)).mean(), model.rates[2, 0], delta=0.3)
+
+        environment, _ = self._line_network()
+        environment.demand_model = model
+        environment.current_time = 26
+        environment.update_state()
+        self.assertEqual(environment.node_table["demand"].tolist(), [4, 4, 4])
+        self.assertEqual(environment.observation().x[:, -1].tolist(), [4.0, 4.0, 4.0])
+
+    def test_episode_demand_streams(self):
+        environment = sampled_network(self.node_file_path, self.arc_file_path)
+        environment.episode_id = 5
+        demand = environment.node_table["demand"].copy()
+        environment.advance([])
+        expected = demand + environment.demand_model.arrivals(2, len(demand), env=5)
+        self.assertEqual(environment.node_table["demand"].tolist(), expected.tolist())
+
+        # Workers give every environment and every episode its own stream
+        env_fn = functools.partial(sampled_network, self.node_file_path, self.arc_file_path)
+        envs = SubprocessVectorEnvironment(env_fn, num_envs=3, envs_per_worker=2, start_method="fork")
+        try:
+            for episode in range(2):
+                envs.reset()
+                states, _, _, _ = envs.step(np.zeros(3, dtype=np.int64))
+                for rank in range(3):
+                    environment = env_fn()
+                    environment.episode_id = rank + 3 * (episode + 1)
+                    environment.advance([])
+                    self.assertTrue(np.array_equal(states[rank], environment.observation().x.numpy()))
+                self.assertFalse(np.array_equal(states[0], states[1]))
+        finally:
+            envs.close()
+
+    def test_demand_stream(self):
+        stream = DemandStream(seed=3)
+        rates = np.array([0.5, 4.0, 80.0])
+        timeline = stream.poisson(rates, np.zeros(48, dtype=np.int64), np.arange(48))
+        # Any slice is regenerated on its own, by any stream with the same seed
+        self.assertTrue(np.array_equal(DemandStream(seed=3).poisson(rates, 0, 30), timeline[30]))
+        self.assertTrue(np.array_equal(stream.poisson(rates[:2], [0, 0], [40, 41]), timeline[40:42, :2]))
+        self.assertFalse(np.array_equal(stream.poisson(rates, 1, np.arange(48)), timeline))
+        self.assertFalse(np.array_equal(DemandStream(seed=4).poisson(rates, 0, np.arange(48)), timeline))
+        samples = stream.poisson(np.full(2000, 4.0), np.arange(5)[:, None], 0)
+        self.assertAlmostEqual(samples.mean(), 4.0, delta=0.15)
+        self.assertAlmostEqual(samples.var(), 4.0, delta=0.4)
+        gaussian = stream.gaussian(np.full(2000, 100.0), 0, 0)
+        self.assertAlmostEqual(gaussian.mean(), 100.0, delta=1.0)
+        self.assertAlmostEqual(gaussian.std(), 10.0, delta=1.0)
+
+    def test_reward_tracker(self):
+        def expected():
+            demands = self.environment.node_table["demand"]
+            return -(demands.sum() + 0.1 * np.std(demands))
+
+        self.assertAlmostEqual(self.environment.calculate_reward(), expected())
+        tracker = self.environment.reward_tracker
+        # Writes through node views and update_demand keep the tracker in sync without a reset
+        self.environment.get_node(4).demand = 1000
+        self.environment.demand_model = DemandModel(sigma=0.1)
+        self.environment.current_time = 2
+        self.environment.update_demand()
+        self.assertEqual(tracker.version, self.environment.node_table.versions["demand"])
+        self.assertAlmostEqual(self.environment.calculate_reward(), expected())
+        # Untracked bulk writes are caught by the column version
+        self.environment.node_table["demand"][:] = 3
+        self.environment.node_table.mark_dirty("demand")
+        self.assertAlmostEqual(self.environment.calculate_reward(), expected())
+
+        calculator = RewardCalculator()
+        demands = np.array([[10, 20, 30], [0, 0, 0], [5, 5, 50]])
+        self.assertTrue(np.allclose(calculator.calculate_batch_reward(demands), [calculator.calculate_reward(d) for d in demands]))
+        tracker = RewardTracker(demands[0])
+        tracker.update(demands[0][1:], demands[2][1:])
+        tracker.update(demands[0][0], demands[2][0])
+        self.assertAlmostEqual(calculator.reward_from_stats(tracker.mean, tracker.std), calculator.calculate_reward(demands[2]))
+
     def test_repr(self):
         repr_str = repr(self.environment)
         self.assertIsInstance(repr_str, str)